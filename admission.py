@@ -0,0 +1,264 @@
+"""
+Admission control, backpressure and deadlines for the prediction endpoints
+At most max_in_flight requests are processed at once; up to max_queue more wait in priority
+lanes (urgent, normal, bulk) and are admitted highest lane first, FIFO within a lane. Anything
+beyond that is refused straight away with 429 and a Retry-After estimated from recent service
+times, instead of piling up in gunicorn until it times out. Each request carries a deadline
+(the client's X-Deadline-Ms, capped by REQUEST_DEADLINE_MS) that is checked before decoding
+and before inference, so work for a client that has already given up is skipped; a request
+that cannot be admitted before its deadline gets 503.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from deadlines import Deadline, DeadlineExceeded  # noqa: F401 - part of this module's interface
+
+PRIORITIES = ('urgent', 'normal', 'bulk')
+DEFAULT_PRIORITY = 'normal'
+
+
+class Overloaded(Exception):
+    """The request was shed: 429 when the queue is full, 503 when it could not be served in time"""
+
+    def __init__(self, message, status=429, retry_after=1):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = max(1, int(round(retry_after)))
+
+
+def parse_priority(value):
+    """Validated priority lane for an X-Priority header / ?priority= value"""
+    if not value:
+        return DEFAULT_PRIORITY
+    value = value.strip().lower()
+    if value not in PRIORITIES:
+        raise ValueError(f"Unknown priority '{value}'. Expected one of: {', '.join(PRIORITIES)}")
+    return value
+
+
+def parse_deadline(value, default_ms):
+    """Deadline from an X-Deadline-Ms header, never later than default_ms (0/None: no default)"""
+    limit = float(default_ms) / 1000.0 if default_ms else None
+    if value in (None, ''):
+        return Deadline(limit)
+    try:
+        seconds = float(value) / 1000.0
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid X-Deadline-Ms '{value}'")
+    if seconds <= 0:
+        raise ValueError(f"Invalid X-Deadline-Ms '{value}'")
+    return Deadline(seconds if limit is None else min(seconds, limit))
+
+
+class _Waiter:
+    __slots__ = ('priority', 'event', 'granted', 'evicted', 'on_wake')
+
+    def __init__(self, priority, on_wake=None):
+        self.priority = priority
+        self.event = threading.Event()
+        self.granted = False
+        self.evicted = False
+        self.on_wake = on_wake  # called (from the releasing thread) when granted or evicted
+
+    def wake(self):
+        self.event.set()
+        if self.on_wake is not None:
+            self.on_wake()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Ticket:
+    """An admitted request; use as a context manager so the slot is always released"""
+
+    def __init__(self, controller, priority, deadline):
+        self.controller = controller
+        self.priority = priority
+        self.deadline = deadline
+        self.admitted_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(time.monotonic() - self.admitted_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class AdmissionController:
+    """Bounded in-flight requests with a bounded, prioritised wait queue
+
+    bulk_queue caps how much of the queue bulk jobs may hold, so urgent and normal requests
+    always find room; when the queue is full an urgent request evicts the newest bulk waiter.
+    max_in_flight=0 turns admission control off (every request is admitted at once).
+    """
+
+    def __init__(self, max_in_flight=8, max_queue=32, bulk_queue=None, default_deadline_ms=None,
+                 initial_service_seconds=0.1):
+        self.max_in_flight = int(max_in_flight)
+        self.default_deadline_ms = default_deadline_ms
+        self.max_queue = int(max_queue)
+        self.bulk_queue = self.max_queue // 2 if bulk_queue is None else int(bulk_queue)
+        self._lock = threading.Lock()
+        self._lanes = {priority: deque() for priority in PRIORITIES}
+        self._in_flight = 0
+        self._service_seconds = initial_service_seconds  # moving average, for Retry-After
+        self.admitted = {priority: 0 for priority in PRIORITIES}
+        self.shed = {'queue_full': 0, 'deadline': 0, 'evicted': 0}
+
+    @property
+    def enabled(self):
+        return self.max_in_flight > 0
+
+    def _queued(self):
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def retry_after(self):
+        """Seconds until the current backlog should have drained"""
+        backlog = self._queued() + self._in_flight
+        return backlog * self._service_seconds / max(self.max_in_flight, 1)
+
+    def _expected_wait(self, priority):
+        ahead = sum(len(self._lanes[p]) for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+        return (ahead + 1) * self._service_seconds / max(self.max_in_flight, 1)
+
+    def deadline(self, header_value=None):
+        """The Deadline for a request from its X-Deadline-Ms header (ValueError if malformed)"""
+        return parse_deadline(header_value, self.default_deadline_ms)
+
+    def admit(self, priority=DEFAULT_PRIORITY, deadline=None):
+        """Return a Ticket once a slot is free; raises Overloaded when the request is shed"""
+        deadline = deadline or Deadline()
+        ticket, waiter = self._enter(priority, deadline)
+        if ticket is not None:
+            return ticket
+        waiter.event.wait(deadline.remaining())
+        return self._settle(waiter, deadline)
+
+    async def admit_async(self, priority=DEFAULT_PRIORITY, deadline=None):
+        """admit() for asyncio servers: queued requests wait on the event loop, not in a thread"""
+        import asyncio
+        deadline = deadline or Deadline()
+        loop = asyncio.get_running_loop()
+        woken = loop.create_future()
+        ticket, waiter = self._enter(priority, deadline, lambda: loop.call_soon_threadsafe(_resolve, woken))
+        if ticket is not None:
+            return ticket
+        try:
+            await asyncio.wait_for(woken, deadline.remaining())
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            self._abandon(waiter)  # the client went away while queued
+            raise
+        return self._settle(waiter, deadline)
+
+    def _enter(self, priority, deadline, on_wake=None):
+        """(Ticket, None) when admitted at once, (None, queued waiter) otherwise; raises Overloaded"""
+        if not self.enabled:
+            return Ticket(self, priority, deadline), None
+
+        with self._lock:
+            if self._in_flight < self.max_in_flight and not self._queued():
+                self._in_flight += 1
+                self.admitted[priority] += 1
+                return Ticket(self, priority, deadline), None
+
+            remaining = deadline.remaining()
+            if remaining is not None and self._expected_wait(priority) > remaining:
+                # Waiting would only end in a timeout: say so now
+                self.shed['deadline'] += 1
+                raise Overloaded("Server busy: the request cannot be served before its deadline",
+                                 503, self.retry_after())
+            if not self._make_room(priority):
+                self.shed['queue_full'] += 1
+                raise Overloaded("Server busy: too many requests queued", 429, self.retry_after())
+            waiter = _Waiter(priority, on_wake)
+            self._lanes[priority].append(waiter)
+            return None, waiter
+
+    def _settle(self, waiter, deadline):
+        """Outcome for a queued waiter once it was woken or its deadline passed"""
+        priority = waiter.priority
+        with self._lock:
+            if waiter.granted:
+                self.admitted[priority] += 1
+                return Ticket(self, priority, deadline)
+            if waiter.evicted:
+                raise Overloaded("Server busy: displaced by higher-priority requests", 429, self.retry_after())
+            self._lanes[priority].remove(waiter)
+            self.shed['deadline'] += 1
+            raise Overloaded("Server busy: the request could not be admitted before its deadline",
+                             503, self.retry_after())
+
+    def _abandon(self, waiter):
+        """Drop a waiter that stopped waiting, passing on the slot if it had just been granted one"""
+        with self._lock:
+            if waiter.granted:
+                self._hand_off_locked()
+            elif not waiter.evicted:
+                self._lanes[waiter.priority].remove(waiter)
+
+    def _make_room(self, priority):
+        """True if the request may join the queue (evicting a bulk waiter for an urgent one)"""
+        if priority == 'bulk' and len(self._lanes['bulk']) >= self.bulk_queue:
+            return False
+        if self._queued() < self.max_queue:
+            return True
+        if priority == 'urgent' and self._lanes['bulk']:
+            waiter = self._lanes['bulk'].pop()
+            waiter.evicted = True
+            waiter.wake()
+            self.shed['evicted'] += 1
+            return True
+        return False
+
+    def _release(self, service_seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._service_seconds = 0.9 * self._service_seconds + 0.1 * service_seconds
+            self._hand_off_locked()
+
+    def _hand_off_locked(self):
+        for priority in PRIORITIES:
+            if self._lanes[priority]:
+                # Hand the slot straight to the next waiter; in-flight stays the same
+                waiter = self._lanes[priority].popleft()
+                waiter.granted = True
+                waiter.wake()
+                return
+        self._in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+                'in_flight': self._in_flight,
+                'queued': {priority: len(lane) for priority, lane in self._lanes.items()},
+                'admitted': dict(self.admitted),
+                'shed': dict(self.shed),
+                'service_ms': round(self._service_seconds * 1000, 3),
+            }
+
+
+def controller_from_env(default_deadline_ms=30000):
+    """ADMISSION_MAX_IN_FLIGHT / ADMISSION_MAX_QUEUE / ADMISSION_BULK_QUEUE size the controller"""
+    bulk_queue = os.environ.get('ADMISSION_BULK_QUEUE')
+    return AdmissionController(
+        max_in_flight=int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 8)),
+        max_queue=int(os.environ.get('ADMISSION_MAX_QUEUE', 32)),
+        bulk_queue=int(bulk_queue) if bulk_queue else None,
+        default_deadline_ms=float(os.environ.get('REQUEST_DEADLINE_MS', default_deadline_ms)),
+    )
@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+
+# Reuse the loaded model from predict.py and the shared modules in the project root
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from image_validation import status_for
+from predict import (_json_response, add_model_cache, admitted, binary_image_bytes, interpret,
+                     is_binary_content_type, load_model_once, metrics)
+from gradcam import DEFAULT_FORMAT, Explainer, data_url
+from payloads import decode_base64_image, get_header
+
+# Grad-CAM needs a gradient pass, so keep requests smaller than the prediction batches
+MAX_EXPLAIN_IMAGES = int(os.environ.get('MAX_EXPLAIN_IMAGES', 16))
+
+explainer = Explainer(load_model_once)
+# Heatmaps belong to one model, like predictions: re-keyed when the file or version changes
+add_model_cache(explainer.cache)
+
+def handler(request):
+    """Vercel serverless handler: Grad-CAM heatmaps as data URLs
+
+    Accepts a raw image body, {"image": "<base64>"} or {"images": [...]}, plus an
+    optional "format" ("webp" or "png").
+    """
+    with metrics.request('api_explain') as req:
+        # Explanations cost more than predictions, so they queue in the bulk lane
+        response = admitted(request, _handle_explain, lane='bulk')
+        if response['statusCode'] >= 400:
+            req.fail(f"http_{response['statusCode']}")
+        return response
+
+def _handle_explain(request, deadline=None):
+    try:
+        if request.get('method') == 'OPTIONS':
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                    'Access-Control-Allow-Headers': 'Content-Type, X-Deadline-Ms',
+                },
+                'body': ''
+            }
+
+        if request.get('method') != 'POST':
+            return _json_response(405, {'error': 'Method not allowed. Use POST.'})
+
+        body = request.get('body', '')
+        if not body:
+            return _json_response(400, {'error': 'No request body provided'})
+
+        fmt = DEFAULT_FORMAT
+        content_type = get_header(request, 'content-type', 'application/json').lower()
+        try:
+            if is_binary_content_type(content_type):
+                images = [binary_image_bytes(request, body, content_type)]
+            else:
+                data = json.loads(body)
+                if not isinstance(data, dict):
+                    return _json_response(400, {'error': 'Expected JSON with an "image" or "images" field.'})
+                encoded = data.get('images') or ([data['image']] if data.get('image') else [])
+                if len(encoded) > MAX_EXPLAIN_IMAGES:
+                    return _json_response(413, {'error': f'Too many images: {len(encoded)} (limit {MAX_EXPLAIN_IMAGES}).'})
+                images = [decode_base64_image(item) for item in encoded]
+                fmt = data.get('format', fmt)
+        except json.JSONDecodeError as json_error:
+            return _json_response(400, {'error': f'Invalid JSON in request body: {str(json_error)}'})
+        except ValueError as decode_error:
+            return _json_response(400, {'error': f'Invalid image data: {str(decode_error)}'})
+
+        if not images:
+            return _json_response(400, {'error': 'No images found in request.'})
+
+        try:
+            if deadline is not None:
+                deadline.check('explain')
+            results, timings = explainer.explain(images, fmt)
+        except Exception as processing_error:
+            print(f"Explain error: {str(processing_error)}")
+            return _json_response(status_for(processing_error), {'error': f'Error explaining image: {str(processing_error)}'})
+
+        payload = []
+        for result in results:
+            label, percentage = interpret(result['probability'])
+            payload.append({'prediction': label, 'percentage': percentage,
+                            'heatmap': data_url(result), 'cached': result['cached']})
+        return _json_response(200, {'results': payload, 'timings_ms': timings})
+
+    except Exception as server_error:
+        print(f"Server error: {str(server_error)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return _json_response(500, {'error': f'Server error: {str(server_error)}'})
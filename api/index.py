@@ -1,32 +1,56 @@
 import os
+import sys
+import base64
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from payloads import get_header
+from static_page import Page
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'templates', 'index.html')
+
+# Read, split and compressed once per cold start instead of on every request
+try:
+    page = Page(TEMPLATE_PATH)
+except FileNotFoundError:
+    page = None
 
 def handler(request):
-    """Serve the main HTML page"""
+    """Serve the main HTML page and its fingerprinted assets"""
     try:
-        # Read the HTML template
-        template_path = os.path.join(os.path.dirname(__file__), '..', 'templates', 'index.html')
+        if page is None:
+            return {
+                'statusCode': 500,
+                'headers': {'Access-Control-Allow-Origin': '*'},
+                'body': '<h1>Template not found</h1>'
+            }
 
-        with open(template_path, 'r', encoding='utf-8') as f:
-            html_content = f.read()
+        resource = page.resource_for(request.get('path') or request.get('url') or '/')
+        if resource is None:
+            return {
+                'statusCode': 404,
+                'headers': {'Access-Control-Allow-Origin': '*'},
+                'body': 'Not found'
+            }
 
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'text/html',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': html_content
-        }
+        status, headers, body = resource.respond(get_header(request, 'accept-encoding'),
+                                                 get_header(request, 'if-none-match'))
+        headers['Access-Control-Allow-Origin'] = '*'
+        if request.get('method') == 'HEAD':
+            body = b''
+
+        response = {'statusCode': status, 'headers': headers}
+        if 'Content-Encoding' in headers:
+            # Compressed bytes travel base64-encoded through the function response
+            response['body'] = base64.b64encode(body).decode('ascii')
+            response['isBase64Encoded'] = True
+        else:
+            response['body'] = body.decode('utf-8')
+        return response
 
-    except FileNotFoundError:
-        return {
-            'statusCode': 500,
-            'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': '<h1>Template not found</h1>'
-        }
     except Exception as e:
         return {
             'statusCode': 500,
             'headers': {'Access-Control-Allow-Origin': '*'},
             'body': f'<h1>Error: {str(e)}</h1>'
-        }
\ No newline at end of file
+        }
@@ -1,67 +1,152 @@
 import os
+import sys
 import json
-import base64
-import numpy as np
-from PIL import Image
-import cv2
-from tensorflow.keras.models import load_model
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Shared modules (backends, batching, ...) live in the project root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# Only standard-library-backed modules at import time: preflights and 4xx responses are answered
+# without NumPy/OpenCV, which are imported on the first request that decodes an image
+# (preprocessing, tta) and TensorFlow only by the model loader
+from metrics import metrics
+from model_loader import BackgroundModelLoader, LoadTimings, load_local_backend
+from prediction_cache import cache_from_env
+from payloads import body_bytes, decode_base64_image, get_header, parse_multipart
+from image_validation import status_for
+from calibration import Calibration, load_calibration
+from admission import DeadlineExceeded, Overloaded, controller_from_env, parse_priority
+import runtime_config
 
 # Global model variable to cache it across function invocations
 model = None
 
-def load_model_once():
+# Calibrated probability and decision threshold, loaded with the model (identity until then)
+calibration = Calibration()
+
+# Repeat submissions of the same image skip decode + predict (warm containers only,
+# unless PREDICTION_CACHE_DB points at persistent storage)
+prediction_cache = cache_from_env()
+
+# Caches keyed to the loaded model file (api/explain.py adds its Grad-CAM cache)
+_model_caches = [prediction_cache]
+_model_path = None
+_model_caches_lock = threading.Lock()
+
+def watch_model(path):
+    """Tie every model cache to the loaded model file, so a changed file or version misses them"""
+    global _model_path
+    with _model_caches_lock:
+        _model_path = path
+        caches = list(_model_caches)
+    for cache in caches:
+        cache.watch_model(path)
+
+def add_model_cache(cache):
+    """Key another cache to the model, including one that loaded before the cache was created"""
+    with _model_caches_lock:
+        _model_caches.append(cache)
+        path = _model_path
+    if path is not None:
+        cache.watch_model(path)
+
+# Bounded in-flight predictions with priority lanes; the default deadline leaves a margin
+# below the 30 s maxDuration in vercel.json so requests are answered before being killed
+admission = controller_from_env(default_deadline_ms=25000)
+
+# Batch endpoint limits: images per forward pass and per request
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 32))
+MAX_BATCH_IMAGES = int(os.environ.get('MAX_BATCH_IMAGES', 256))
+
+# Decode/resize worker threads (OpenCV releases the GIL), created on first batch
+_preprocess_pool = None
+
+def _load_model(timings):
+    """Find and load the model, recording per-phase timings"""
+    global calibration
+    # A models.json manifest bundled with the function picks the version (and any shadow)
+    if os.environ.get('MODEL_REGISTRY'):
+        from model_registry import registry_from_env
+        registry = registry_from_env()
+        registry.on_activate(lambda entry: watch_model(entry.location))
+        registry.load_active(timings)
+        calibration = registry.current().calibration
+        print(f"Model version {registry.current().version} loaded from {os.environ['MODEL_REGISTRY']}")
+        return registry
+
+    # Try local file first (for development/testing)
+    possible_paths = [
+        os.environ.get('MODEL_PATH', 'model.keras'),
+        'model.keras',
+        './model.keras',
+        '../model.keras',
+        os.path.join(os.path.dirname(__file__), '..', 'model.keras')
+    ]
+
+    for path in possible_paths:
+        if os.path.exists(path):
+            print(f"Loading model from local file: {path}")
+            backend = load_local_backend(path, timings)
+            watch_model(path)
+            calibration = load_calibration(path)
+            print(f"Model loaded successfully from local file ({backend.name} backend)")
+            return backend
+
+    # If no local file found, try loading from URL (for production)
+    print("No local model found, attempting to load from cloud storage...")
+    backend = load_model_from_url(timings)
+    print("Model loaded successfully from cloud storage")
+    return backend
+
+# Thread counts for the TensorFlow runtime, before it is imported by the loader
+runtime_config.configure()
+
+# Start loading as soon as the container imports this module, so request parsing
+# overlaps with model loading (MODEL_LOAD_MODE=lazy waits for the first prediction)
+model_loader = BackgroundModelLoader(_load_model)
+if os.environ.get('MODEL_LOAD_MODE', 'background') == 'background':
+    model_loader.start()
+metrics.register_gauges(lambda: [('model_load_seconds', {'phase': phase}, ms / 1000.0)
+                                  for phase, ms in model_loader.timings.phases.items()])
+
+def load_model_once(deadline=None):
     global model
     if model is None:
+        remaining = deadline.remaining() if deadline is not None else None
         try:
-            # Try local file first (for development/testing)
-            possible_paths = [
-                'model.keras',
-                './model.keras',
-                '../model.keras',
-                os.path.join(os.path.dirname(__file__), '..', 'model.keras')
-            ]
-
-            model_path = None
-            for path in possible_paths:
-                if os.path.exists(path):
-                    model_path = path
-                    print(f"Loading model from local file: {model_path}")
-                    model = load_model(model_path)
-                    print("Model loaded successfully from local file")
-                    return model
-
-            # If no local file found, try loading from URL (for production)
-            print("No local model found, attempting to load from cloud storage...")
-            model = load_model_from_url()
-            print("Model loaded successfully from cloud storage")
-
-        except Exception as e:
-            print(f"Error loading model: {str(e)}")
-            raise
+            model = model_loader.get(max(remaining, 0) if remaining is not None else None)
+        except TimeoutError:
+            raise DeadlineExceeded('model_wait')
     return model
 
-def load_model_from_url():
-    """Load model from cloud storage URL"""
-    import requests
-    import io
+def load_model_from_url(timings=None):
+    """Load model from cloud storage URL
+
+    The file is streamed into a versioned cache under MODEL_CACHE_DIR (default /tmp/model-cache),
+    so warm containers reuse it and interrupted downloads resume. Set MODEL_SHA256, or point
+    MODEL_MANIFEST_URL at a {"url", "sha256", "version"} JSON, to verify it.
+    """
+    global calibration
+    from model_fetch import fetch_model_from_env
+    timings = timings or LoadTimings()
 
     # Replace this URL with your actual model URL
     # You can host on: Google Drive, Dropbox, AWS S3, GitHub Releases, etc.
     model_url = os.environ.get('MODEL_URL', 'https://your-cloud-storage-url/model.keras')
 
-    if model_url == 'https://your-cloud-storage-url/model.keras':
+    if model_url == 'https://your-cloud-storage-url/model.keras' and not os.environ.get('MODEL_MANIFEST_URL'):
         raise ValueError("MODEL_URL environment variable not set. Please configure your model URL.")
 
     try:
-        print(f"Downloading model from: {model_url}")
-        response = requests.get(model_url, timeout=60)
-
-        if response.status_code != 200:
-            raise ValueError(f"Failed to download model: HTTP {response.status_code}")
-
-        # Load model from bytes
-        model_bytes = io.BytesIO(response.content)
-        model = load_model(model_bytes)
+        print(f"Fetching model from: {os.environ.get('MODEL_MANIFEST_URL') or model_url}")
+        with timings.phase('fetch'):
+            model_path, stats = fetch_model_from_env()
+        print(f"Model fetch: {stats.as_dict()}")
+
+        model = load_local_backend(model_path, timings)
+        watch_model(model_path)
+        calibration = load_calibration(model_path)
         print("Model downloaded and loaded successfully")
         return model
 
@@ -69,37 +154,203 @@ def load_model_from_url():
         print(f"Error downloading model: {str(e)}")
         raise
 
-def getResult(image_bytes):
+def getResult(image_bytes, deadline=None):
     """Process image bytes and return prediction"""
+    from preprocessing import decode_checked, preprocess_batch
     try:
-        # Convert bytes to numpy array
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
-
-        if image is None:
-            raise ValueError("Image could not be decoded. Please ensure it's a valid image file.")
+        with metrics.stage('model_wait'):
+            model = load_model_once(deadline)
+        with metrics.stage('cache_lookup'):
+            cache_key = f"{prediction_cache.key(image_bytes)}:p"
+            cached = prediction_cache.get(image_bytes, key=cache_key)
+        if cached is not None:
+            return interpret(cached)
+
+        # Check the header, then decode bytes straight to grayscale
+        with metrics.stage('decode'):
+            if deadline is not None:
+                deadline.check('decode')
+            image = decode_checked(image_bytes)
 
         # Process image
-        image = Image.fromarray(image)
-        image = image.resize((256, 256))  # Match model input shape
-        image = np.array(image).astype('float32') / 255.0
-        input_img = np.expand_dims(image, axis=(0, -1))  # Shape: (1, 256, 256, 1)
-
-        # Load model and predict
-        model = load_model_once()
-        prediction = model.predict(input_img, verbose=0)
+        with metrics.stage('preprocess'):
+            input_img = preprocess_batch([image])  # Shape: (1, 256, 256, 1)
+
+        # Predict
+        with metrics.stage('inference'):
+            if deadline is not None:
+                deadline.check('inference')
+            prediction = model.predict(input_img)
         pneumonia_prob = float(prediction[0][0])  # Single output neuron
-
-        label = "Pneumonia" if pneumonia_prob > 0.95 else "Normal"
-        percentage = round(pneumonia_prob * 100, 2)
-        return label, percentage
+        # Cache the raw output: the calibration and threshold are applied on every hit
+        prediction_cache.put(image_bytes, pneumonia_prob, key=cache_key)
+        return interpret(pneumonia_prob)
 
     except Exception as e:
         print(f"Error in getResult: {str(e)}")
         raise
 
+def getResultTTA(image_bytes, variants=None, deadline=None):
+    """Mean over `variants` augmented copies scored as one batch: (label, percentage, uncertainty %)"""
+    from preprocessing import decode_checked, preprocess_batch
+    from tta import TTA_ALLOW_FLIP, TTA_VARIANTS, predict_tta
+    variants = variants or TTA_VARIANTS
+    with metrics.stage('model_wait'):
+        model = load_model_once(deadline)
+    with metrics.stage('cache_lookup'):
+        cache_key = f"{prediction_cache.key(image_bytes)}:tta{variants}:p"
+        cached = prediction_cache.get(image_bytes, key=cache_key)
+    if cached is not None:
+        return tta_result(*cached)
+
+    with metrics.stage('decode'):
+        if deadline is not None:
+            deadline.check('decode')
+        image = decode_checked(image_bytes)
+    with metrics.stage('preprocess'):
+        input_img = preprocess_batch([image])
+    with metrics.stage('inference'):
+        if deadline is not None:
+            deadline.check('inference')
+        mean, spread, _ = predict_tta(model.predict, input_img, variants, TTA_ALLOW_FLIP)
+
+    raw = [float(mean[0]), float(spread[0])]
+    prediction_cache.put(image_bytes, raw, key=cache_key)
+    return tta_result(*raw)
+
+def tta_result(mean, spread):
+    """(label, percentage, uncertainty %) from the raw TTA mean and spread"""
+    label, percentage = interpret(mean)
+    return label, percentage, round(spread * 100, 2)
+
+def requested_variants(value):
+    """Validated TTA variant count for a request, TTA_VARIANTS when it doesn't ask"""
+    from tta import TTA_VARIANTS, parse_variants
+    return parse_variants(TTA_VARIANTS if value is None else value)
+
+def predict_response(image_bytes, variants, deadline=None):
+    """Run the plain or TTA prediction and build the JSON payload"""
+    if variants > 1:
+        label, percentage, uncertainty = getResultTTA(image_bytes, variants, deadline)
+        return {'prediction': label, 'percentage': percentage, 'confidence': percentage,
+                'uncertainty': uncertainty, 'tta_variants': variants}
+    label, percentage = getResult(image_bytes, deadline)
+    return {'prediction': label, 'percentage': percentage, 'confidence': percentage}
+
+def interpret(pneumonia_prob):
+    """Turn the sigmoid output into (label, percentage) with the model's calibration"""
+    return calibration.interpret(pneumonia_prob)
+
+def _get_preprocess_pool():
+    global _preprocess_pool
+    if _preprocess_pool is None:
+        _preprocess_pool = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1),
+                                              thread_name_prefix='preprocess')
+    return _preprocess_pool
+
+def getResults(images_bytes, chunk_size=None, deadline=None):
+    """Predict a list of encoded images in chunked batches
+
+    Returns one dict per image, in input order, with either the prediction or an error.
+    Items that are already errors (e.g. bad base64) can be passed as Exception instances.
+    Raises DeadlineExceeded if the deadline passes before a chunk starts.
+    """
+    from preprocessing import allocate_batch, decode_checked, resize_into
+    chunk_size = chunk_size or BATCH_CHUNK_SIZE
+    results = [None] * len(images_bytes)
+    pool = _get_preprocess_pool()
+    model = load_model_once(deadline)
+
+    for start in range(0, len(images_bytes), chunk_size):
+        if deadline is not None:
+            deadline.check('decode')
+        chunk = images_bytes[start:start + chunk_size]
+        buffer = allocate_batch(len(chunk))
+
+        def prepare(i):
+            item = chunk[i]
+            if isinstance(item, Exception):
+                return str(item)
+            try:
+                image = decode_checked(item)
+            except ValueError as e:
+                return str(e)
+            resize_into(image, buffer[i])
+            return None
+
+        with metrics.stage('decode_preprocess'):
+            errors = list(pool.map(prepare, range(len(chunk))))
+        valid = [i for i, error in enumerate(errors) if error is None]
+
+        if valid:
+            batch = buffer if len(valid) == len(chunk) else buffer[valid]
+            try:
+                with metrics.stage('inference'):
+                    probs = model.predict(batch)[:, 0]
+            except Exception as e:
+                print(f"Batch prediction error: {str(e)}")
+                probs = None
+                for i in valid:
+                    errors[i] = f"Prediction failed: {str(e)}"
+
+            if probs is not None:
+                for i, (label, percentage) in zip(valid, calibration.interpret_batch(probs)):
+                    results[start + i] = {'index': start + i, 'prediction': label,
+                                          'percentage': percentage, 'confidence': percentage}
+
+        for i, error in enumerate(errors):
+            if error is not None:
+                results[start + i] = {'index': start + i, 'error': error}
+
+    return results
+
+def is_binary_content_type(content_type):
+    return (content_type.startswith('application/octet-stream')
+            or content_type.startswith('image/')
+            or content_type.startswith('multipart/form-data'))
+
+def binary_image_bytes(request, body, content_type):
+    """Image bytes from a raw or multipart body (Vercel base64-wraps binary bodies)"""
+    if request.get('encoding') == 'base64' and isinstance(body, str):
+        body = decode_base64_image(body)
+
+    if content_type.startswith('multipart/form-data'):
+        parts = parse_multipart(body, get_header(request, 'content-type'))
+        for name, filename, data in parts:
+            if name == 'image' or filename:
+                return data
+        raise ValueError('No "image" file field found in multipart body')
+    return body_bytes(body)
+
 def handler(request):
     """Vercel serverless function handler"""
+    with metrics.request('api_predict') as req:
+        response = admitted(request, _handle_predict)
+        if response['statusCode'] >= 400:
+            req.fail(f"http_{response['statusCode']}")
+        return response
+
+def admitted(request, handle, lane=None):
+    """Admission control in front of handle(request, deadline) for POSTs (preflights and 405s skip it)
+
+    X-Priority: urgent|normal|bulk picks the lane (unless `lane` fixes it) and X-Deadline-Ms
+    the time budget; shed requests get 429/503 with Retry-After straight away.
+    """
+    if request.get('method') != 'POST':
+        return handle(request)
+    try:
+        priority = lane or parse_priority(get_header(request, 'x-priority', None))
+        ticket = admission.admit(priority, admission.deadline(get_header(request, 'x-deadline-ms', None)))
+    except ValueError as e:
+        return _json_response(400, {'error': str(e)})
+    except Overloaded as e:
+        response = _json_response(e.status, {'error': str(e), 'retry_after': e.retry_after})
+        response['headers']['Retry-After'] = str(e.retry_after)
+        return response
+    with ticket:
+        return handle(request, ticket.deadline)
+
+def _handle_predict(request, deadline=None):
     try:
         print(f"Request method: {request.get('method', 'unknown')}")
 
@@ -110,7 +361,7 @@ def handler(request):
                 'headers': {
                     'Access-Control-Allow-Origin': '*',
                     'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                    'Access-Control-Allow-Headers': 'Content-Type',
+                    'Access-Control-Allow-Headers': 'Content-Type, X-Priority, X-Deadline-Ms, X-TTA-Variants',
                 },
                 'body': ''
             }
@@ -133,9 +384,27 @@ def handler(request):
                 'body': json.dumps({'error': 'No request body provided'})
             }
 
+        # Binary uploads (raw image body or multipart form) skip base64 and JSON entirely
+        content_type = get_header(request, 'content-type', 'application/json').lower()
+        if is_binary_content_type(content_type):
+            try:
+                image_bytes = binary_image_bytes(request, body, content_type)
+                print(f"Binary image bytes: {len(image_bytes)}")
+                variants = requested_variants(get_header(request, 'x-tta-variants', None))
+                payload = predict_response(image_bytes, variants, deadline)
+            except Exception as processing_error:
+                print(f"Processing error: {str(processing_error)}")
+                return {
+                    'statusCode': status_for(processing_error),
+                    'headers': {'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': f'Error processing image: {str(processing_error)}'})
+                }
+            return _json_response(200, payload)
+
         # Parse JSON payload
         try:
-            data = json.loads(body)
+            with metrics.stage('parse'):
+                data = json.loads(body)
             image_data = data.get('image')
 
             if not image_data:
@@ -149,14 +418,8 @@ def handler(request):
 
             # Decode base64 image
             try:
-                if image_data.startswith('data:image'):
-                    # Handle data URL format: "data:image/jpeg;base64,..."
-                    header, base64_data = image_data.split(',', 1)
-                    image_bytes = base64.b64decode(base64_data)
-                else:
-                    # Assume it's raw base64
-                    image_bytes = base64.b64decode(image_data)
-
+                with metrics.stage('parse'):
+                    image_bytes = decode_base64_image(image_data)
                 print(f"Decoded image bytes: {len(image_bytes)}")
 
             except Exception as decode_error:
@@ -166,10 +429,10 @@ def handler(request):
                     'body': json.dumps({'error': f'Invalid base64 image data: {str(decode_error)}'})
                 }
 
-            # Get prediction
+            # Get prediction ("tta": K asks for K augmented variants)
             print("Starting prediction...")
-            label, percentage = getResult(image_bytes)
-            print(f"Prediction result: {label}, {percentage}%")
+            payload = predict_response(image_bytes, requested_variants(data.get('tta')), deadline)
+            print(f"Prediction result: {payload['prediction']}, {payload['percentage']}%")
 
             return {
                 'statusCode': 200,
@@ -177,11 +440,7 @@ def handler(request):
                     'Access-Control-Allow-Origin': '*',
                     'Content-Type': 'application/json'
                 },
-                'body': json.dumps({
-                    'prediction': label,
-                    'percentage': percentage,
-                    'confidence': percentage
-                })
+                'body': json.dumps(payload)
             }
 
         except json.JSONDecodeError as json_error:
@@ -193,7 +452,7 @@ def handler(request):
         except Exception as processing_error:
             print(f"Processing error: {str(processing_error)}")
             return {
-                'statusCode': 400,
+                'statusCode': status_for(processing_error),
                 'headers': {'Access-Control-Allow-Origin': '*'},
                 'body': json.dumps({'error': f'Error processing image: {str(processing_error)}'})
             }
@@ -206,4 +465,90 @@ def handler(request):
             'statusCode': 500,
             'headers': {'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': f'Server error: {str(server_error)}'})
-        }
\ No newline at end of file
+        }
+
+def _json_response(status_code, payload):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Content-Type': 'application/json'
+        },
+        'body': json.dumps(payload)
+    }
+
+def batch_handler(request):
+    """Vercel serverless handler for multi-image studies
+
+    Accepts JSON {"images": ["<base64 or data URL>", ...]} or a multipart/form-data body
+    with one or more image file fields. Returns per-image results in input order.
+    """
+    with metrics.request('api_predict_batch') as req:
+        response = admitted(request, _handle_batch)
+        if response['statusCode'] >= 400:
+            req.fail(f"http_{response['statusCode']}")
+        return response
+
+def _handle_batch(request, deadline=None):
+    try:
+        if request.get('method') == 'OPTIONS':
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                    'Access-Control-Allow-Headers': 'Content-Type, X-Priority, X-Deadline-Ms',
+                },
+                'body': ''
+            }
+
+        if request.get('method') != 'POST':
+            return _json_response(405, {'error': 'Method not allowed. Use POST.'})
+
+        body = request.get('body', '')
+        if not body:
+            return _json_response(400, {'error': 'No request body provided'})
+
+        content_type = get_header(request, 'content-type', 'application/json')
+        if content_type.lower().startswith('multipart/form-data'):
+            try:
+                if request.get('encoding') == 'base64' and isinstance(body, str):
+                    body = decode_base64_image(body)
+                parts = parse_multipart(body, content_type)
+            except Exception as parse_error:
+                return _json_response(400, {'error': f'Invalid multipart body: {str(parse_error)}'})
+            images = [data for name, filename, data in parts if filename is not None or name in ('image', 'images')]
+        else:
+            try:
+                data = json.loads(body)
+            except json.JSONDecodeError as json_error:
+                return _json_response(400, {'error': f'Invalid JSON in request body: {str(json_error)}'})
+            encoded = data.get('images') if isinstance(data, dict) else None
+            if not isinstance(encoded, list):
+                return _json_response(400, {'error': 'Expected JSON with an "images" list.'})
+
+            images = []
+            for item in encoded:
+                try:
+                    images.append(decode_base64_image(item))
+                except ValueError as decode_error:
+                    images.append(ValueError(f'Invalid base64 image data: {str(decode_error)}'))
+
+        if not images:
+            return _json_response(400, {'error': 'No images found in request.'})
+        if len(images) > MAX_BATCH_IMAGES:
+            return _json_response(413, {'error': f'Too many images: {len(images)} (limit {MAX_BATCH_IMAGES}).'})
+
+        print(f"Batch request with {len(images)} images")
+        try:
+            results = getResults(images, deadline=deadline)
+        except DeadlineExceeded as e:
+            return _json_response(e.status, {'error': str(e)})
+        failed = sum(1 for r in results if 'error' in r)
+        return _json_response(200, {'count': len(results), 'errors': failed, 'results': results})
+
+    except Exception as server_error:
+        print(f"Server error: {str(server_error)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return _json_response(500, {'error': f'Server error: {str(server_error)}'})
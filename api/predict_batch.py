@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Reuse the model cache and batch logic from predict.py
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from predict import batch_handler as handler
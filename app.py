@@ -1,71 +1,504 @@
+import atexit
 import os
+from functools import wraps
 import numpy as np
-from PIL import Image
-import cv2
-from flask import Flask, request, render_template
+from urllib.parse import unquote
+from flask import Flask, Response, g, request, render_template, jsonify
 from werkzeug.utils import secure_filename
-from tensorflow.keras.models import load_model
+from batching import BatchScheduler
+from metrics import metrics
+from model_loader import BackgroundModelLoader, prefetch_model
+from model_registry import registry_from_env
+from prediction_cache import cache_from_env
+import runtime_config
+from image_validation import max_request_bytes, status_for
+from preprocessing import decode_checked, preprocess_batch
+from tta import TTA_ALLOW_FLIP, TTA_VARIANTS, parse_variants, predict_tta
+from gradcam import DEFAULT_FORMAT, Explainer, data_url
+from upload_store import store_from_env
+from calibration import load_calibration
+from static_page import Page
+from admission import Overloaded, controller_from_env, parse_priority
 
 # ✅ Load full model (architecture + weights)
-model_path = 'model.keras'
-if not os.path.exists(model_path):
-    print("❌ Model file not found! Please ensure model.keras is in the project root.")
+# MODEL_PATH / MODEL_BACKEND select e.g. model_float16.tflite on the TFLite interpreter
+model_path = os.environ.get('MODEL_PATH', 'model.keras')
+
+# 🔌 INFERENCE_SERVER_ADDRESS: the model lives in inference_server.py, shared by all workers
+INFERENCE_SERVER_ADDRESS = os.environ.get('INFERENCE_SERVER_ADDRESS')
+
+# 🗃️ MODEL_REGISTRY: a models.json manifest of versions (see model_registry.py) instead of one MODEL_PATH
+MODEL_REGISTRY = os.environ.get('MODEL_REGISTRY')
+MODEL_REGISTRY_POLL_SECONDS = float(os.environ.get('MODEL_REGISTRY_POLL_SECONDS', 5))
+
+if not INFERENCE_SERVER_ADDRESS and not MODEL_REGISTRY and not os.path.exists(model_path):
+    print(f"❌ Model file not found! Please ensure {model_path} is in the project root.")
     print("For deployment, you may need to:")
     print("1. Upload model.keras to a cloud storage (Google Drive, Dropbox, etc.)")
     print("2. Or use Git LFS for large files")
     print("3. Or train a smaller model")
     exit(1)
 
-model_03 = load_model(model_path)
+# 🧵 Per-worker TensorFlow/OpenMP thread counts, set before TensorFlow is imported
+runtime_config.configure()
+
+# ⏳ MODEL_LOAD_MODE: background (default) serves requests while the model loads,
+# eager loads before serving, preload only reads the model file into the page cache in the gunicorn
+# master and each worker loads it after fork (see gunicorn.conf.py)
+MODEL_LOAD_MODE = os.environ.get('MODEL_LOAD_MODE', 'background')
+inference_client = None
+registry = None
+if INFERENCE_SERVER_ADDRESS:
+    from inference_server import InferenceClient
+    # Stands in for the loader and the backend; connects lazily in each worker after fork
+    inference_client = model_loader = InferenceClient(INFERENCE_SERVER_ADDRESS)
+else:
+    # The registry stands in for the backend: it serves the active version, swaps in new ones
+    # without a restart and shadow-scores a candidate on a sample of batches
+    registry = registry_from_env()
+    model_loader = BackgroundModelLoader(lambda timings: registry.load_active(timings, default_path=model_path))
+    if MODEL_LOAD_MODE == 'background':
+        model_loader.start()
+    elif MODEL_LOAD_MODE == 'preload':
+        # No TensorFlow before the fork: its runtime threads don't survive one
+        active_version = registry.wanted()[0]
+        prefetch_model(registry.versions[active_version].location if active_version else model_path)
+    else:
+        model_loader.load()
+
+def predict_batch(batch):
+    return model_loader.get().predict(batch)
+
+# 🎯 Calibrated probability and decision threshold (model.calibration.json next to the model)
+calibration = load_calibration(model_path) if registry is None else None
+
+def current_calibration():
+    """The calibration of the model version being served"""
+    return calibration if registry is None else registry.current().calibration
+
+def serving_backend():
+    """The backend of the model version being served"""
+    backend = model_loader.get()
+    return backend if registry is None else registry.current_backend()
+
+# 🗂️ Repeat submissions of the same image skip decode + predict
+prediction_cache = cache_from_env()
+
+# 🔥 Grad-CAM explanations (Keras backend only), cached by image hash
+explainer = Explainer(serving_backend)
+
+if registry is None:
+    prediction_cache.watch_model(model_path)
+    explainer.cache.watch_model(model_path)
+else:
+    # Cached results belong to one model version; a swap re-keys both caches
+    def _watch_version(entry):
+        prediction_cache.watch_model(entry.location)
+        explainer.cache.watch_model(entry.location)
+
+    registry.on_activate(_watch_version)
+    registry.watch(MODEL_REGISTRY_POLL_SECONDS)
+    atexit.register(registry.close)
+MAX_EXPLAIN_IMAGES = int(os.environ.get('MAX_EXPLAIN_IMAGES', 16))
+
+# ⚡ Micro-batching: concurrent /predict requests share one forward pass
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 16))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 10))
+
+# (in inference-server mode the server batches across all workers instead)
+batch_scheduler = None
+if BATCH_MAX_SIZE > 1 and inference_client is None:
+    def _observe_batch(size, waits, inference_seconds):
+        metrics.observe('batch_size', size)
+        for wait in waits:
+            metrics.observe('queue_wait_seconds', wait)
+
+    batch_scheduler = BatchScheduler(
+        predict_batch,
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        on_batch=_observe_batch,
+    ).start()
+
+# 📈 Gauges read at scrape time by /metrics
+def _gauges():
+    for phase, ms in model_loader.timings.phases.items():
+        yield 'model_load_seconds', {'phase': phase}, ms / 1000.0
+    yield 'model_ready', None, int(model_loader.ready)
+    if batch_scheduler is not None:
+        yield 'batch_queue_depth', None, batch_scheduler.queue_depth()
+    cache = prediction_cache.stats()
+    for name in ('hits', 'misses', 'evictions', 'memory_entries'):
+        yield f'cache_{name}', None, cache[name]
+    for name, value in upload_store.stats().items():
+        yield f'upload_store_{name}', None, value
+    if registry is not None:
+        yield from registry.gauges()
+    stats = admission.stats()
+    yield 'admission_in_flight', None, stats['in_flight']
+    for priority, depth in stats['queued'].items():
+        yield 'admission_queued', {'priority': priority}, depth
+
+metrics.register_gauges(_gauges)
+
+# 🚦 Admission control: bounded in-flight /predict requests, priority lanes, deadlines, fast 429/503
+admission = controller_from_env()
+
+def admitted(html=False, lane=None):
+    """Run the view only once admitted; g.admission is its ticket (with the request's deadline)
+
+    lane fixes the priority (the X-Priority header is then ignored).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                priority = lane or parse_priority(request.headers.get('X-Priority') or request.args.get('priority'))
+                ticket = admission.admit(priority, admission.deadline(request.headers.get('X-Deadline-Ms')))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            except Overloaded as e:
+                metrics.inc('requests_shed_total', {'endpoint': request.endpoint, 'status': str(e.status)})
+                headers = {'Retry-After': str(e.retry_after)}
+                if html and not _is_binary_upload():
+                    return render_template('index.html', prediction_text=f"⏳ {e} Please retry shortly."), e.status, headers
+                return jsonify({'error': str(e), 'retry_after': e.retry_after}), e.status, headers
+            with ticket:
+                g.admission = ticket
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def request_deadline():
+    """The admitted request's deadline (None outside an admitted view)"""
+    ticket = g.get('admission')
+    return ticket.deadline if ticket is not None else None
 
 app = Flask(__name__)
+# 📏 Bodies over the upload limit get a 413 before they are read into memory
+app.config['MAX_CONTENT_LENGTH'] = max_request_bytes()
+
+@app.errorhandler(413)
+def body_too_large(e):
+    return jsonify({'error': f'Request body too large (limit {request.max_content_length} bytes).'}), 413
+
+# 📄 Index page read, split into fingerprinted assets and precompressed once, not rendered per request
+index_page = Page(os.path.join(app.root_path, 'templates', 'index.html'))
 UPLOAD_FOLDER = os.path.join('static', 'uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-print('✅ Model loaded. Visit http://127.0.0.1:5000/')
+# 💾 Uploads are predicted from memory; a bounded, content-addressed copy is written in the background
+SAVE_UPLOADS = os.environ.get('SAVE_UPLOADS', '1') == '1'
+upload_store = store_from_env(UPLOAD_FOLDER)
+atexit.register(upload_store.close)
+
+def save_upload_async(filename, image_bytes):
+    """Queue an upload for the store; returns the stored name (None when not saved)
+
+    Only call this once the upload has passed validation (i.e. after it was predicted), so
+    rejected files are never written or decoded by the writer thread.
+    """
+    if SAVE_UPLOADS:
+        return upload_store.submit(filename, image_bytes)
+    return None
+
+print(f'✅ Model {model_loader.status()["state"]}. Visit http://127.0.0.1:5000/')
 
 # 🧪 Prediction logic using sigmoid output
 def getResult(img_path):
-    image = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-    if image is None:
+    try:
+        with open(img_path, 'rb') as f:
+            image_bytes = f.read()
+    except OSError:
         raise ValueError("Image not found or unreadable.")
+    return getResultFromBytes(image_bytes)
+
+def getResultFromBytes(image_bytes, deadline=None):
+    cache_key, cached = lookup_cache(image_bytes)
+    if cached is not None:
+        return interpret(cached)
+
+    if inference_client is not None:
+        return store_result(cache_key, predict_via_server(image_bytes, deadline))
+
+    input_img = preprocess_upload(image_bytes, deadline=deadline)
+
+    with metrics.stage('inference'):
+        if deadline is not None:
+            deadline.check('inference')
+        if batch_scheduler is not None:
+            prediction = batch_scheduler.predict(input_img, deadline=deadline)
+        else:
+            prediction = predict_batch(input_img)[0]
+
+    return store_result(cache_key, prediction)
+
+# The steps of getResultFromBytes, shared with the async server in asgi_app.py
+def lookup_cache(image_bytes):
+    """Returns (cache_key, cached raw probability or None)"""
+    with metrics.stage('cache_lookup'):
+        cache_key = f"{prediction_cache.key(image_bytes)}:p"
+        cached = prediction_cache.get(image_bytes, key=cache_key)
+    return cache_key, cached
+
+def preprocess_upload(image_bytes, out=None, deadline=None):
+    """Validate, decode + resize + normalize into a (1, 256, 256, 1) batch (written into out if given)
 
-    image = Image.fromarray(image)
-    image = image.resize((256, 256))  # Match model input shape
-    image = np.array(image).astype('float32') / 255.0
-    input_img = np.expand_dims(image, axis=(0, -1))  # Shape: (1, 256, 256, 1)
+    Unsupported, malformed or oversized images raise InvalidImage before any pixels are decoded,
+    and nothing is decoded for a request whose deadline has already passed.
+    """
+    if deadline is not None:
+        deadline.check('decode')
+    with metrics.stage('decode'):
+        image = decode_checked(image_bytes)
 
-    prediction = model_03.predict(input_img)
-    pneumonia_prob = prediction[0][0]  # Single output neuron
+    with metrics.stage('preprocess'):
+        return preprocess_batch([image], out=out)  # Shape: (1, 256, 256, 1)
 
-    label = "Pneumonia" if pneumonia_prob > 0.95 else "Normal"
-    percentage = round(pneumonia_prob * 100, 2)
-    return label, percentage
+def predict_via_server(image_bytes, deadline=None):
+    """Preprocess straight into a shared-memory slot and wait for the inference server"""
+    with inference_client.slot() as slot:
+        preprocess_upload(image_bytes, out=slot.array, deadline=deadline)
+        with metrics.stage('inference'):
+            if deadline is not None:
+                deadline.check('inference')
+            return slot.predict()
+
+def interpret(pneumonia_prob):
+    return current_calibration().interpret(pneumonia_prob)
+
+def store_result(cache_key, prediction):
+    # The raw output is cached and interpreted on every hit, so a new calibration or
+    # DECISION_THRESHOLD applies to cached images too
+    pneumonia_prob = float(prediction[0])  # Single output neuron
+    prediction_cache.put(None, pneumonia_prob, key=cache_key)
+    return interpret(pneumonia_prob)
+
+def predict_rows(batch, deadline=None):
+    """Score a batch row by row through the batch scheduler (when enabled) so it shares forward passes"""
+    if batch_scheduler is None:
+        return predict_batch(batch)
+    futures = [batch_scheduler.submit(row, deadline) for row in batch]
+    return np.stack([future.result() for future in futures])
+
+# 🔁 Test-time augmentation: mean over K augmented copies, scored as one batch
+def getResultTTA(image_bytes, variants=TTA_VARIANTS, deadline=None):
+    """Returns (label, percentage, uncertainty); uncertainty is the std across variants in %"""
+    with metrics.stage('cache_lookup'):
+        cache_key = f"{prediction_cache.key(image_bytes)}:tta{variants}:p"
+        cached = prediction_cache.get(image_bytes, key=cache_key)
+    if cached is not None:
+        return tta_result(*cached)
+
+    input_img = preprocess_upload(image_bytes, deadline=deadline)
+    with metrics.stage('inference'):
+        if deadline is not None:
+            deadline.check('inference')
+        mean, spread, _ = predict_tta(lambda batch: predict_rows(batch, deadline), input_img, variants, TTA_ALLOW_FLIP)
+
+    raw = [float(mean[0]), float(spread[0])]
+    prediction_cache.put(None, raw, key=cache_key)
+    return tta_result(*raw)
+
+def tta_result(mean, spread):
+    label, percentage = interpret(mean)
+    return label, percentage, round(spread * 100, 2)
 
 # 🌐 Routes
+def _serve(resource):
+    status, headers, body = resource.respond(request.headers.get('Accept-Encoding'),
+                                             request.headers.get('If-None-Match'))
+    return Response(body, status=status, headers=headers)
+
 @app.route('/', methods=['GET'])
 def index():
-    return render_template('index.html')
+    return _serve(index_page.html)
 
-@app.route('/predict', methods=['POST'])
-def predict():
-    if 'image' not in request.files:
-        return render_template('index.html', prediction_text="⚠️ No file uploaded.")
+@app.route('/assets/<name>', methods=['GET'])
+def asset(name):
+    resource = index_page.assets.get(name)
+    if resource is None:
+        return jsonify({'error': 'Not found'}), 404
+    return _serve(resource)
+
+def _is_binary_upload():
+    content_type = (request.mimetype or '').lower()
+    return content_type == 'application/octet-stream' or content_type.startswith('image/')
 
-    f = request.files['image']
-    if f.filename == '':
-        return render_template('index.html', prediction_text="⚠️ No file selected.")
+def _predict_binary(req):
+    """Raw image body: decoded straight from memory, answered with JSON"""
+    with metrics.stage('upload_read'):
+        image_bytes = request.get_data(cache=False)
+    if not image_bytes:
+        req.fail('EmptyBody')
+        return jsonify({'error': 'No request body provided'}), 400
 
-    filename = secure_filename(f.filename)
-    file_path = os.path.join(UPLOAD_FOLDER, filename)
-    f.save(file_path)
+    filename = secure_filename(unquote(request.headers.get('X-Filename', '')))
+    return _predict_json(req, image_bytes, filename)
 
+def _predict_json(req, image_bytes, filename=''):
+    """JSON prediction; ?tta=K (or an X-TTA-Variants header) asks for K augmented variants"""
     try:
-        label, percentage = getResult(file_path)
-        result_text = f"{label} ({percentage}%)"
-        return render_template('index.html', prediction_text=result_text, image_name=filename, percentage=percentage)
+        variants = parse_variants(request.args.get('tta') or request.headers.get('X-TTA-Variants') or TTA_VARIANTS)
+        if variants > 1:
+            label, percentage, uncertainty = getResultTTA(image_bytes, variants, request_deadline())
+            save_upload_async(filename, image_bytes)
+            return jsonify({'prediction': label, 'percentage': percentage, 'confidence': percentage,
+                            'uncertainty': uncertainty, 'tta_variants': variants})
+        label, percentage = getResultFromBytes(image_bytes, request_deadline())
     except Exception as e:
-        return render_template('index.html', prediction_text=f"❌ Error: {str(e)}")
+        req.fail(e)
+        return jsonify({'error': f'Error processing image: {str(e)}'}), status_for(e)
+    save_upload_async(filename, image_bytes)
+    return jsonify({'prediction': label, 'percentage': percentage, 'confidence': percentage})
+
+@app.route('/predict', methods=['POST'])
+@admitted(html=True)
+def predict():
+    with metrics.request('predict') as req:
+        if _is_binary_upload():
+            return _predict_binary(req)
+
+        if 'image' not in request.files:
+            req.fail('NoFile')
+            return render_template('index.html', prediction_text="⚠️ No file uploaded.")
+
+        f = request.files['image']
+        if f.filename == '':
+            req.fail('NoFile')
+            return render_template('index.html', prediction_text="⚠️ No file selected.")
+
+        with metrics.stage('upload_read'):
+            image_bytes = f.read()
+
+        try:
+            if TTA_VARIANTS > 1:
+                label, percentage, uncertainty = getResultTTA(image_bytes, deadline=request_deadline())
+                result_text = f"{label} ({percentage}% ± {uncertainty}%)"
+            else:
+                label, percentage = getResultFromBytes(image_bytes, request_deadline())
+                result_text = f"{label} ({percentage}%)"
+            filename = save_upload_async(secure_filename(f.filename), image_bytes)
+            return render_template('index.html', prediction_text=result_text, image_name=filename, percentage=percentage)
+        except Exception as e:
+            req.fail(e)
+            return render_template('index.html', prediction_text=f"❌ Error: {str(e)}"), status_for(e)
+
+# Same contract as the serverless api/predict.py, used by templates/index.html
+@app.route('/api/predict', methods=['POST'])
+@admitted()
+def api_predict():
+    with metrics.request('api_predict') as req:
+        if _is_binary_upload():
+            return _predict_binary(req)
+
+        f = request.files.get('image')
+        if f is None or f.filename == '':
+            req.fail('NoFile')
+            return jsonify({'error': 'No image uploaded. Send the file as the request body or an "image" form field.'}), 400
+        with metrics.stage('upload_read'):
+            image_bytes = f.read()
+        return _predict_json(req, image_bytes, secure_filename(f.filename))
+
+def _observe_explain(timings):
+    for stage, ms in timings.items():
+        metrics.observe('stage_seconds', ms / 1000.0, {'stage': f'explain_{stage}'})
+
+# Grad-CAM overlay of one upload (raw body or "image" form field), returned as the image itself
+# Explanations cost more than predictions, so they queue in the bulk lane
+@app.route('/explain', methods=['POST'])
+@admitted(lane='bulk')
+def explain():
+    with metrics.request('explain') as req:
+        if _is_binary_upload():
+            image_bytes = request.get_data(cache=False)
+        else:
+            f = request.files.get('image')
+            image_bytes = f.read() if f is not None else b''
+        if not image_bytes:
+            req.fail('NoFile')
+            return jsonify({'error': 'No image uploaded. Send the file as the request body or an "image" form field.'}), 400
+
+        try:
+            request_deadline().check('explain')
+            results, timings = explainer.explain([image_bytes], request.args.get('format', DEFAULT_FORMAT))
+        except Exception as e:
+            req.fail(e)
+            return jsonify({'error': f'Error explaining image: {str(e)}'}), status_for(e)
+        _observe_explain(timings)
+
+        result = results[0]
+        label, percentage = interpret(result['probability'])
+        response = Response(result['image'], mimetype=result['content_type'])
+        response.headers['X-Prediction'] = label
+        response.headers['X-Percentage'] = str(percentage)
+        response.headers['X-Explain-Ms'] = str(round(sum(timings.values()), 3))
+        response.headers['Cache-Control'] = 'private, max-age=3600'
+        return response
+
+# Same contract as api/explain.py: JSON with data URLs, one raw image or several "images" form fields
+@app.route('/api/explain', methods=['POST'])
+@admitted(lane='bulk')
+def api_explain():
+    request.max_content_length = max_request_bytes(MAX_EXPLAIN_IMAGES)
+    with metrics.request('api_explain') as req:
+        if _is_binary_upload():
+            images = [request.get_data(cache=False)]
+        else:
+            images = [f.read() for f in request.files.getlist('images') + request.files.getlist('image')]
+        images = [data for data in images if data]
+        if not images:
+            req.fail('NoFile')
+            return jsonify({'error': 'No image uploaded. Send the file as the request body or "images" form fields.'}), 400
+        if len(images) > MAX_EXPLAIN_IMAGES:
+            req.fail('TooManyImages')
+            return jsonify({'error': f'Too many images: {len(images)} (limit {MAX_EXPLAIN_IMAGES}).'}), 413
+
+        try:
+            request_deadline().check('explain')
+            results, timings = explainer.explain(images, request.args.get('format', DEFAULT_FORMAT))
+        except Exception as e:
+            req.fail(e)
+            return jsonify({'error': f'Error explaining image: {str(e)}'}), status_for(e)
+        _observe_explain(timings)
+
+        payload = []
+        interpretations = current_calibration().interpret_batch([result['probability'] for result in results])
+        for result, (label, percentage) in zip(results, interpretations):
+            payload.append({'prediction': label, 'percentage': percentage,
+                            'heatmap': data_url(result), 'cached': result['cached']})
+        return jsonify({'results': payload, 'timings_ms': timings})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if not metrics.enabled:
+        return Response('# metrics disabled (METRICS_ENABLED=0)\n', status=404, mimetype='text/plain')
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/model_status', methods=['GET'])
+def model_status():
+    status = model_loader.status()
+    return jsonify(status), 200 if status['state'] == 'ready' else 503
+
+@app.route('/model_versions', methods=['GET'])
+def model_versions():
+    if registry is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **registry.stats()})
+
+@app.route('/admission_stats', methods=['GET'])
+def admission_stats():
+    return jsonify({'enabled': admission.enabled, **admission.stats()})
+
+@app.route('/batch_stats', methods=['GET'])
+def batch_stats():
+    if batch_scheduler is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **batch_scheduler.stats()})
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(prediction_cache.stats())
 
 if __name__ == '__main__':
     app.run(debug=False, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
\ No newline at end of file
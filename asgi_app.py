@@ -0,0 +1,222 @@
+"""
+Async (ASGI) serving mode for the same / and /predict routes as app.py
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port $PORT
+
+Request I/O runs on the event loop, decode/preprocess runs on a thread pool (OpenCV and
+NumPy release the GIL) and inference runs on the batch scheduler's dedicated thread (or a
+single-thread executor when batching is off), so one process with one model copy can hold
+many concurrent connections. Admission control, priorities and deadlines are the same as in
+app.py, except that queued requests wait on the event loop.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from urllib.parse import unquote
+
+from quart import Quart, Response, g, jsonify, render_template, request
+from werkzeug.utils import secure_filename
+
+import app as sync_app
+from admission import Overloaded, parse_priority
+from image_validation import max_request_bytes, status_for
+from metrics import metrics
+from tta import TTA_VARIANTS, parse_variants
+
+PREPROCESS_THREADS = int(os.environ.get('ASGI_PREPROCESS_THREADS', os.cpu_count() or 4))
+
+preprocess_pool = ThreadPoolExecutor(max_workers=PREPROCESS_THREADS, thread_name_prefix='asgi-preprocess')
+inference_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='asgi-inference')
+
+app = Quart(__name__)
+# Same upload limit as the Flask app: oversized bodies get a 413 before they are read
+app.config['MAX_CONTENT_LENGTH'] = max_request_bytes()
+
+
+@app.errorhandler(413)
+async def body_too_large(e):
+    return jsonify({'error': f'Request body too large (limit {request.max_content_length} bytes).'}), 413
+
+
+# Same admission controller (and limits) as the Flask app; queued requests wait on the event loop
+admission = sync_app.admission
+
+
+def admitted(html=False):
+    """Async twin of app.admitted(): run the view only once admitted, g.admission is its ticket"""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(*args, **kwargs):
+            try:
+                priority = parse_priority(request.headers.get('X-Priority') or request.args.get('priority'))
+                ticket = await admission.admit_async(priority, admission.deadline(request.headers.get('X-Deadline-Ms')))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            except Overloaded as e:
+                metrics.inc('requests_shed_total', {'endpoint': request.endpoint, 'status': str(e.status)})
+                headers = {'Retry-After': str(e.retry_after)}
+                if html and not _is_binary_upload():
+                    page = await render_template('index.html', prediction_text=f"⏳ {e} Please retry shortly.")
+                    return page, e.status, headers
+                return jsonify({'error': str(e), 'retry_after': e.retry_after}), e.status, headers
+            with ticket:
+                g.admission = ticket
+                return await view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def request_deadline():
+    ticket = g.get('admission')
+    return ticket.deadline if ticket is not None else None
+
+
+async def get_result(image_bytes, deadline=None):
+    """Async twin of app.getResultFromBytes()"""
+    loop = asyncio.get_running_loop()
+    # Hashing and the cache (SQLite when PREDICTION_CACHE_DB is set) stay off the event loop too
+    cache_key, cached = await loop.run_in_executor(preprocess_pool, sync_app.lookup_cache, image_bytes)
+    if cached is not None:
+        return sync_app.interpret(cached)
+
+    if sync_app.inference_client is not None:
+        prediction = await loop.run_in_executor(preprocess_pool, sync_app.predict_via_server, image_bytes, deadline)
+        return await loop.run_in_executor(preprocess_pool, sync_app.store_result, cache_key, prediction)
+
+    input_img = await loop.run_in_executor(preprocess_pool, sync_app.preprocess_upload, image_bytes, None, deadline)
+
+    with metrics.stage('inference'):
+        if deadline is not None:
+            deadline.check('inference')
+        if sync_app.batch_scheduler is not None:
+            prediction = await asyncio.wrap_future(sync_app.batch_scheduler.submit(input_img, deadline))
+        else:
+            prediction = (await loop.run_in_executor(inference_pool, sync_app.predict_batch, input_img))[0]
+
+    return await loop.run_in_executor(preprocess_pool, sync_app.store_result, cache_key, prediction)
+
+
+async def get_result_tta(image_bytes, variants=TTA_VARIANTS, deadline=None):
+    """app.getResultTTA() on the preprocessing pool: (label, percentage, uncertainty)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(preprocess_pool, sync_app.getResultTTA, image_bytes, variants, deadline)
+
+
+def _is_binary_upload():
+    content_type = (request.mimetype or '').lower()
+    return content_type == 'application/octet-stream' or content_type.startswith('image/')
+
+
+async def _read_upload():
+    """(filename, image bytes) from a raw body or the "image" form field; bytes is None if missing"""
+    if _is_binary_upload():
+        image_bytes = await request.get_data(cache=False)
+        filename = secure_filename(unquote(request.headers.get('X-Filename', '')))
+        return filename, image_bytes or None
+
+    files = await request.files
+    f = files.get('image')
+    if f is None or f.filename == '':
+        return None, None
+    return secure_filename(f.filename), f.read()
+
+
+def _serve(resource):
+    status, headers, body = resource.respond(request.headers.get('Accept-Encoding'),
+                                             request.headers.get('If-None-Match'))
+    return Response(body, status=status, headers=headers)
+
+
+@app.route('/', methods=['GET'])
+async def index():
+    return _serve(sync_app.index_page.html)
+
+
+@app.route('/assets/<name>', methods=['GET'])
+async def asset(name):
+    resource = sync_app.index_page.assets.get(name)
+    if resource is None:
+        return jsonify({'error': 'Not found'}), 404
+    return _serve(resource)
+
+
+async def _predict_json(req, image_bytes, filename):
+    """Twin of app._predict_json(): ?tta=K (or an X-TTA-Variants header) asks for K augmented variants"""
+    try:
+        variants = parse_variants(request.args.get('tta') or request.headers.get('X-TTA-Variants') or TTA_VARIANTS)
+        if variants > 1:
+            label, percentage, uncertainty = await get_result_tta(image_bytes, variants, request_deadline())
+            sync_app.save_upload_async(filename, image_bytes)
+            return jsonify({'prediction': label, 'percentage': percentage, 'confidence': percentage,
+                            'uncertainty': uncertainty, 'tta_variants': variants})
+        label, percentage = await get_result(image_bytes, request_deadline())
+    except Exception as e:
+        req.fail(e)
+        return jsonify({'error': f'Error processing image: {str(e)}'}), status_for(e)
+    sync_app.save_upload_async(filename, image_bytes)
+    return jsonify({'prediction': label, 'percentage': percentage, 'confidence': percentage})
+
+
+@app.route('/predict', methods=['POST'])
+@admitted(html=True)
+async def predict():
+    with metrics.request('predict') as req:
+        binary = _is_binary_upload()
+        filename, image_bytes = await _read_upload()
+        if image_bytes is None:
+            req.fail('NoFile')
+            if binary:
+                return jsonify({'error': 'No request body provided'}), 400
+            return await render_template('index.html', prediction_text="⚠️ No file uploaded.")
+        if binary:
+            return await _predict_json(req, image_bytes, filename)
+
+        try:
+            if TTA_VARIANTS > 1:
+                label, percentage, uncertainty = await get_result_tta(image_bytes, deadline=request_deadline())
+                result_text = f"{label} ({percentage}% ± {uncertainty}%)"
+            else:
+                label, percentage = await get_result(image_bytes, request_deadline())
+                result_text = f"{label} ({percentage}%)"
+        except Exception as e:
+            req.fail(e)
+            return await render_template('index.html', prediction_text=f"❌ Error: {str(e)}"), status_for(e)
+
+        filename = sync_app.save_upload_async(filename, image_bytes)  # validated by now
+        return await render_template('index.html', prediction_text=result_text,
+                                     image_name=filename, percentage=percentage)
+
+
+@app.route('/api/predict', methods=['POST'])
+@admitted()
+async def api_predict():
+    with metrics.request('api_predict') as req:
+        filename, image_bytes = await _read_upload()
+        if image_bytes is None:
+            req.fail('NoFile')
+            return jsonify({'error': 'No image uploaded. Send the file as the request body or an "image" form field.'}), 400
+        return await _predict_json(req, image_bytes, filename)
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    if not metrics.enabled:
+        return Response('# metrics disabled (METRICS_ENABLED=0)\n', status=404, mimetype='text/plain')
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/admission_stats', methods=['GET'])
+async def admission_stats():
+    return jsonify({'enabled': admission.enabled, **admission.stats()})
+
+
+@app.route('/model_status', methods=['GET'])
+async def model_status():
+    status = sync_app.model_loader.status()
+    return jsonify(status), 200 if status['state'] == 'ready' else 503
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
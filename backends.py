@@ -0,0 +1,237 @@
+"""
+Inference backends
+Lets app.py and api/predict.py serve the same model through Keras, the TFLite interpreter or ONNX Runtime
+"""
+import os
+import threading
+
+import numpy as np
+
+BACKENDS = ('keras', 'tflite', 'onnx')
+
+
+# Batch sizes the compiled Keras function is traced for; other sizes are padded up
+DEFAULT_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+
+def bucket_for(n, buckets):
+    """Smallest bucket that holds n rows (the largest bucket if none does)"""
+    for bucket in buckets:
+        if bucket >= n:
+            return bucket
+    return buckets[-1]
+
+
+def pad_to_bucket(batch, buckets):
+    """Zero-pad batch along axis 0 to its bucket size; returns (padded, bucket)"""
+    bucket = bucket_for(batch.shape[0], buckets)
+    if batch.shape[0] == bucket:
+        return batch, bucket
+    padded = np.zeros((bucket,) + batch.shape[1:], dtype=batch.dtype)
+    padded[:batch.shape[0]] = batch
+    return padded, bucket
+
+
+def keras_options_from_env():
+    """KERAS_COMPILED=0 falls back to model.predict(); KERAS_BATCH_BUCKETS / KERAS_JIT_COMPILE tune the compiled path"""
+    if os.environ.get('KERAS_COMPILED', '1') != '1':
+        return {}
+    buckets = os.environ.get('KERAS_BATCH_BUCKETS')
+    return {
+        'buckets': tuple(int(b) for b in buckets.split(',')) if buckets else DEFAULT_BUCKETS,
+        'jit_compile': os.environ.get('KERAS_JIT_COMPILE', '0') == '1',
+    }
+
+
+class KerasBackend:
+    """Run a Keras model with model.predict(), or through tf.function graphs traced per batch-size bucket
+
+    With buckets, each bucket gets a concrete function with a fixed input signature (optionally
+    XLA-compiled); inputs are padded to the nearest bucket, so calls never retrace and skip
+    predict()'s per-call data adapter and callback setup.
+    """
+    name = 'keras'
+
+    def __init__(self, model, buckets=None, jit_compile=False):
+        self.model = model
+        self.buckets = tuple(sorted(set(buckets))) if buckets else ()
+        self.jit_compile = jit_compile
+        self._functions = {}
+        if self.buckets:
+            self._compile()
+
+    @classmethod
+    def load(cls, model_path, **options):
+        from tensorflow.keras.models import load_model
+        return cls(load_model(model_path), **options)
+
+    def _trace(self, bucket):
+        import tensorflow as tf
+        if not hasattr(self, '_graph_fn'):
+            self._graph_fn = tf.function(lambda x: self.model(x, training=False), jit_compile=self.jit_compile)
+        input_shape = tuple(self.model.input_shape[1:])
+        return self._graph_fn.get_concrete_function(tf.TensorSpec((bucket,) + input_shape, tf.float32))
+
+    def _compile(self):
+        for bucket in self.buckets:
+            self._functions[bucket] = self._trace(bucket)
+
+    def warm_up(self):
+        """Run every traced bucket once so no request pays for the first execution"""
+        if not self._functions:
+            return
+        input_shape = tuple(self.model.input_shape[1:])
+        for bucket, fn in self._functions.items():
+            fn(np.zeros((bucket,) + input_shape, dtype=np.float32))
+
+    def predict(self, batch):
+        if not self._functions:
+            return np.asarray(self.model.predict(batch, verbose=0))
+
+        batch = np.asarray(batch, dtype=np.float32)
+        largest = self.buckets[-1]
+        outputs = []
+        for start in range(0, batch.shape[0], largest):
+            chunk = batch[start:start + largest]
+            padded, bucket = pad_to_bucket(chunk, self.buckets)
+            outputs.append(np.asarray(self._functions[bucket](padded))[:chunk.shape[0]])
+        return outputs[0] if len(outputs) == 1 else np.concatenate(outputs)
+
+
+def _tflite_interpreter_class():
+    """Prefer the standalone tflite-runtime wheel, fall back to the interpreter bundled with TensorFlow"""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        from tensorflow.lite import Interpreter
+    return Interpreter
+
+
+class TFLiteBackend:
+    """Run a .tflite model (float32, float16 or int8 quantized) with the TFLite interpreter"""
+    name = 'tflite'
+
+    def __init__(self, model_path=None, model_content=None, num_threads=None):
+        if model_path is None and model_content is None:
+            raise ValueError("TFLiteBackend needs a model_path or model_content")
+        Interpreter = _tflite_interpreter_class()
+        self.interpreter = Interpreter(model_path=model_path, model_content=model_content,
+                                       num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input['shape'][0])
+        # The interpreter keeps per-invocation state, so calls are serialized
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, model_path):
+        num_threads = os.environ.get('TFLITE_NUM_THREADS')
+        return cls(model_path=model_path, num_threads=int(num_threads) if num_threads else None)
+
+    def _resize(self, batch_size):
+        if batch_size == self._batch_size:
+            return
+        shape = list(self._input['shape'])
+        shape[0] = batch_size
+        self.interpreter.resize_tensor_input(self._input['index'], shape)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            self._resize(batch.shape[0])
+            self.interpreter.set_tensor(self._input['index'], quantize(batch, self._input))
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output['index'])
+            return dequantize(output, self._output)
+
+
+def onnx_options_from_env():
+    """ONNX_INTRA_OP_THREADS / ONNX_INTER_OP_THREADS size the thread pools; ONNX_MEMORY_ARENA=0 and
+    ONNX_MEMORY_PATTERN=0 trade some speed for a smaller, non-growing memory footprint"""
+    options = {
+        'enable_cpu_mem_arena': os.environ.get('ONNX_MEMORY_ARENA', '1') == '1',
+        'enable_mem_pattern': os.environ.get('ONNX_MEMORY_PATTERN', '1') == '1',
+    }
+    for key, name in (('intra_op_threads', 'ONNX_INTRA_OP_THREADS'), ('inter_op_threads', 'ONNX_INTER_OP_THREADS')):
+        if os.environ.get(name):
+            options[key] = int(os.environ[name])
+    return options
+
+
+class OnnxBackend:
+    """Run an .onnx export of the model with ONNX Runtime on the CPU
+
+    The session applies all graph optimizations when it loads; session.run() is thread-safe,
+    so concurrent requests are not serialized.
+    """
+    name = 'onnx'
+
+    def __init__(self, model_path, intra_op_threads=None, inter_op_threads=None,
+                 enable_cpu_mem_arena=True, enable_mem_pattern=True):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.enable_cpu_mem_arena = enable_cpu_mem_arena
+        options.enable_mem_pattern = enable_mem_pattern
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self._input = self.session.get_inputs()[0].name
+        self._output = self.session.get_outputs()[0].name
+
+    @classmethod
+    def load(cls, model_path):
+        return cls(model_path, **onnx_options_from_env())
+
+    def predict(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run([self._output], {self._input: batch})[0]
+
+
+def quantize(values, details):
+    """Map float inputs onto an integer input tensor using its (scale, zero_point)"""
+    dtype = details['dtype']
+    if dtype == np.float32:
+        return values
+    scale, zero_point = details['quantization']
+    info = np.iinfo(dtype)
+    return np.clip(np.round(values / scale + zero_point), info.min, info.max).astype(dtype)
+
+
+def dequantize(values, details):
+    """Map an integer output tensor back to floats"""
+    if values.dtype == np.float32:
+        return values
+    scale, zero_point = details['quantization']
+    return (values.astype(np.float32) - zero_point) * scale
+
+
+def load_backend(model_path, backend=None):
+    """Load model_path with the backend named by MODEL_BACKEND (default: inferred from the file extension)
+
+    A directory written by model_loader.export_mmap_artifact() is loaded with the Keras backend.
+    """
+    backend = backend or os.environ.get('MODEL_BACKEND')
+    if not backend:
+        backend = {'.tflite': 'tflite', '.onnx': 'onnx'}.get(os.path.splitext(model_path)[1], 'keras')
+    backend = backend.lower()
+
+    if backend == 'keras':
+        from model_loader import is_mmap_artifact, load_mmap_model
+        options = keras_options_from_env()
+        if is_mmap_artifact(model_path):
+            return KerasBackend(load_mmap_model(model_path), **options)
+        return KerasBackend.load(model_path, **options)
+    if backend == 'tflite':
+        return TFLiteBackend.load(model_path)
+    if backend == 'onnx':
+        return OnnxBackend.load(model_path)
+    raise ValueError(f"Unknown MODEL_BACKEND '{backend}'. Expected one of: {', '.join(BACKENDS)}")
@@ -0,0 +1,211 @@
+"""
+Dynamic micro-batching for model inference
+Queues preprocessed images from concurrent requests and runs them through the model in one forward pass
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from deadlines import DeadlineExceeded
+
+
+class _PendingItem:
+    __slots__ = ('image', 'future', 'enqueued_at', 'deadline')
+
+    def __init__(self, image, deadline=None):
+        self.image = image
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        self.deadline = deadline
+
+
+class BatchScheduler:
+    """Collect single images into batches of up to max_batch_size, waiting at most max_wait_ms"""
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10, stats_window=1000, on_batch=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.predict_fn = predict_fn
+        # Optional hook: on_batch(batch_size, queue_wait_seconds_list, inference_seconds)
+        self.on_batch = on_batch
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = max(float(max_wait_ms), 0.0) / 1000.0
+
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        # Tuning statistics
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = {}
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._expired = 0
+        self._wait_times = deque(maxlen=stats_window)
+        self._inference_times = deque(maxlen=stats_window)
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return self
+            self._running = True
+        self._spawn()
+        return self
+
+    def _spawn(self):
+        self._thread = threading.Thread(target=self._run, name='batch-scheduler', daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        # Threads don't survive fork (gunicorn --preload): give the child fresh locks and its own thread
+        self._cond = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._pending.clear()
+        if self._running:
+            self._spawn()
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, image, deadline=None):
+        """Queue one image of shape (H, W, C) or (1, H, W, C); returns a Future for its output row
+
+        An item whose deadline (deadlines.Deadline) passes while it waits is dropped from its
+        batch and its future fails with DeadlineExceeded.
+        """
+        image = np.asarray(image)
+        if image.ndim == 4:
+            if image.shape[0] != 1:
+                raise ValueError(f"Expected a single image, got batch of {image.shape[0]}")
+            image = image[0]
+
+        item = _PendingItem(image, deadline)
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("BatchScheduler is not running. Call start() first.")
+            self._pending.append(item)
+            self._cond.notify()
+        return item.future
+
+    def predict(self, image, timeout=None, deadline=None):
+        """Blocking helper: submit one image and wait for its prediction row"""
+        return self.submit(image, deadline).result(timeout)
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def stats(self):
+        with self._stats_lock:
+            waits = np.array(self._wait_times, dtype=np.float64) * 1000.0
+            infer = np.array(self._inference_times, dtype=np.float64) * 1000.0
+            histogram = dict(sorted(self._batch_sizes.items()))
+            batches, items, errors, expired = self._batches, self._items, self._errors, self._expired
+
+        def summary(values):
+            if values.size == 0:
+                return {'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+            return {
+                'mean': round(float(values.mean()), 3),
+                'p50': round(float(np.percentile(values, 50)), 3),
+                'p95': round(float(np.percentile(values, 95)), 3),
+                'max': round(float(values.max()), 3),
+            }
+
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'queue_depth': self.queue_depth(),
+            'batches': batches,
+            'items': items,
+            'errors': errors,
+            'expired': expired,
+            'mean_batch_size': round(items / batches, 3) if batches else 0.0,
+            'batch_size_histogram': histogram,
+            'queue_wait_ms': summary(waits),
+            'inference_ms': summary(infer),
+        }
+
+    def _next_batch(self):
+        """Block until at least one item is queued, then gather more until full or max_wait elapses
+
+        Returns None once the scheduler is stopped; expired items are failed and left out.
+        """
+        with self._cond:
+            while self._running and not self._pending:
+                self._cond.wait()
+            if not self._pending:
+                return None
+
+            deadline = self._pending[0].enqueued_at + self.max_wait
+            while self._running and len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            count = min(len(self._pending), self.max_batch_size)
+            batch = [self._pending.popleft() for _ in range(count)]
+
+        live = []
+        for item in batch:
+            if item.deadline is not None and item.deadline.expired():
+                item.future.set_exception(DeadlineExceeded('inference'))
+                with self._stats_lock:
+                    self._expired += 1
+            else:
+                live.append(item)
+        return live
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if not batch:
+                continue  # every item had expired
+
+            started = time.monotonic()
+            try:
+                outputs = np.asarray(self.predict_fn(np.stack([item.image for item in batch])))
+                if outputs.shape[0] != len(batch):
+                    raise ValueError(f"Model returned {outputs.shape[0]} rows for batch of {len(batch)}")
+            except Exception as e:
+                for item in batch:
+                    item.future.set_exception(e)
+                with self._stats_lock:
+                    self._errors += len(batch)
+                continue
+            finished = time.monotonic()
+
+            for i, item in enumerate(batch):
+                item.future.set_result(outputs[i])
+
+            waits = [started - item.enqueued_at for item in batch]
+            with self._stats_lock:
+                size = len(batch)
+                self._batches += 1
+                self._items += size
+                self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+                self._wait_times.extend(waits)
+                self._inference_times.append(finished - started)
+
+            if self.on_batch is not None:
+                try:
+                    self.on_batch(size, waits, finished - started)
+                except Exception as e:
+                    print(f"Batch hook failed: {e}")
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+Reproducible inference benchmark over the bundled sample X-rays
+
+Measures decode, preprocess, base64/JSON and forward-pass time separately, sweeps batch
+sizes and thread counts, drives app.getResult / api.predict.getResult / api.predict.handler
+end to end, and writes p50/p95/p99 latency, images/sec and peak memory as JSON.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json --max-regression 0.15   # regression gate
+    python benchmark.py --ab-compiled --targets none                  # predict() vs tf.function
+    python benchmark.py --explain --targets none                      # Grad-CAM cost vs predict()
+    python benchmark.py --null-model --targets none --cold-start      # fresh-process api/predict.py
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Measure the work, not the prediction cache
+os.environ.setdefault('PREDICTION_CACHE_SIZE', '0')
+
+import numpy as np
+
+from preprocessing import allocate_batch, decode_grayscale, preprocess_batch, resize_into
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'uploads')
+
+
+class NullBackend:
+    """Stand-in model for measuring everything except the forward pass"""
+    name = 'null'
+
+    def predict(self, batch):
+        return np.zeros((batch.shape[0], 1), dtype=np.float32)
+
+
+class BenchRequest:
+    """Vercel-style request object for api.predict.handler"""
+
+    def __init__(self, body, headers=None):
+        self.data = {'method': 'POST', 'body': body, 'headers': headers or {}}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+
+def load_samples(image_dir=SAMPLE_DIR, limit=None):
+    names = sorted(n for n in os.listdir(image_dir) if n.lower().endswith(('.jpg', '.jpeg', '.png')))[:limit]
+    samples = []
+    for name in names:
+        path = os.path.join(image_dir, name)
+        with open(path, 'rb') as f:
+            samples.append((path, f.read()))
+    return samples
+
+
+def summarize(seconds, images=None):
+    """Latency percentiles in ms (+ images/sec when the number of images is known)"""
+    ms = np.asarray(seconds, dtype=np.float64) * 1000.0
+    if ms.size == 0:
+        return {}
+    summary = {
+        'count': int(ms.size),
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+    }
+    if images:
+        summary['images_per_sec'] = round(images / float(np.sum(seconds)), 2)
+    return summary
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def bench_stages(samples, backend, repeats):
+    """Per-image time of each stage of the single-image prediction path"""
+    stages = {'decode': [], 'preprocess': [], 'base64_json': [], 'forward': []}
+    buffer = allocate_batch(1)
+    for _ in range(repeats):
+        for _, data in samples:
+            payload = json.dumps({'image': 'data:image/jpeg;base64,' + base64.b64encode(data).decode()})
+            t, _ = timed(lambda: base64.b64decode(json.loads(payload)['image'].split(',', 1)[1]))
+            stages['base64_json'].append(t)
+
+            t, image = timed(decode_grayscale, data)
+            stages['decode'].append(t)
+            t, _ = timed(resize_into, image, buffer[0])
+            stages['preprocess'].append(t)
+            t, _ = timed(backend.predict, buffer)
+            stages['forward'].append(t)
+    return {name: summarize(values) for name, values in stages.items()}
+
+
+def bench_batch_sizes(samples, backend, batch_sizes, repeats):
+    """Forward-pass latency and throughput per batch size (inputs preprocessed once)"""
+    inputs = preprocess_batch([data for _, data in samples])
+    results = {}
+    for size in batch_sizes:
+        batch = inputs[np.arange(size) % len(inputs)]
+        backend.predict(batch)  # warm up this shape
+        times = [timed(backend.predict, batch)[0] for _ in range(repeats)]
+        results[str(size)] = summarize(times, images=size * repeats)
+    return results
+
+
+def bench_compiled_ab(samples, model_path, batch_sizes, repeats):
+    """A/B of Keras model.predict() against the bucketed tf.function path (and XLA) on the same model"""
+    from backends import DEFAULT_BUCKETS, KerasBackend, load_backend
+    model = load_backend(model_path, 'keras').model
+    buckets = tuple(sorted(set(DEFAULT_BUCKETS) | set(batch_sizes)))
+
+    variants = {'predict': KerasBackend(model)}
+    for name, jit in (('compiled', False), ('compiled_xla', True)):
+        try:
+            start = time.perf_counter()
+            backend = KerasBackend(model, buckets=buckets, jit_compile=jit)
+            backend.warm_up()
+            print(f"{name}: traced {len(buckets)} buckets in {time.perf_counter() - start:.1f}s")
+            variants[name] = backend
+        except Exception as e:
+            print(f"Skipping {name}: {e}")
+
+    results = {name: bench_batch_sizes(samples, backend, batch_sizes, repeats) for name, backend in variants.items()}
+    for name in variants:
+        if name != 'predict':
+            results[f'{name}_speedup'] = {
+                size: round(results['predict'][size]['p50_ms'] / results[name][size]['p50_ms'], 2)
+                for size in results[name]}
+    return results
+
+
+def bench_tta(samples, backend, variant_counts, repeats):
+    """Per-image latency of test-time augmentation with K variants (augment + one K-row forward pass)"""
+    from tta import predict_tta
+    inputs = preprocess_batch([data for _, data in samples])
+    results = {}
+    for k in variant_counts:
+        predict_tta(backend.predict, inputs[:1], k, allow_flip=True)  # warm up this batch size
+        times = [timed(predict_tta, backend.predict, inputs[i:i + 1], k, True)[0]
+                 for _ in range(repeats) for i in range(len(inputs))]
+        results[str(k)] = summarize(times, images=len(times))
+    if '1' in results:
+        for k, summary in results.items():
+            summary['cost_vs_single'] = round(summary['p50_ms'] / results['1']['p50_ms'], 2)
+    return results
+
+
+def bench_explain(samples, backend, batch_sizes, repeats):
+    """Grad-CAM (gradient pass + overlay + encode) per batch size, against a plain forward pass"""
+    from gradcam import GradCAM, encode, overlay
+    gradcam = GradCAM(backend.model)
+    inputs = preprocess_batch([data for _, data in samples])
+
+    def explain(batch):
+        cams, _ = gradcam(batch)
+        return [encode(image) for image in overlay(batch, cams)]
+
+    results = {}
+    for size in batch_sizes:
+        batch = np.resize(inputs, (size,) + inputs.shape[1:])
+        explain(batch)  # trace this batch size
+        backend.predict(batch)
+        explain_times = [timed(explain, batch)[0] for _ in range(repeats)]
+        predict_times = [timed(backend.predict, batch)[0] for _ in range(repeats)]
+        summary = summarize(explain_times, images=size * repeats)
+        summary['predict_p50_ms'] = summarize(predict_times)['p50_ms']
+        summary['added_ms'] = round(summary['p50_ms'] - summary['predict_p50_ms'], 3)
+        results[str(size)] = summary
+    return results
+
+
+# Runs in a fresh interpreter: import api/predict.py, answer one request, report timings
+_COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import predict
+imported = time.perf_counter()
+response = predict.handler(json.loads(sys.stdin.read()))
+done = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'request_ms': (done - imported) * 1000,
+                  'status': response['statusCode'],
+                  'heavy_modules': [m for m in ('numpy', 'cv2', 'tensorflow') if m in sys.modules]}))
+"""
+
+
+def cold_start_requests(samples):
+    """One request of each kind the serverless handler sees, as Vercel-style dicts"""
+    image = base64.b64encode(samples[0][1]).decode()
+    return {
+        'options': {'method': 'OPTIONS', 'headers': {}},
+        'get_405': {'method': 'GET', 'headers': {}},
+        'empty_400': {'method': 'POST', 'body': '', 'headers': {}},
+        'bad_json_400': {'method': 'POST', 'body': '{not json', 'headers': {}},
+        'predict': {'method': 'POST', 'body': json.dumps({'image': image}), 'headers': {}},
+    }
+
+
+def bench_cold_start(samples, repeats):
+    """Import time and first-request latency of api/predict.py in a fresh process, per request type"""
+    api_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+    results = {}
+    for name, request in cold_start_requests(samples).items():
+        runs = []
+        for _ in range(repeats):
+            output = subprocess.run([sys.executable, '-c', _COLD_START_SCRIPT, api_dir], input=json.dumps(request),
+                                    capture_output=True, text=True, timeout=600)
+            runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+        results[name] = {
+            'import_ms': round(float(np.median([r['import_ms'] for r in runs])), 1),
+            'request_ms': round(float(np.median([r['request_ms'] for r in runs])), 1),
+            'status': runs[-1]['status'],
+            'heavy_modules': runs[-1]['heavy_modules'],
+        }
+    return results
+
+
+def bench_threads(samples, fn, thread_counts, repeats):
+    """Concurrent end-to-end calls of fn(sample) per thread count"""
+    results = {}
+    work = samples * repeats
+    for threads in thread_counts:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            start = time.perf_counter()
+            latencies = list(pool.map(lambda sample: timed(fn, sample)[0], work))
+            wall = time.perf_counter() - start
+        summary = summarize(latencies)
+        summary['images_per_sec'] = round(len(work) / wall, 2)
+        results[str(threads)] = summary
+    return results
+
+
+def entry_points(targets, backend, null_model):
+    """Callables taking a (path, bytes) sample for each requested entry point"""
+    calls = {}
+    if {'api_getResult', 'api_handler'} & set(targets):
+        import api.predict as api_predict
+        if null_model:
+            api_predict.model = backend
+        api_predict.load_model_once()
+
+        calls['api_getResult'] = lambda sample: api_predict.getResult(sample[1])
+        calls['api_handler'] = lambda sample: api_predict.handler(BenchRequest(json.dumps(
+            {'image': 'data:image/jpeg;base64,' + base64.b64encode(sample[1]).decode()})))
+        calls['api_handler_binary'] = lambda sample: api_predict.handler(BenchRequest(
+            sample[1], {'Content-Type': 'application/octet-stream'}))
+
+    if 'app_getResult' in targets:
+        if null_model or not os.path.exists(os.environ.get('MODEL_PATH', 'model.keras')):
+            print("Skipping app_getResult: app.py needs the real model file")
+        else:
+            import app
+            app.model_loader.get()
+            calls['app_getResult'] = lambda sample: app.getResult(sample[0])
+
+    return {name: fn for name, fn in calls.items() if name in targets or name.startswith(tuple(targets))}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    samples = load_samples(args.images, args.limit)
+    if not samples:
+        raise SystemExit(f"No images found in {args.images}")
+
+    if args.null_model:
+        backend = NullBackend()
+    else:
+        from backends import load_backend
+        backend = load_backend(args.model)
+    backend.predict(allocate_batch(1))  # warm up
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'backend': backend.name,
+            'images': len(samples),
+            'repeats': args.repeats,
+        },
+        'stages': bench_stages(samples, backend, args.repeats),
+        'batch_sizes': bench_batch_sizes(samples, backend, args.batch_sizes, args.repeats),
+        'entry_points': {},
+    }
+
+    if args.ab_compiled:
+        if args.null_model:
+            print("Skipping --ab-compiled: needs the real Keras model")
+        else:
+            report['ab_compiled'] = bench_compiled_ab(samples, args.model, args.batch_sizes, args.repeats)
+
+    if args.tta:
+        report['tta'] = bench_tta(samples, backend, sorted(set([1] + args.tta)), args.repeats)
+
+    if args.explain:
+        if not hasattr(backend, 'model'):
+            print("Skipping --explain: Grad-CAM needs the Keras backend")
+        else:
+            report['explain'] = bench_explain(samples, backend, args.batch_sizes, args.repeats)
+
+    if args.cold_start:
+        report['cold_start'] = bench_cold_start(samples, args.repeats)
+
+    for name, fn in entry_points(args.targets, backend, args.null_model).items():
+        fn(samples[0])  # warm up
+        report['entry_points'][name] = bench_threads(samples, fn, args.threads, args.repeats)
+
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+def flatten(report, prefix=''):
+    """{'stages': {'forward': {'p95_ms': 3}}} -> {'stages.forward.p95_ms': 3}"""
+    flat = {}
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def check_gate(report, thresholds=None, baseline=None, max_regression=0.1):
+    """Return a list of failures: absolute thresholds ({"metric.path": max}) and/or regressions vs a baseline"""
+    failures = []
+    flat = flatten(report)
+
+    for metric, limit in (thresholds or {}).items():
+        if metric not in flat:
+            failures.append(f"{metric}: missing from report")
+        elif flat[metric] > limit:
+            failures.append(f"{metric}: {flat[metric]} > {limit}")
+
+    if baseline:
+        previous = flatten(baseline)
+        for metric, value in flat.items():
+            old = previous.get(metric)
+            if not old or metric.startswith('meta.'):
+                continue
+            if metric.endswith(('_ms', 'peak_rss_mb')) and value > old * (1 + max_regression):
+                failures.append(f"{metric}: {value} vs baseline {old} (+{(value / old - 1):.0%})")
+            elif metric.endswith('images_per_sec') and value < old * (1 - max_regression):
+                failures.append(f"{metric}: {value} vs baseline {old} ({(value / old - 1):.0%})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pneumonia inference on the sample images")
+    parser.add_argument('--images', default=SAMPLE_DIR, help="Directory of sample X-rays")
+    parser.add_argument('--limit', type=int, help="Use only the first N images")
+    parser.add_argument('--model', default=os.environ.get('MODEL_PATH', 'model.keras'))
+    parser.add_argument('--null-model', action='store_true', help="Skip the real model (measures everything else)")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--targets', nargs='+', default=['app_getResult', 'api_getResult', 'api_handler'],
+                        help="Entry points to drive end to end")
+    parser.add_argument('--ab-compiled', action='store_true',
+                        help="Compare model.predict() with the bucketed tf.function / XLA paths")
+    parser.add_argument('--tta', type=int, nargs='+', help="Measure test-time augmentation with these variant counts")
+    parser.add_argument('--explain', action='store_true',
+                        help="Measure Grad-CAM explanations against plain prediction per batch size")
+    parser.add_argument('--cold-start', action='store_true',
+                        help="Measure import and first-request time of api/predict.py per request type")
+    parser.add_argument('--output', help="Write the JSON report here (default: stdout)")
+    parser.add_argument('--gate', help="JSON file of {\"metric.path\": max_value} thresholds")
+    parser.add_argument('--baseline', help="Previous report to compare against")
+    parser.add_argument('--max-regression', type=float, default=0.1,
+                        help="Allowed relative slowdown vs --baseline (default 0.1 = 10%%)")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+        print(f"Benchmark report written to {args.output}")
+    else:
+        print(text)
+
+    thresholds = None
+    if args.gate:
+        with open(args.gate) as f:
+            thresholds = json.load(f)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    failures = check_gate(report, thresholds, baseline, args.max_regression)
+    if failures:
+        print("\nBenchmark gate FAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        raise SystemExit(1)
+    if thresholds or baseline:
+        print("\nBenchmark gate passed")
+
+
+if __name__ == "__main__":
+    main()
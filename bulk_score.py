@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Offline bulk scoring of a directory, zip or tar of chest X-rays
+
+Decoding runs in a process pool, decoded chunks wait in a bounded prefetch queue and the
+model scores them in large batches. Results are appended to CSV, JSONL or a Parquet dataset
+as they are produced; rerunning with the same output skips images that are already in it.
+
+    python bulk_score.py xrays.zip --output scores.csv
+    python bulk_score.py /data/xrays --output scores.jsonl --batch-size 128 --workers 8
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from calibration import Calibration, load_calibration
+from preprocessing import IMAGE_SIZE, allocate_batch, decode_checked, resize_gray
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+OUTPUT_FORMATS = ('csv', 'jsonl', 'parquet')
+FIELDS = ('name', 'probability', 'label', 'percentage', 'error')
+
+
+def iter_images(source, skip=()):
+    """Yield (name, payload) for every image in source, in a stable order
+
+    payload is a file path for directories and the member bytes for zip/tar archives.
+    Names in skip are not read at all.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(root, filename)
+                    name = os.path.relpath(path, source)
+                    if name not in skip:
+                        yield name, path
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                if not info.is_dir() and name.lower().endswith(IMAGE_EXTENSIONS) and name not in skip:
+                    yield name, archive.read(info)
+    elif tarfile.is_tarfile(source):
+        # Stream mode reads compressed tars front to back without seeking
+        with tarfile.open(source, 'r|*') as archive:
+            for member in archive:
+                name = member.name
+                if member.isfile() and name.lower().endswith(IMAGE_EXTENSIONS) and name not in skip:
+                    yield name, archive.extractfile(member).read()
+    else:
+        raise ValueError(f"{source} is not a directory, zip or tar archive")
+
+
+def decode_chunk(items, size=IMAGE_SIZE):
+    """Decode and resize a list of (name, payload) into (names, uint8 (n, size, size) array, errors)
+
+    Runs in the worker processes; returning uint8 keeps the transfer back 4x smaller than float32.
+    """
+    pixels = np.zeros((len(items), size, size), dtype=np.uint8)
+    names, errors = [], []
+    for i, (name, payload) in enumerate(items):
+        names.append(name)
+        try:
+            if isinstance(payload, str):
+                with open(payload, 'rb') as f:
+                    payload = f.read()
+            image = decode_checked(payload, size=size)
+        except (OSError, ValueError) as e:
+            errors.append(str(e))
+            continue
+        resize_gray(image, size, size, pixels[i])
+        errors.append(None)
+    return names, pixels, errors
+
+
+def _init_worker():
+    # One OpenCV thread per worker process; the pool already provides the parallelism
+    import cv2
+    cv2.setNumThreads(1)
+
+
+def _chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def decoded_chunks(items, chunk_size=16, workers=None, prefetch=None):
+    """decode_chunk() over items in order, keeping at most `prefetch` chunks in flight
+
+    workers=0 decodes in the calling process.
+    """
+    chunks = _chunks(items, chunk_size)
+    if workers == 0:
+        for chunk in chunks:
+            yield decode_chunk(chunk)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    prefetch = max(prefetch or workers * 4, 1)
+    # spawn: never fork a process that may already hold TensorFlow threads
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(decode_chunk, chunk))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _truncate_partial_line(path):
+    """Drop a half-written last line left by a killed run"""
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            f.truncate(end)
+
+
+class ResultWriter:
+    """Append result rows to CSV / JSONL, or to a directory of Parquet parts
+
+    Rows already present in the output are the checkpoint: done() lists their names.
+    """
+
+    def __init__(self, path, fmt=None, parquet_rows=4096):
+        self.path = path
+        self.format = (fmt or self._infer_format(path)).lower()
+        if self.format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format '{self.format}'. Expected one of: {', '.join(OUTPUT_FORMATS)}")
+        self.parquet_rows = parquet_rows
+        self._buffer = []
+        self._file = None
+        self._csv = None
+
+    @staticmethod
+    def _infer_format(path):
+        ext = os.path.splitext(path)[1].lower().lstrip('.')
+        return {'json': 'jsonl', 'ndjson': 'jsonl', 'pq': 'parquet'}.get(ext, ext or 'csv')
+
+    def done(self):
+        if self.format == 'parquet':
+            if not os.path.isdir(self.path):
+                return set()
+            import pyarrow.parquet as pq
+            names = set()
+            for part in self._parts():
+                names.update(pq.read_table(part, columns=['name']).column('name').to_pylist())
+            return names
+
+        if not os.path.exists(self.path):
+            return set()
+        _truncate_partial_line(self.path)
+        with open(self.path, newline='') as f:
+            if self.format == 'csv':
+                return {row['name'] for row in csv.DictReader(f)}
+            return {json.loads(line)['name'] for line in f if line.strip()}
+
+    def _parts(self):
+        return sorted(os.path.join(self.path, n) for n in os.listdir(self.path) if n.endswith('.parquet'))
+
+    def write(self, rows):
+        if self.format == 'parquet':
+            self._buffer.extend(rows)
+            if len(self._buffer) >= self.parquet_rows:
+                self._flush_parquet()
+            return
+
+        if self._file is None:
+            new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            self._file = open(self.path, 'a', newline='')
+            if self.format == 'csv':
+                self._csv = csv.DictWriter(self._file, fieldnames=FIELDS)
+                if new:
+                    self._csv.writeheader()
+        if self.format == 'csv':
+            self._csv.writerows(rows)
+        else:
+            self._file.writelines(json.dumps(row) + '\n' for row in rows)
+        self._file.flush()
+
+    def _flush_parquet(self):
+        if not self._buffer:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        os.makedirs(self.path, exist_ok=True)
+        table = pa.Table.from_pylist(self._buffer, schema=pa.schema([
+            ('name', pa.string()), ('probability', pa.float32()), ('label', pa.string()),
+            ('percentage', pa.float32()), ('error', pa.string())]))
+        part = os.path.join(self.path, f'part-{len(self._parts()):05d}.parquet')
+        pq.write_table(table, part + '.tmp')
+        os.replace(part + '.tmp', part)  # a part is either complete or absent
+        self._buffer = []
+
+    def close(self):
+        if self.format == 'parquet':
+            self._flush_parquet()
+        elif self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def label_rows(names, probabilities, calibration=None):
+    """Result rows for one scored batch
+
+    probability is the raw model output (so calibration.py can refit from the results);
+    label and percentage are calibrated.
+    """
+    calibration = calibration or Calibration()
+    probabilities = np.asarray(probabilities, dtype=np.float64).reshape(len(names), -1)[:, 0]
+    calibrated = calibration.apply(probabilities)
+    labels = np.where(calibrated > calibration.threshold, "Pneumonia", "Normal")
+    percentages = np.round(calibrated * 100, 2)
+    return [{'name': name, 'probability': round(float(p), 6), 'label': str(label),
+             'percentage': float(pct), 'error': None}
+            for name, p, label, pct in zip(names, probabilities, labels, percentages)]
+
+
+def score(source, writer, predict_fn, batch_size=64, workers=None, prefetch=None, chunk_size=16,
+          calibration=None, progress_seconds=10.0):
+    """Score every image in source that writer does not already hold; returns run statistics"""
+    done = writer.done()
+    stats = {'scored': 0, 'failed': 0, 'skipped': len(done)}
+    if done:
+        print(f"Resuming: {len(done)} images already scored")
+
+    batch = allocate_batch(batch_size)
+    names = []
+    started = last_report = time.perf_counter()
+
+    def flush():
+        if not names:
+            return
+        writer.write(label_rows(names, predict_fn(batch[:len(names)]), calibration))
+        stats['scored'] += len(names)
+        names.clear()
+
+    for chunk_names, pixels, errors in decoded_chunks(iter_images(source, done), chunk_size, workers, prefetch):
+        failed = []
+        for name, image, error in zip(chunk_names, pixels, errors):
+            if error:
+                failed.append({'name': name, 'probability': None, 'label': None, 'percentage': None, 'error': error})
+                continue
+            np.divide(image, np.float32(255.0), out=batch[len(names), ..., 0], dtype=np.float32)
+            names.append(name)
+            if len(names) == batch_size:
+                flush()
+        if failed:
+            writer.write(failed)
+            stats['failed'] += len(failed)
+
+        now = time.perf_counter()
+        if progress_seconds and now - last_report >= progress_seconds:
+            last_report = now
+            print(f"Scored {stats['scored']} images ({stats['scored'] / (now - started):.1f} images/sec)")
+
+    flush()
+    writer.close()
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['images_per_sec'] = round(stats['scored'] / stats['seconds'], 2) if stats['seconds'] else 0.0
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a directory, zip or tar of X-rays with the pneumonia model")
+    parser.add_argument('source', help="Directory, .zip or .tar(.gz) of images")
+    parser.add_argument('--output', required=True, help="Results file (.csv, .jsonl) or Parquet dataset directory")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, help="Output format (default: from the extension)")
+    parser.add_argument('--model', default=os.environ.get('MODEL_PATH', 'model.keras'))
+    parser.add_argument('--backend', help="keras or tflite (default: MODEL_BACKEND / file extension)")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=None, help="Decode processes (default: all cores, 0 = in-process)")
+    parser.add_argument('--prefetch', type=int, default=None, help="Decoded chunks kept ahead of the model")
+    parser.add_argument('--chunk-size', type=int, default=16, help="Images per decode task")
+    parser.add_argument('--threshold', type=float, help="Decision threshold (default: the model's calibration artifact)")
+    args = parser.parse_args()
+
+    from backends import load_backend
+    backend = load_backend(args.model, args.backend)
+    print(f"Loaded {args.model} with the {backend.name} backend")
+    calibration = load_calibration(args.model)
+    if args.threshold is not None:
+        calibration.threshold = args.threshold
+
+    writer = ResultWriter(args.output, args.format)
+    stats = score(args.source, writer, backend.predict, batch_size=args.batch_size, workers=args.workers,
+                  prefetch=args.prefetch, chunk_size=args.chunk_size, calibration=calibration)
+    print(f"Done: {json.dumps(stats)}")
+
+
+if __name__ == "__main__":
+    main()
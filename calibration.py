@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Probability calibration and the decision threshold
+A labelled folder (or archive) of X-rays is scored offline in large batches, streaming through
+the decode pipeline of bulk_score.py so only one score and label per image stay in memory.
+Temperature scaling or isotonic regression is fitted to those scores, and the operating
+threshold is picked for a target sensitivity. The result is a small JSON artifact kept next to
+the model (model.keras -> model.calibration.json) that app.py, api/predict.py and bulk_score.py
+apply to whole batches of sigmoid outputs.
+
+    python calibration.py public/uploads --model model.keras --target-sensitivity 0.95
+    python calibration.py --scores scores.csv --method isotonic --model model.keras
+"""
+import argparse
+import csv
+import json
+import math
+import os
+
+FORMAT = 'pneumonia-calibration-v1'
+METHODS = ('temperature', 'isotonic', 'none')
+
+# Used when a model has no calibration artifact; DECISION_THRESHOLD overrides any threshold
+DEFAULT_THRESHOLD = 0.95
+_EPSILON = 1e-7
+_MAX_KNOTS = 256
+
+
+def label_from_name(name):
+    """1 for pneumonia, 0 for normal, None if the path doesn't say
+
+    Folder names (NORMAL/, PNEUMONIA/) win; otherwise the dataset's file names are used:
+    personN_bacteria_M / personN_virus_M are pneumonia, NORMAL2-IM-... and IM-... are normal.
+    """
+    parts = name.replace('\\', '/').split('/')
+    for folder in parts[:-1]:
+        if folder.upper() == 'NORMAL':
+            return 0
+        if folder.upper() == 'PNEUMONIA':
+            return 1
+    filename = parts[-1].lower()
+    if 'bacteria' in filename or 'virus' in filename:
+        return 1
+    if filename.startswith(('normal', 'im-')):
+        return 0
+    return None
+
+
+def calibration_path(model_path):
+    """Where the artifact for a model lives: alongside it, with the model's extension replaced"""
+    return os.path.splitext(model_path.rstrip('/\\'))[0] + '.calibration.json'
+
+
+def _logits(probabilities):
+    import numpy as np
+    p = np.clip(np.asarray(probabilities, dtype=np.float64), _EPSILON, 1 - _EPSILON)
+    return np.log(p) - np.log1p(-p)
+
+
+def _sigmoid(z):
+    import numpy as np
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+class Calibration:
+    """Maps raw sigmoid outputs to calibrated probabilities and (label, percentage) pairs
+
+    Calibration() is the identity with the default threshold, i.e. the old behaviour.
+    """
+
+    def __init__(self, method='none', threshold=DEFAULT_THRESHOLD, temperature=1.0, knots=None, metadata=None):
+        if method not in METHODS:
+            raise ValueError(f"Unknown calibration method '{method}'. Expected one of: {', '.join(METHODS)}")
+        if method == 'isotonic' and not knots:
+            raise ValueError("Isotonic calibration needs its knots")
+        self.method = method
+        self.threshold = float(threshold)
+        self.temperature = float(temperature)
+        self.knots = knots  # ([x...], [y...]) of the isotonic fit
+        self.metadata = dict(metadata or {})
+
+    def apply(self, probabilities):
+        """Calibrated probabilities for an array of raw sigmoid outputs (any shape)"""
+        import numpy as np
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        if self.method == 'temperature':
+            return _sigmoid(_logits(probabilities) / self.temperature)
+        if self.method == 'isotonic':
+            return np.interp(probabilities, self.knots[0], self.knots[1])
+        return probabilities
+
+    def interpret_batch(self, probabilities):
+        """[(label, percentage), ...] for a batch of raw outputs, in one vectorized pass"""
+        import numpy as np
+        calibrated = self.apply(np.asarray(probabilities).reshape(-1))
+        positive = calibrated > self.threshold
+        percentages = np.round(calibrated * 100, 2)
+        return [("Pneumonia" if p else "Normal", float(pct)) for p, pct in zip(positive, percentages)]
+
+    def interpret(self, probability):
+        """(label, percentage) for one raw output"""
+        return self.interpret_batch([probability])[0]
+
+    def labels(self, probabilities):
+        """Boolean array: which raw outputs are called pneumonia"""
+        return self.apply(probabilities) > self.threshold
+
+    def to_dict(self):
+        data = {'format': FORMAT, 'method': self.method, 'threshold': self.threshold}
+        if self.method == 'temperature':
+            data['temperature'] = self.temperature
+        if self.method == 'isotonic':
+            data['knots'] = {'x': list(self.knots[0]), 'y': list(self.knots[1])}
+        data.update(self.metadata)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('format') != FORMAT:
+            raise ValueError(f"Not a calibration artifact (format {data.get('format')!r})")
+        knots = data.get('knots')
+        metadata = {k: v for k, v in data.items() if k not in ('format', 'method', 'threshold', 'temperature', 'knots')}
+        return cls(data['method'], data['threshold'], data.get('temperature', 1.0),
+                   (knots['x'], knots['y']) if knots else None, metadata)
+
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+
+def load_calibration(model_path=None):
+    """The artifact next to model_path (or at CALIBRATION_PATH); the identity if there is none"""
+    path = os.environ.get('CALIBRATION_PATH') or (calibration_path(model_path) if model_path else None)
+    calibration = Calibration()
+    if path and os.path.exists(path):
+        with open(path) as f:
+            calibration = Calibration.from_dict(json.load(f))
+        print(f"Calibration: {calibration.method}, threshold {calibration.threshold} ({path})")
+    if os.environ.get('DECISION_THRESHOLD'):
+        calibration.threshold = float(os.environ['DECISION_THRESHOLD'])
+    return calibration
+
+
+# --- fitting ---
+
+def fit_temperature(probabilities, labels, iterations=50):
+    """Temperature T minimising the log loss of sigmoid(logit / T) (Newton's method on 1 / T)"""
+    import numpy as np
+    z = _logits(probabilities)
+    y = np.asarray(labels, dtype=np.float64)
+    a = 1.0
+    for _ in range(iterations):
+        p = _sigmoid(a * z)
+        gradient = np.mean((p - y) * z)
+        hessian = np.mean(p * (1 - p) * z * z)
+        if hessian <= 1e-12:
+            break
+        step = gradient / hessian
+        a = max(a - step, 1e-3)
+        if abs(step) < 1e-9:
+            break
+    return 1.0 / a
+
+
+def fit_isotonic(probabilities, labels, max_knots=_MAX_KNOTS):
+    """Pool-adjacent-violators fit: ([x...], [y...]) knots of a non-decreasing map, for np.interp"""
+    import numpy as np
+    x, inverse = np.unique(np.asarray(probabilities, dtype=np.float64), return_inverse=True)
+    weights = np.bincount(inverse).astype(np.float64)
+    sums = np.bincount(inverse, weights=np.asarray(labels, dtype=np.float64))
+
+    # Blocks of [value, weight, first x, last x], merged while they decrease
+    blocks = []
+    for i in range(len(x)):
+        blocks.append([sums[i] / weights[i], weights[i], x[i], x[i]])
+        while len(blocks) > 1 and blocks[-2][0] >= blocks[-1][0]:
+            value, weight, _, last = blocks.pop()
+            previous = blocks[-1]
+            total = previous[1] + weight
+            previous[0] = (previous[0] * previous[1] + value * weight) / total
+            previous[1] = total
+            previous[3] = last
+
+    xs, ys = [], []
+    for value, _, first, last in blocks:
+        xs.extend([first, last] if last > first else [first])
+        ys.extend([value, value] if last > first else [value])
+    if len(xs) > max_knots:
+        keep = np.unique(np.linspace(0, len(xs) - 1, max_knots).round().astype(int))
+        xs, ys = [xs[i] for i in keep], [ys[i] for i in keep]
+    return [round(float(v), 8) for v in xs], [round(float(v), 8) for v in ys]
+
+
+def threshold_for_sensitivity(probabilities, labels, target):
+    """Highest threshold (for `p > threshold`) whose sensitivity is at least target
+
+    The threshold sits halfway between the weakest positive that must be caught and the next
+    lower score, so it does not sit exactly on a training example.
+    """
+    import numpy as np
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    labels = np.asarray(labels)
+    positives = np.sort(probabilities[labels == 1])[::-1]
+    if positives.size == 0:
+        raise ValueError("No pneumonia examples to set a sensitivity target on")
+    needed = positives[max(1, math.ceil(target * positives.size)) - 1]
+    below = probabilities[probabilities < needed]
+    return float((needed + below.max()) / 2 if below.size else needed / 2)
+
+
+def evaluate(probabilities, labels, threshold, bins=10):
+    """Log loss, Brier score, expected calibration error and sensitivity/specificity at threshold"""
+    import numpy as np
+    p = np.clip(np.asarray(probabilities, dtype=np.float64), _EPSILON, 1 - _EPSILON)
+    y = np.asarray(labels, dtype=np.float64)
+    bin_index = np.minimum((p * bins).astype(int), bins - 1)
+    ece = 0.0
+    for b in range(bins):
+        in_bin = bin_index == b
+        if in_bin.any():
+            ece += in_bin.mean() * abs(p[in_bin].mean() - y[in_bin].mean())
+    predicted = p > threshold
+    positives, negatives = y == 1, y == 0
+    return {
+        'log_loss': round(float(-np.mean(y * np.log(p) + (1 - y) * np.log(1 - p))), 5),
+        'brier': round(float(np.mean((p - y) ** 2)), 5),
+        'ece': round(float(ece), 5),
+        'sensitivity': round(float(predicted[positives].mean()), 4) if positives.any() else None,
+        'specificity': round(float((~predicted[negatives]).mean()), 4) if negatives.any() else None,
+    }
+
+
+def fit(probabilities, labels, method='temperature', target_sensitivity=0.95, metadata=None):
+    """Fit a Calibration to raw outputs and 0/1 labels, with its threshold and before/after metrics"""
+    import numpy as np
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    labels = np.asarray(labels, dtype=np.int8)
+    if method == 'temperature':
+        calibration = Calibration('temperature', temperature=fit_temperature(probabilities, labels))
+    elif method == 'isotonic':
+        calibration = Calibration('isotonic', knots=fit_isotonic(probabilities, labels))
+    else:
+        calibration = Calibration()
+
+    calibrated = calibration.apply(probabilities)
+    if target_sensitivity:
+        calibration.threshold = threshold_for_sensitivity(calibrated, labels, target_sensitivity)
+    calibration.metadata = {
+        **(metadata or {}),
+        'target_sensitivity': target_sensitivity,
+        'images': int(labels.size),
+        'positives': int(labels.sum()),
+        'uncalibrated': evaluate(probabilities, labels, DEFAULT_THRESHOLD),
+        'calibrated': evaluate(calibrated, labels, calibration.threshold),
+    }
+    return calibration
+
+
+# --- offline scoring ---
+
+def score_labelled(source, predict_fn, batch_size=256, workers=None, chunk_size=32, prefetch=None):
+    """Raw outputs and labels for every labelled image in a directory, zip or tar
+
+    Decoding streams through bulk_score's process pool and bounded prefetch queue; the model
+    sees full batches of batch_size, and unlabelled or undecodable images are skipped.
+    """
+    import numpy as np
+    from bulk_score import decoded_chunks, iter_images
+    from preprocessing import allocate_batch
+
+    labelled = ((name, payload) for name, payload in iter_images(source) if label_from_name(name) is not None)
+    batch = allocate_batch(batch_size)
+    pending = []
+    scores, labels = [], []
+    skipped = 0
+
+    def flush():
+        if pending:
+            scores.append(np.asarray(predict_fn(batch[:len(pending)]), dtype=np.float32).reshape(len(pending), -1)[:, 0])
+            labels.append(np.array(pending, dtype=np.int8))
+            pending.clear()
+
+    for names, pixels, errors in decoded_chunks(labelled, chunk_size, workers, prefetch):
+        for name, image, error in zip(names, pixels, errors):
+            if error:
+                skipped += 1
+                continue
+            np.divide(image, np.float32(255.0), out=batch[len(pending), ..., 0], dtype=np.float32)
+            pending.append(label_from_name(name))
+            if len(pending) == batch_size:
+                flush()
+    flush()
+    if skipped:
+        print(f"Skipped {skipped} undecodable images")
+    if not scores:
+        return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int8)
+    return np.concatenate(scores), np.concatenate(labels)
+
+
+def read_scores(path):
+    """Raw outputs and labels from a bulk_score.py CSV/JSONL result file, read row by row"""
+    import numpy as np
+    scores, labels = [], []
+    with open(path, newline='') as f:
+        rows = csv.DictReader(f) if path.lower().endswith('.csv') else (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            label = label_from_name(row['name'])
+            if label is None or row.get('probability') in (None, ''):
+                continue
+            scores.append(float(row['probability']))
+            labels.append(label)
+    return np.array(scores, dtype=np.float64), np.array(labels, dtype=np.int8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit probability calibration and the decision threshold")
+    parser.add_argument('source', nargs='?', help="Labelled directory, .zip or .tar(.gz) of images")
+    parser.add_argument('--scores', help="Fit from a bulk_score.py CSV/JSONL instead of scoring images")
+    parser.add_argument('--model', default=os.environ.get('MODEL_PATH', 'model.keras'))
+    parser.add_argument('--backend', help="keras, tflite or onnx (default: MODEL_BACKEND / file extension)")
+    parser.add_argument('--method', choices=METHODS, default='temperature')
+    parser.add_argument('--target-sensitivity', type=float, default=0.95)
+    parser.add_argument('--output', help="Artifact path (default: next to the model)")
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=None, help="Decode processes (default: all cores, 0 = in-process)")
+    args = parser.parse_args()
+    if not args.source and not args.scores:
+        parser.error("give a labelled image source or --scores")
+
+    if args.scores:
+        probabilities, labels = read_scores(args.scores)
+    else:
+        from backends import load_backend
+        backend = load_backend(args.model, args.backend)
+        print(f"Scoring {args.source} with {args.model} ({backend.name} backend)")
+        probabilities, labels = score_labelled(args.source, backend.predict, args.batch_size, args.workers)
+    if labels.size == 0 or labels.min() == labels.max():
+        raise SystemExit("Need both normal and pneumonia examples to calibrate")
+
+    metadata = {'model': os.path.basename(args.model)}
+    if os.path.exists(args.model):
+        from prediction_cache import model_fingerprint
+        metadata['model_fingerprint'] = model_fingerprint(args.model)
+    calibration = fit(probabilities, labels, args.method, args.target_sensitivity, metadata)
+    path = calibration.save(args.output or calibration_path(args.model))
+
+    info = calibration.to_dict()
+    print(f"{info['images']} images ({info['positives']} pneumonia), threshold {calibration.threshold:.4f}")
+    for stage in ('uncalibrated', 'calibrated'):
+        print(f"  {stage:13s} {json.dumps(info[stage])}")
+    print(f"Calibration written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Request deadlines shared by the admission controller and the batch scheduler
+A Deadline is a point in time by which the response is due; stages of the request check it
+and give up with DeadlineExceeded (504) instead of doing work the client no longer waits for.
+"""
+import time
+
+
+class DeadlineExceeded(Exception):
+    """The client's deadline passed before `stage`; the remaining work is skipped"""
+    status = 504
+
+    def __init__(self, stage):
+        super().__init__(f"Request deadline exceeded before {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """A point in time.monotonic() by which the response is due (None: no deadline)"""
+
+    def __init__(self, seconds=None):
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self):
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, stage):
+        """Raise DeadlineExceeded if the deadline has passed"""
+        if self.expired():
+            raise DeadlineExceeded(stage)
@@ -0,0 +1,180 @@
+"""
+Grad-CAM explanation heatmaps
+One GradientTape pass over a whole batch yields the last convolutional layer's activations and
+the gradients of the pneumonia score; the gradient-weighted activations are upsampled,
+colour-mapped and blended over the X-ray in a few batched OpenCV/NumPy calls, then encoded
+as a compact WebP (or PNG). Results are cached by image hash, per output format.
+"""
+import base64
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from prediction_cache import PredictionCache
+from preprocessing import IMAGE_SIZE, decode_checked, preprocess_batch
+
+FORMATS = {
+    'webp': ('.webp', [cv2.IMWRITE_WEBP_QUALITY, 80], 'image/webp'),
+    'png': ('.png', [cv2.IMWRITE_PNG_COMPRESSION, 6], 'image/png'),
+}
+DEFAULT_FORMAT = os.environ.get('EXPLAIN_FORMAT', 'webp')
+ALPHA = 0.4
+
+# cv2.resize handles at most this many channels, i.e. heatmaps per call
+_MAX_RESIZE_CHANNELS = 512
+
+
+def find_target_layer(model):
+    """The last layer with a 4-D (N, H, W, C) output, normally the final convolution block"""
+    for layer in reversed(model.layers):
+        shape = getattr(layer, 'output_shape', None) or tuple(layer.output.shape)
+        if len(shape) == 4:
+            return layer
+    raise ValueError("Model has no convolutional layer to explain")
+
+
+class GradCAM:
+    """Batched Grad-CAM for a Keras model with a single sigmoid output"""
+
+    def __init__(self, model, layer_name=None):
+        import tensorflow as tf
+        layer = model.get_layer(layer_name) if layer_name else find_target_layer(model)
+        grad_model = tf.keras.Model(model.inputs, [layer.output, model.output])
+        self.layer_name = layer.name
+
+        @tf.function(reduce_retracing=True)
+        def compute(batch):
+            with tf.GradientTape() as tape:
+                activations, predictions = grad_model(batch, training=False)
+                score = predictions[:, 0]
+            # Samples don't interact, so one gradient of the summed scores is every sample's own gradient
+            grads = tape.gradient(score, activations)
+            weights = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+            cams = tf.nn.relu(tf.reduce_sum(activations * weights, axis=-1))
+            return cams, score
+
+        self._compute = compute
+
+    def __call__(self, batch):
+        """(N, H, W, 1) model inputs -> ((N, h, w) maps in [0, 1], (N,) pneumonia probabilities)"""
+        cams, scores = self._compute(np.asarray(batch, dtype=np.float32))
+        return normalize_cams(cams.numpy()), scores.numpy()
+
+
+def normalize_cams(cams):
+    """Scale each map to [0, 1] by its own peak; all-zero maps stay zero"""
+    cams = np.maximum(np.asarray(cams, dtype=np.float32), 0)
+    peak = cams.max(axis=(1, 2), keepdims=True)
+    return np.divide(cams, peak, out=np.zeros_like(cams), where=peak > 0)
+
+
+def _resize_stack(maps, size, interpolation):
+    """Resize (N, h, w) float maps to (N, size, size), packing them as channels of one cv2.resize call"""
+    out = []
+    for start in range(0, len(maps), _MAX_RESIZE_CHANNELS):
+        chunk = np.ascontiguousarray(np.moveaxis(maps[start:start + _MAX_RESIZE_CHANNELS], 0, -1))
+        resized = cv2.resize(chunk, (size, size), interpolation=interpolation)
+        out.append(np.moveaxis(resized.reshape(size, size, -1), -1, 0))
+    return np.concatenate(out)
+
+
+def overlay(images, cams, alpha=ALPHA, size=IMAGE_SIZE):
+    """Blend colour-mapped heatmaps over the model inputs -> (N, size, size, 3) uint8 BGR"""
+    images = np.asarray(images, dtype=np.float32).reshape(len(cams), images.shape[1], images.shape[2])
+    heat = _resize_stack(np.asarray(cams, dtype=np.float32), size, cv2.INTER_CUBIC)
+    gray = images if images.shape[1:] == (size, size) else _resize_stack(images, size, cv2.INTER_AREA)
+
+    heat_u8 = np.clip(heat * 255.0, 0, 255).astype(np.uint8)
+    # One applyColorMap over the maps stacked vertically
+    colour = cv2.applyColorMap(heat_u8.reshape(-1, size), cv2.COLORMAP_JET).reshape(len(cams), size, size, 3)
+    blended = gray[..., np.newaxis] * (255.0 * (1.0 - alpha)) + colour * np.float32(alpha)
+    return np.clip(blended, 0, 255).astype(np.uint8)
+
+
+def encode(image, fmt=DEFAULT_FORMAT):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown explanation format '{fmt}'. Expected one of: {', '.join(FORMATS)}")
+    extension, params, _ = FORMATS[fmt]
+    ok, buffer = cv2.imencode(extension, image, params)
+    if not ok:
+        raise ValueError(f"Could not encode heatmap as {fmt}")
+    return buffer.tobytes()
+
+
+def content_type(fmt):
+    return FORMATS[fmt][2]
+
+
+class Explainer:
+    """Grad-CAM overlays for uploaded images, batched and cached by image hash
+
+    get_backend() returns the loaded backend; only the Keras backend exposes the graph
+    needed for gradients. gradcam_factory is injectable for tests.
+    """
+
+    def __init__(self, get_backend, cache=None, fmt=DEFAULT_FORMAT, gradcam_factory=GradCAM):
+        self.get_backend = get_backend
+        self.fmt = fmt
+        self.cache = cache if cache is not None else PredictionCache(
+            max_entries=int(os.environ.get('EXPLAIN_CACHE_SIZE', 256)))
+        self.gradcam_factory = gradcam_factory
+        self._gradcam = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _gradcam_for(self, backend):
+        model = getattr(backend, 'model', None)
+        if model is None:
+            raise ValueError(f"Explanations need the Keras backend, not '{getattr(backend, 'name', backend)}'")
+        with self._lock:
+            if self._model is not model:
+                self._gradcam = self.gradcam_factory(model)
+                self._model = model
+            return self._gradcam
+
+    def explain(self, images_bytes, fmt=None):
+        """Returns ([{'probability', 'image' (encoded bytes), 'content_type', 'cached'}], timings_ms)"""
+        fmt = fmt or self.fmt
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown explanation format '{fmt}'. Expected one of: {', '.join(FORMATS)}")
+
+        results = [None] * len(images_bytes)
+        keys = [f"{self.cache.key(data)}:{fmt}" for data in images_bytes]
+        todo = []
+        for i, data in enumerate(images_bytes):
+            cached = self.cache.get(data, key=keys[i])
+            if cached is None:
+                todo.append(i)
+            else:
+                results[i] = {'probability': cached[0], 'image': base64.b64decode(cached[1]),
+                              'content_type': content_type(fmt), 'cached': True}
+
+        timings = {}
+        if todo:
+            start = time.perf_counter()
+            batch = preprocess_batch([decode_checked(images_bytes[i]) for i in todo])
+            timings['preprocess'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            cams, probabilities = self._gradcam_for(self.get_backend())(batch)
+            timings['gradcam'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            blended = overlay(batch, cams)
+            encoded = [encode(image, fmt) for image in blended]
+            timings['overlay'] = time.perf_counter() - start
+
+            for j, i in enumerate(todo):
+                probability = float(probabilities[j])
+                results[i] = {'probability': probability, 'image': encoded[j],
+                              'content_type': content_type(fmt), 'cached': False}
+                self.cache.put(images_bytes[i], [probability, base64.b64encode(encoded[j]).decode()], key=keys[i])
+
+        return results, {name: round(seconds * 1000, 3) for name, seconds in timings.items()}
+
+
+def data_url(result):
+    return f"data:{result['content_type']};base64,{base64.b64encode(result['image']).decode()}"
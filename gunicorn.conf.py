@@ -0,0 +1,49 @@
+"""
+Gunicorn settings, picked up automatically by `gunicorn app:app`
+
+GUNICORN_PRELOAD=1 imports the app once in the master and reads the model file into the page
+cache there; each worker then loads the model from memory after the fork. TensorFlow itself is
+never imported in the master, because a fork after it has started its threads can hang a worker.
+Thread counts and CPU pinning per worker come from runtime_config (see its docstring).
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import runtime_config
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0') == '1'
+
+if preload_app:
+    # The master only prefetches the model file; post_fork loads it in each worker
+    os.environ.setdefault('MODEL_LOAD_MODE', 'preload')
+
+
+cpu_slots = runtime_config.CpuSlots()
+
+
+def nworkers_changed(server, new_value, old_value):
+    if old_value is None:
+        # First call, from the arbiter's setup and before preload_app imports the app: resolve
+        # threads once in the master for the real worker count (--workers or WEB_CONCURRENCY,
+        # autotuning included); workers inherit the environment
+        runtime_config.configure(new_value)
+
+
+def pre_fork(server, worker):
+    worker.cpu_slot = cpu_slots.acquire(worker)
+
+
+def child_exit(server, worker):
+    cpu_slots.release(worker)
+
+
+def post_fork(server, worker):
+    runtime_config.pin_worker(worker.cpu_slot, server.num_workers)
+    if preload_app:
+        import app
+        if app.inference_client is None:
+            app.model_loader.start()  # import TensorFlow, build and warm the model in this worker only
+        if app.registry is not None:
+            app.registry.watch(app.MODEL_REGISTRY_POLL_SECONDS)  # the master's poller did not survive the fork
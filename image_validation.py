@@ -0,0 +1,251 @@
+"""
+Header-only validation of uploaded images
+Reads format, dimensions and bit depth from the first bytes of the file (JPEG markers, PNG IHDR,
+BMP/WebP/TIFF headers) without decoding any pixels, so unsupported types, truncated headers and
+decompression bombs are rejected before the decoder allocates anything. Errors are ValueErrors
+that carry the HTTP status to answer with (400, 413 or 415).
+"""
+import os
+import struct
+from collections import namedtuple
+
+# Largest encoded upload accepted per image
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_BYTES', 20 << 20))
+# Largest image (width x height from the header) accepted at all
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 100_000_000))
+# Memory ceiling for one decoded image; larger JPEGs are decoded at 1/2, 1/4 or 1/8 scale to fit
+MAX_DECODE_BYTES = int(os.environ.get('MAX_DECODE_BYTES', 32 << 20))
+
+# OpenCV's own pixel limit as a backstop for anything that slips past the header checks
+os.environ.setdefault('OPENCV_IO_MAX_IMAGE_PIXELS', str(MAX_IMAGE_PIXELS))
+
+# Room for multipart boundaries, part headers and small form fields around each upload
+FORM_OVERHEAD_BYTES = 64 << 10
+
+SUPPORTED_FORMATS = ('jpeg', 'png', 'bmp', 'webp', 'tiff')
+REDUCTION_FACTORS = (2, 4, 8)
+
+ImageInfo = namedtuple('ImageInfo', ['format', 'height', 'width', 'bit_depth', 'channels'])
+
+
+class InvalidImage(ValueError):
+    """Malformed or truncated image data"""
+    status = 400
+
+
+class UnsupportedImageType(InvalidImage):
+    status = 415
+
+
+class ImageTooLarge(InvalidImage):
+    status = 413
+
+
+def max_request_bytes(images=1):
+    """Largest request body worth reading for `images` uploads (the HTTP layer's MAX_CONTENT_LENGTH)"""
+    return images * (MAX_IMAGE_BYTES + FORM_OVERHEAD_BYTES)
+
+
+def status_for(error, default=400):
+    """HTTP status for an exception raised while handling an image"""
+    return getattr(error, 'status', default)
+
+
+# Recognised but not decodable by the service: name them in the error instead of "unknown"
+_KNOWN_UNSUPPORTED = (
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'%PDF', 'pdf'),
+    (b'PK\x03\x04', 'zip'),
+    (b'\x00\x00\x00\x0cjP  ', 'jpeg2000'),
+    (b'\xff\x4f\xff\x51', 'jpeg2000'),
+    (b'II+\x00', 'bigtiff'),
+    (b'MM\x00+', 'bigtiff'),
+)
+
+# JPEG start-of-frame markers the decoder supports (baseline, extended, progressive)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2}
+# Lossless / hierarchical / arithmetic-coded frames
+_JPEG_SOF_UNSUPPORTED = {0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+def _jpeg_info(data):
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise InvalidImage("Corrupt JPEG: expected a marker")
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # markers without a length
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            raise InvalidImage("Corrupt JPEG: no frame header before the image data")
+        length = (data[pos + 2] << 8) | data[pos + 3]
+        if length < 2:
+            raise InvalidImage("Corrupt JPEG: bad segment length")
+        if marker in _JPEG_SOF_UNSUPPORTED:
+            raise UnsupportedImageType("Lossless, hierarchical and arithmetic-coded JPEGs are not supported")
+        if marker in _JPEG_SOF:
+            if pos + 10 > len(data):
+                break
+            precision, height, width, channels = struct.unpack_from('>BHHB', data, pos + 4)
+            return ImageInfo('jpeg', height, width, precision, channels)
+        pos += 2 + length
+    raise InvalidImage("Truncated JPEG: no frame header found")
+
+
+def _png_info(data):
+    if len(data) < 29 or data[12:16] != b'IHDR':
+        raise InvalidImage("Truncated PNG: missing IHDR header")
+    width, height, bit_depth, colour_type = struct.unpack_from('>IIBB', data, 16)
+    if colour_type not in _PNG_CHANNELS or bit_depth not in (1, 2, 4, 8, 16):
+        raise InvalidImage(f"Corrupt PNG: colour type {colour_type}, bit depth {bit_depth}")
+    return ImageInfo('png', height, width, bit_depth, _PNG_CHANNELS[colour_type])
+
+
+def _bmp_info(data):
+    if len(data) < 26:
+        raise InvalidImage("Truncated BMP header")
+    header_size = struct.unpack_from('<I', data, 14)[0]
+    if header_size == 12:
+        width, height, _, bits = struct.unpack_from('<HHHH', data, 18)
+    elif header_size >= 40 and len(data) >= 30:
+        width, height, _, bits = struct.unpack_from('<iiHH', data, 18)
+    else:
+        raise InvalidImage(f"Corrupt BMP: header size {header_size}")
+    if width < 0:
+        raise InvalidImage("Corrupt BMP: negative width")
+    return ImageInfo('bmp', abs(height), width, bits, 1 if bits <= 8 else 3)
+
+
+def _webp_info(data):
+    if len(data) < 30:
+        raise InvalidImage("Truncated WebP header")
+    chunk = data[12:16]
+    if chunk == b'VP8 ':
+        if data[23:26] != b'\x9d\x01\x2a':
+            raise InvalidImage("Corrupt WebP: bad VP8 start code")
+        width, height = struct.unpack_from('<HH', data, 26)
+        return ImageInfo('webp', height & 0x3FFF, width & 0x3FFF, 8, 3)
+    if chunk == b'VP8L':
+        if data[20] != 0x2F:
+            raise InvalidImage("Corrupt WebP: bad VP8L signature")
+        bits = struct.unpack_from('<I', data, 21)[0]
+        return ImageInfo('webp', ((bits >> 14) & 0x3FFF) + 1, (bits & 0x3FFF) + 1, 8, 4)
+    if chunk == b'VP8X':
+        width = int.from_bytes(data[24:27], 'little') + 1
+        height = int.from_bytes(data[27:30], 'little') + 1
+        return ImageInfo('webp', height, width, 8, 4)
+    raise InvalidImage(f"Corrupt WebP: unknown chunk {bytes(chunk)!r}")
+
+
+def _tiff_info(data):
+    order = '<' if data[:2] == b'II' else '>'
+    (offset,) = struct.unpack_from(order + 'I', data, 4)
+    if offset + 2 > len(data):
+        raise InvalidImage("Truncated TIFF: directory past the end of the file")
+    (count,) = struct.unpack_from(order + 'H', data, offset)
+    tags = {}
+    for i in range(count):
+        entry = offset + 2 + 12 * i
+        if entry + 12 > len(data):
+            raise InvalidImage("Truncated TIFF directory")
+        tag, kind, values = struct.unpack_from(order + 'HHI', data, entry)
+        if kind not in (3, 4):
+            continue
+        code, size = ('H', 2) if kind == 3 else ('I', 4)
+        position = entry + 8
+        if values * size > 4:
+            # Too big for the entry (e.g. one bits-per-sample value per channel): the field holds
+            # a 4-byte offset to the values, and the first value is enough
+            (position,) = struct.unpack_from(order + 'I', data, position)
+            if position + size > len(data):
+                raise InvalidImage(f"Truncated TIFF: tag {tag} past the end of the file")
+        tags[tag] = struct.unpack_from(order + code, data, position)[0]
+    if 256 not in tags or 257 not in tags:
+        raise InvalidImage("Corrupt TIFF: no image dimensions")
+    return ImageInfo('tiff', tags[257], tags[256], tags.get(258, 1), tags.get(277, 1))
+
+
+def sniff(data):
+    """Format, dimensions, bit depth and channels of encoded image bytes, from the header alone
+
+    Raises UnsupportedImageType for anything that isn't JPEG/PNG/BMP/WebP/TIFF and
+    InvalidImage for a header that is truncated or inconsistent.
+    """
+    data = memoryview(data)
+    head = bytes(data[:16])
+    if head[:3] == b'\xff\xd8\xff':
+        info = _jpeg_info(data)
+    elif head[:8] == b'\x89PNG\r\n\x1a\n':
+        info = _png_info(data)
+    elif head[:2] == b'BM':
+        info = _bmp_info(data)
+    elif head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        info = _webp_info(data)
+    elif head[:4] in (b'II*\x00', b'MM\x00*'):
+        if len(data) < 8:
+            raise InvalidImage("Truncated TIFF header")
+        info = _tiff_info(data)
+    else:
+        if len(data) == 0:
+            raise InvalidImage("Empty image")
+        name = next((name for magic, name in _KNOWN_UNSUPPORTED if head.startswith(magic)), None)
+        if name is None and bytes(data[128:132]) == b'DICM':
+            name = 'dicom'
+        described = f"'{name}' files" if name else "this file type"
+        raise UnsupportedImageType(f"Unsupported image type: {described}. "
+                                   f"Send one of: {', '.join(SUPPORTED_FORMATS)}")
+    if info.width <= 0 or info.height <= 0:
+        raise InvalidImage(f"Corrupt {info.format}: {info.width}x{info.height} image")
+    return info
+
+
+def jpeg_size(data):
+    """Return (height, width) from a JPEG header without decoding, or None if not a usable JPEG"""
+    data = memoryview(data)
+    if bytes(data[:3]) != b'\xff\xd8\xff':
+        return None
+    try:
+        info = _jpeg_info(data)
+    except InvalidImage:
+        return None
+    return info.height, info.width
+
+
+def decoded_bytes(info, factor=1):
+    """Memory for the decoded image at 1/factor scale (16-bit samples take two bytes)"""
+    scale = factor * factor
+    return -(-info.height * info.width // scale) * max(1, (info.bit_depth + 7) // 8)
+
+
+def check(data, max_bytes=None, max_pixels=None, max_decode_bytes=None):
+    """Validate encoded bytes before decoding; returns (ImageInfo, smallest reduction factor)
+
+    The factor is 1 when the full-resolution decode fits in max_decode_bytes; a larger JPEG
+    gets the smallest reduced-decode factor that fits. Anything else over a limit raises
+    ImageTooLarge.
+    """
+    max_bytes = MAX_IMAGE_BYTES if max_bytes is None else max_bytes
+    max_pixels = MAX_IMAGE_PIXELS if max_pixels is None else max_pixels
+    max_decode_bytes = MAX_DECODE_BYTES if max_decode_bytes is None else max_decode_bytes
+
+    if len(data) > max_bytes:
+        raise ImageTooLarge(f"Image is {len(data)} bytes (limit {max_bytes})")
+    info = sniff(data)
+    if info.width * info.height > max_pixels:
+        raise ImageTooLarge(f"Image is {info.width}x{info.height} pixels (limit {max_pixels})")
+
+    if decoded_bytes(info) <= max_decode_bytes:
+        return info, 1
+    if info.format == 'jpeg':
+        for factor in REDUCTION_FACTORS:
+            if decoded_bytes(info, factor) <= max_decode_bytes:
+                return info, factor
+    raise ImageTooLarge(f"{info.format.upper()} image of {info.width}x{info.height} pixels needs "
+                        f"{decoded_bytes(info)} bytes to decode (limit {max_decode_bytes})")
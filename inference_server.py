@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""
+Single-process inference server shared by many HTTP workers
+
+One process owns the model and batches requests from every connected worker. Each worker
+gets a ring of input slots in shared memory: it preprocesses straight into a free slot and
+sends only the slot number over a local socket, so image tensors are never pickled or copied
+between processes. Memory stays at one model copy however many HTTP workers are added.
+
+    python inference_server.py --model model.keras &
+    INFERENCE_SERVER_ADDRESS=/tmp/pneumonia-inference.sock gunicorn app:app --workers 8
+"""
+import argparse
+import itertools
+import os
+import queue
+import secrets
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError, resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from batching import BatchScheduler
+from model_loader import LoadTimings
+
+DEFAULT_ADDRESS = os.path.join('/tmp', 'pneumonia-inference.sock')
+IMAGE_SHAPE = (256, 256, 1)
+DEFAULT_SLOTS = 16
+MAX_SLOTS = 256
+
+
+def parse_address(address):
+    """'host:port' -> TCP tuple, anything else is a Unix socket path"""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and '/' not in address:
+        return host or '127.0.0.1', int(port)
+    return address
+
+
+def key_path(address):
+    """Where the server writes the generated authkey for a Unix socket address"""
+    return address + '.key'
+
+
+def resolve_authkey(address, authkey=None):
+    """authkey, else INFERENCE_SERVER_AUTHKEY; None means a Unix socket's generated key file
+
+    Every message on the connection is unpickled, so a TCP address must have an explicit key.
+    """
+    authkey = authkey or os.environ.get('INFERENCE_SERVER_AUTHKEY')
+    if authkey:
+        return authkey.encode() if isinstance(authkey, str) else authkey
+    if not isinstance(address, str):
+        raise ValueError(f"INFERENCE_SERVER_AUTHKEY must be set to serve on TCP address {address[0]}:{address[1]}")
+    return None
+
+
+def write_key_file(address):
+    """Generate a random authkey for this run and store it beside the socket, readable by its owner only"""
+    authkey = secrets.token_hex(32).encode()
+    path = key_path(address)
+    if os.path.exists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(authkey)
+    return authkey
+
+
+def read_key_file(address):
+    try:
+        with open(key_path(address), 'rb') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        raise ConnectionError(f"No authkey at {key_path(address)}: is the inference server running?") from None
+
+
+def attach_shared_memory(name):
+    """Map a segment created by the server without registering it with this process's resource tracker
+
+    Before Python 3.13 attaching always registers the segment, and the tracker (which may be
+    shared with other forked workers) would then unlink it or complain when the server does.
+    """
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _shutdown(conn):
+    """Wake a thread blocked in conn.recv() with EOF (closing the handle alone doesn't)"""
+    try:
+        sock = socket.socket(fileno=os.dup(conn.fileno()))
+    except OSError:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    finally:
+        sock.close()
+
+
+class InferenceServer:
+    """Serve predict_fn to InferenceClients, batching across all of them with a BatchScheduler"""
+
+    def __init__(self, predict_fn, address=DEFAULT_ADDRESS, authkey=None, image_shape=IMAGE_SHAPE,
+                 max_batch_size=32, max_wait_ms=5, status_fn=None):
+        self.address = parse_address(address)
+        self.authkey = resolve_authkey(self.address, authkey)
+        self._key_file = None
+        self.image_shape = tuple(image_shape)
+        self.status_fn = status_fn or (lambda: {'state': 'ready'})
+        self.scheduler = BatchScheduler(predict_fn, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        self._listener = None
+        self._connections = {}  # conn -> serving thread
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Bind and accept connections in a background thread"""
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)  # stale socket from a previous run
+        if self.authkey is None:
+            self.authkey = write_key_file(self.address)
+            self._key_file = key_path(self.address)
+        self._listener = Listener(self.address, authkey=self.authkey)
+        self.scheduler.start()
+        threading.Thread(target=self._accept_loop, name='inference-accept', daemon=True).start()
+        print(f"Inference server listening on {self.address}")
+        return self
+
+    def serve_forever(self):
+        self.start()
+        threading.Event().wait()
+
+    def close(self, timeout=5.0):
+        """Stop accepting, disconnect every client and release their shared memory"""
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.close()
+        with self._lock:
+            connections = dict(self._connections)
+        for conn, thread in connections.items():
+            _shutdown(conn)
+            thread.join(timeout)
+        self.scheduler.stop()
+        if self._key_file is not None:
+            try:
+                os.remove(self._key_file)
+            except FileNotFoundError:
+                pass
+            self._key_file = self.authkey = None  # a restart generates a fresh key
+
+    def stats(self):
+        with self._lock:
+            connections = len(self._connections)
+        return dict(self.scheduler.stats(), connections=connections)
+
+    def _accept_loop(self):
+        while self._listener is not None:
+            try:
+                conn = self._listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                if self._listener is None:
+                    return
+                continue  # failed handshake (e.g. wrong authkey)
+            thread = threading.Thread(target=self._serve_connection, args=(conn,), name='inference-conn', daemon=True)
+            with self._lock:
+                self._connections[conn] = thread
+            thread.start()
+
+    def _serve_connection(self, conn):
+        try:
+            kind, requested = conn.recv()
+        except (EOFError, OSError, ValueError):
+            kind = None
+        if kind != 'hello':
+            with self._lock:
+                self._connections.pop(conn, None)
+            conn.close()
+            return
+
+        slots = min(max(int(requested), 1), MAX_SLOTS)
+        slot_bytes = int(np.prod(self.image_shape)) * 4
+        shm = SharedMemory(create=True, size=slots * slot_bytes)
+        ring = np.ndarray((slots,) + self.image_shape, dtype=np.float32, buffer=shm.buf)
+        send_lock = threading.Lock()
+        pending = set()
+
+        def reply(request_id, future):
+            pending.discard(future)
+            try:
+                message = (request_id, np.asarray(future.result()), None)
+            except Exception as e:
+                message = (request_id, None, str(e))
+            with send_lock:
+                try:
+                    conn.send(message)
+                except (OSError, ValueError):
+                    pass  # client went away
+
+        try:
+            with send_lock:
+                conn.send(('ready', shm.name, slots, self.image_shape))
+            while True:
+                message = conn.recv()
+                if message[0] == 'predict':
+                    _, request_id, slot = message
+                    future = self.scheduler.submit(ring[slot])
+                    pending.add(future)
+                    future.add_done_callback(lambda f, request_id=request_id: reply(request_id, f))
+                elif message[0] == 'status':
+                    status = dict(self.status_fn(), batching=self.scheduler.stats())
+                    with send_lock:
+                        conn.send((message[1], status, None))
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self._lock:
+                self._connections.pop(conn, None)
+            for future in list(pending):
+                try:
+                    future.result()
+                except Exception:
+                    pass
+            conn.close()
+            del ring
+            try:
+                shm.close()
+            except BufferError:
+                pass  # a view may still be referenced by the scheduler; the mapping goes with it
+            shm.unlink()
+
+
+class _Ring:
+    """One connection's shared-memory input slots
+
+    Stays mapped until the last slot taken from it is released, even after a reconnect has
+    replaced it: a held slot's array is a raw view into the mapping.
+    """
+
+    def __init__(self, shm, slots, image_shape):
+        self.shm = shm
+        self.array = np.ndarray((slots,) + tuple(image_shape), dtype=np.float32, buffer=shm.buf)
+        self.free = queue.Queue()
+        for i in range(slots):
+            self.free.put(i)
+        self.held = 0
+        # One taker at a time, so nobody holds part of the ring while waiting for the rest
+        self.taking = threading.Lock()
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+
+
+class _Slot:
+    """One shared-memory input slot, held by one request at a time"""
+
+    def __init__(self, client, ring, index):
+        self.client = client
+        self.ring = ring  # the connection the slot belongs to
+        self.index = index
+        self.array = ring.array[index:index + 1]  # (1, H, W, C) view: pass as `out=` to preprocess_batch()
+
+    def submit(self):
+        return self.client._send_predict(self.ring, self.index)
+
+    def predict(self, timeout=None):
+        return self.submit().result(timeout or self.client.timeout)
+
+    def release(self):
+        self.client._release(self.ring, self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class InferenceClient:
+    """Per-process connection to an InferenceServer
+
+    Also stands in for BackgroundModelLoader and the backend in app.py (get(), predict(),
+    status(), ready, warm_up()), so the rest of the app is unchanged in client mode.
+    """
+    name = 'inference-server'
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None, slots=DEFAULT_SLOTS, timeout=30.0):
+        self.address = parse_address(address)
+        self.authkey = resolve_authkey(self.address, authkey)  # None: read the server's key file on connect
+        self.slots = min(slots, MAX_SLOTS)  # what the server grants
+        self.timeout = timeout
+        self.timings = LoadTimings()
+        self._ids = itertools.count()
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # Connections and shared memory belong to the process that opened them
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._conn = None
+        self._ring = None
+        self._pending = {}
+
+    def _connect(self):
+        with self._lock:
+            if self._conn is not None:
+                return
+            conn = Client(self.address, authkey=self.authkey or read_key_file(self.address))
+            conn.send(('hello', self.slots))
+            _, shm_name, slots, image_shape = conn.recv()
+            ring = _Ring(attach_shared_memory(shm_name), slots, image_shape)
+
+            # Reconnecting: slots still held from the old ring are stale, and it is unmapped
+            # once the last of them is released
+            old, self._ring = self._ring, ring
+            if old is not None and old.held == 0:
+                old.close()
+            self._pending = {}
+            self._conn = conn
+            threading.Thread(target=self._read_loop, args=(conn,), name='inference-client', daemon=True).start()
+
+    def _read_loop(self, conn):
+        try:
+            while True:
+                request_id, value, error = conn.recv()
+                future = self._pending.pop(request_id, None)
+                if future is None:
+                    continue
+                if error is not None:
+                    future.set_exception(RuntimeError(error))
+                else:
+                    future.set_result(value)
+        except (EOFError, OSError):
+            pass
+        conn.close()
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Inference server connection lost"))
+
+    def _send(self, message_fn, ring=None):
+        future = Future()
+        request_id = next(self._ids)
+        with self._lock:
+            conn = self._conn
+            if conn is None or ring not in (None, self._ring):
+                raise ConnectionError("Not connected to the inference server")
+            self._pending[request_id] = future
+        try:
+            with self._send_lock:
+                conn.send(message_fn(request_id))
+        except (OSError, ValueError) as e:
+            self._pending.pop(request_id, None)
+            raise ConnectionError(f"Inference server connection lost: {e}") from e
+        return future
+
+    def _send_predict(self, ring, index):
+        # A slot from before a reconnect would name another request's slot in the new ring
+        return self._send(lambda request_id: ('predict', request_id, index), ring)
+
+    def _release(self, ring, index=None):
+        with self._lock:
+            ring.held -= 1
+            if ring is self._ring:
+                if index is not None:
+                    ring.free.put(index)
+            elif ring.held == 0:
+                ring.close()  # an index of a replaced ring is never handed out again
+
+    def close(self):
+        with self._lock:
+            conn = self._conn
+        if conn is not None:
+            _shutdown(conn)  # the reader thread sees EOF, fails pending requests and closes it
+
+    def slot(self, timeout=None):
+        """Reserve an input slot (blocks while all of this process's slots are in flight)"""
+        return self.take(1, timeout)[0]
+
+    def take(self, count, timeout=None):
+        """Reserve `count` slots (at most self.slots) at once: all of them, or none on TimeoutError"""
+        if not 0 < count <= self.slots:
+            raise ValueError(f"Can take 1 to {self.slots} slots at once, not {count}")
+        self._connect()
+        with self._lock:
+            ring = self._ring
+            ring.held += count  # keeps the mapping alive from here on
+        deadline = time.monotonic() + (timeout or self.timeout)
+        indices = []
+        try:
+            if not ring.taking.acquire(timeout=max(deadline - time.monotonic(), 0)):
+                raise queue.Empty
+            try:
+                while len(indices) < count:
+                    indices.append(ring.free.get(timeout=max(deadline - time.monotonic(), 0)))
+            finally:
+                ring.taking.release()
+        except queue.Empty:
+            for index in indices:
+                self._release(ring, index)
+            for _ in range(count - len(indices)):
+                self._release(ring)
+            raise TimeoutError("No free inference slot") from None
+        return [_Slot(self, ring, index) for index in indices]
+
+    def predict(self, batch):
+        """Backend interface: copy rows into slots, send them all, then collect the outputs in order"""
+        batch = np.asarray(batch, dtype=np.float32)
+        outputs = []
+        for start in range(0, batch.shape[0], self.slots):
+            rows = batch[start:start + self.slots]
+            held = self.take(len(rows))  # all at once: threads never wait on each other's half-filled chunks
+            try:
+                for slot, row in zip(held, rows):
+                    slot.array[0] = row
+                futures = [slot.submit() for slot in held]
+                outputs.extend(future.result(self.timeout) for future in futures)
+            finally:
+                for slot in held:
+                    slot.release()
+        return np.stack(outputs)
+
+    # BackgroundModelLoader interface
+
+    def get(self, timeout=None):
+        return self
+
+    def warm_up(self):
+        pass
+
+    def status(self):
+        try:
+            self._connect()
+            return self._send(lambda request_id: ('status', request_id)).result(self.timeout)
+        except (OSError, EOFError, TimeoutError, ConnectionError, AuthenticationError) as e:
+            return {'state': 'unavailable', 'error': str(e), 'timings_ms': {}}
+
+    @property
+    def ready(self):
+        return self.status().get('state') == 'ready'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the model to HTTP workers over shared memory")
+    parser.add_argument('--model', default=os.environ.get('MODEL_PATH', 'model.keras'))
+    parser.add_argument('--address', default=os.environ.get('INFERENCE_SERVER_ADDRESS', DEFAULT_ADDRESS),
+                        help="Unix socket path or host:port")
+    parser.add_argument('--max-batch-size', type=int, default=int(os.environ.get('BATCH_MAX_SIZE', 32)))
+    parser.add_argument('--max-wait-ms', type=float, default=float(os.environ.get('BATCH_MAX_WAIT_MS', 5)))
+    args = parser.parse_args()
+
+    import runtime_config
+    from model_loader import BackgroundModelLoader, load_local_backend
+
+    runtime_config.configure(workers=1)  # the only TensorFlow process: give it every core
+    loader = BackgroundModelLoader(lambda timings: load_local_backend(args.model, timings))
+    loader.load()
+    server = InferenceServer(loader.get().predict, args.address, max_batch_size=args.max_batch_size,
+                             max_wait_ms=args.max_wait_ms, status_fn=loader.status)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
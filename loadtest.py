@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Closed-loop HTTP load generator for /predict
+
+Each of N concurrent clients posts sample X-rays back to back; the report shows latency
+percentiles and throughput per concurrency level, so serving modes can be compared:
+
+    gunicorn app:app --workers 2 &                      # sync workers
+    python loadtest.py --url http://127.0.0.1:8000/api/predict --concurrency 1 8 32 128
+
+    uvicorn asgi_app:app --port 8001 &                  # async, one process
+    python loadtest.py --url http://127.0.0.1:8001/api/predict --concurrency 1 8 32 128
+
+Shed requests (429/503 from admission control) are counted under statuses; --priority and
+--deadline-ms send X-Priority / X-Deadline-Ms to exercise the lanes and deadlines.
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlparse
+
+from benchmark import SAMPLE_DIR, load_samples, summarize
+
+
+def post_image(url, image_bytes, timeout, headers=None):
+    """One binary upload; returns (status, seconds)"""
+    parsed = urlparse(url)
+    connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+    connection = connection_class(parsed.hostname, parsed.port, timeout=timeout)
+    start = time.perf_counter()
+    try:
+        request_headers = {'Content-Type': 'application/octet-stream'}
+        request_headers.update(headers or {})
+        connection.request('POST', parsed.path or '/', body=image_bytes, headers=request_headers)
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        status = 0  # connection refused / reset / timed out
+    finally:
+        connection.close()
+    return status, time.perf_counter() - start
+
+
+def run_level(url, samples, concurrency, total_requests, timeout, headers=None):
+    """Closed loop: `concurrency` clients share `total_requests` requests"""
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            status, seconds = post_image(url, samples[i % len(samples)][1], timeout, headers)
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    latencies.append(seconds)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    result = summarize(latencies)
+    result['concurrency'] = concurrency
+    result['requests'] = total_requests
+    result['statuses'] = {str(k): v for k, v in sorted(statuses.items())}
+    result['throughput_rps'] = round(len(latencies) / wall, 2) if wall else 0.0
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running /predict endpoint")
+    parser.add_argument('--url', default='http://127.0.0.1:5000/api/predict')
+    parser.add_argument('--images', default=SAMPLE_DIR)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128])
+    parser.add_argument('--requests-per-client', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--priority', choices=('urgent', 'normal', 'bulk'), help="Send X-Priority")
+    parser.add_argument('--deadline-ms', type=int, help="Send X-Deadline-Ms")
+    parser.add_argument('--output', help="Write the JSON results here")
+    args = parser.parse_args()
+
+    samples = load_samples(args.images)
+    headers = {}
+    if args.priority:
+        headers['X-Priority'] = args.priority
+    if args.deadline_ms:
+        headers['X-Deadline-Ms'] = str(args.deadline_ms)
+    results = []
+    print(f"{'clients':>8} {'ok':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  statuses")
+    for concurrency in args.concurrency:
+        r = run_level(args.url, samples, concurrency, concurrency * args.requests_per_client, args.timeout, headers)
+        results.append(r)
+        print(f"{concurrency:>8} {r.get('count', 0):>6} {r['throughput_rps']:>8} {r.get('p50_ms', 0):>9} "
+              f"{r.get('p95_ms', 0):>9} {r.get('p99_ms', 0):>9}  {r['statuses']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'url': args.url, 'levels': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Lightweight latency instrumentation and Prometheus-style metrics
+Stage timers feed histograms and per-request timings; counters track requests and errors by type.
+With METRICS_ENABLED=0 every call is a no-op on a shared null object.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+# Histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PREFIX = 'pneumonia_'
+
+# Stage timings of the request being handled; a ContextVar so that both threads and
+# asyncio tasks each see their own request
+_request_timings = ContextVar('request_timings', default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + list(extra or ())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{str(v)}"' for k, v in items) + '}'
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Stage:
+    """Context manager timing one stage with the monotonic clock"""
+    __slots__ = ('registry', 'name', 'start')
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.registry.observe('stage_seconds', elapsed, {'stage': self.name})
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[self.name] = timings.get(self.name, 0.0) + elapsed
+        return False
+
+
+class _Request:
+    """Counts one request, its error type (if any) and collects its stage timings"""
+
+    def __init__(self, registry, endpoint, json_log):
+        self.registry = registry
+        self.endpoint = endpoint
+        self.json_log = json_log
+        self.timings = {}
+        self.error_type = None
+
+    def fail(self, error_type):
+        self.error_type = error_type if isinstance(error_type, str) else type(error_type).__name__
+
+    def __enter__(self):
+        self._token = _request_timings.set(self.timings)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        _request_timings.reset(self._token)
+        if exc_type is not None and self.error_type is None:
+            self.error_type = exc_type.__name__
+
+        labels = {'endpoint': self.endpoint}
+        self.registry.inc('requests_total', labels)
+        self.registry.observe('request_seconds', elapsed, labels)
+        if self.error_type:
+            self.registry.inc('errors_total', {'endpoint': self.endpoint, 'type': self.error_type})
+
+        if self.json_log:
+            record = {'event': 'request', 'endpoint': self.endpoint,
+                      'duration_ms': round(elapsed * 1000, 3),
+                      'stages_ms': {k: round(v * 1000, 3) for k, v in self.timings.items()},
+                      'error': self.error_type}
+            print(json.dumps(record))
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self, json_logs=False):
+        self.enabled = True
+        self.json_logs = json_logs
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._gauge_callbacks = []
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def request(self, endpoint):
+        return _Request(self, endpoint, self.json_logs)
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def set_gauge(self, name, value, labels=None):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def register_gauges(self, callback):
+        """callback() -> iterable of (name, labels dict or None, value), evaluated at scrape time"""
+        self._gauge_callbacks.append(callback)
+
+    def _collect_gauges(self):
+        gauges = dict(self._gauges)
+        for callback in self._gauge_callbacks:
+            try:
+                for name, labels, value in callback():
+                    gauges[(name, _label_key(labels))] = value
+            except Exception as e:
+                print(f"Metrics gauge callback failed: {e}")
+        return gauges
+
+    def render_prometheus(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: (list(h.counts), h.sum, h.count, h.buckets) for k, h in self._histograms.items()}
+        gauges = self._collect_gauges()
+
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {PREFIX}{name} {kind}')
+
+        for (name, key), value in sorted(counters.items()):
+            declare(name, 'counter')
+            lines.append(f'{PREFIX}{name}{_format_labels(key)} {value}')
+
+        for (name, key), value in sorted(gauges.items()):
+            declare(name, 'gauge')
+            lines.append(f'{PREFIX}{name}{_format_labels(key)} {value}')
+
+        for (name, key), (counts, total, count, buckets) in sorted(histograms.items()):
+            declare(name, 'histogram')
+            cumulative = 0
+            for bound, n in zip(buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{PREFIX}{name}_bucket{_format_labels(key, [("le", le)])} {cumulative}')
+            lines.append(f'{PREFIX}{name}_sum{_format_labels(key)} {total}')
+            lines.append(f'{PREFIX}{name}_count{_format_labels(key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Counters, gauges and histogram count/sum as plain dicts (for JSON)"""
+        with self._lock:
+            counters = {f'{n}{_format_labels(k)}': v for (n, k), v in self._counters.items()}
+            histograms = {f'{n}{_format_labels(k)}': {'count': h.count, 'sum': round(h.sum, 6)}
+                          for (n, k), h in self._histograms.items()}
+        gauges = {f'{n}{_format_labels(k)}': v for (n, k), v in self._collect_gauges().items()}
+        return {'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+
+class _NullContext:
+    __slots__ = ()
+    timings = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def fail(self, error_type):
+        pass
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class NullRegistry:
+    """Drop-in registry that records nothing"""
+    enabled = False
+    json_logs = False
+
+    def stage(self, name):
+        return _NULL_CONTEXT
+
+    def request(self, endpoint):
+        return _NULL_CONTEXT
+
+    def inc(self, name, labels=None, value=1):
+        pass
+
+    def observe(self, name, value, labels=None):
+        pass
+
+    def set_gauge(self, name, value, labels=None):
+        pass
+
+    def register_gauges(self, callback):
+        pass
+
+    def render_prometheus(self):
+        return ''
+
+    def snapshot(self):
+        return {}
+
+
+def registry_from_env():
+    """METRICS_ENABLED=0 disables instrumentation, METRICS_JSON_LOGS=1 prints one JSON line per request"""
+    if os.environ.get('METRICS_ENABLED', '1') != '1':
+        return NullRegistry()
+    return MetricsRegistry(json_logs=os.environ.get('METRICS_JSON_LOGS', '0') == '1')
+
+
+metrics = registry_from_env()
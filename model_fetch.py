@@ -0,0 +1,256 @@
+"""
+Resumable, verified model download with a versioned local artifact cache
+Streams to disk in chunks, resumes with HTTP Range requests, splits large files into
+parallel range downloads and checks the SHA-256 against a manifest. Partial downloads are
+tied to the remote file's ETag (or Last-Modified) and resumed with If-Range, so bytes of a
+replaced file are never appended to those of the old one.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+DEFAULT_CACHE_DIR = os.path.join('/tmp', 'model-cache')
+CHUNK_SIZE = 1 << 20
+PARALLEL_MIN_SIZE = 32 << 20
+
+
+class FetchStats:
+    """Download accounting reported after every fetch"""
+
+    def __init__(self):
+        self.bytes_downloaded = 0
+        self.bytes_resumed = 0
+        self.ranges = 1
+        self.seconds = 0.0
+        self.cache_hit = False
+        self._lock = threading.Lock()
+
+    def add(self, n):
+        with self._lock:
+            self.bytes_downloaded += n
+
+    def as_dict(self):
+        mb = self.bytes_downloaded / (1024 * 1024)
+        return {
+            'cache_hit': self.cache_hit,
+            'downloaded_mb': round(mb, 2),
+            'resumed_mb': round(self.bytes_resumed / (1024 * 1024), 2),
+            'ranges': self.ranges,
+            'seconds': round(self.seconds, 3),
+            'throughput_mb_s': round(mb / self.seconds, 2) if self.seconds > 0 else 0.0,
+        }
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_url, timeout=30, session=None):
+    """Manifest JSON: {"url": ..., "sha256": ..., "version": ..., "size": ...}"""
+    session = session or requests
+    if manifest_url.startswith(('http://', 'https://')):
+        response = session.get(manifest_url, timeout=timeout)
+        if response.status_code != 200:
+            raise ValueError(f"Failed to download manifest: HTTP {response.status_code}")
+        return response.json()
+    with open(manifest_url) as f:
+        return json.load(f)
+
+
+def _validator(headers):
+    """What identifies this version of the remote file: its ETag, else Last-Modified ('' if neither)"""
+    return headers.get('ETag', '') or headers.get('Last-Modified', '')
+
+
+def _probe(session, url, timeout):
+    """Size, range support and validator of the remote file (HEAD, falling back to a 1-byte GET)"""
+    response = session.head(url, timeout=timeout, allow_redirects=True)
+    size = int(response.headers.get('Content-Length', 0) or 0) if response.status_code == 200 else 0
+    accepts_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    etag = _validator(response.headers) if response.status_code == 200 else ''
+
+    if not size or not accepts_ranges:
+        response = session.get(url, headers={'Range': 'bytes=0-0'}, timeout=timeout, stream=True)
+        content_range = response.headers.get('Content-Range', '')
+        if response.status_code == 206 and '/' in content_range:
+            size = int(content_range.rsplit('/', 1)[1])
+            accepts_ranges = True
+        etag = etag or _validator(response.headers)
+        response.close()
+    return size, accepts_ranges, etag
+
+
+def _range_headers(byte_range, validator):
+    """Range request that the server answers with the whole (new) file if it has changed"""
+    headers = {'Range': f'bytes={byte_range}'}
+    if validator:
+        headers['If-Range'] = validator
+    return headers
+
+
+def _prepare_part(part_path, size, validator):
+    """Keep a partial download only if it was started against the same remote file
+
+    The validator and size are recorded beside the .part file; without a validator there is
+    nothing to check a resume against, so the download starts over.
+    """
+    source_path = part_path + '.source'
+    current = {'validator': validator, 'size': size}
+    try:
+        with open(source_path) as f:
+            resumable = bool(validator) and json.load(f) == current
+    except (OSError, ValueError):
+        resumable = False
+    if not resumable:
+        for path in (part_path, part_path + '.ranges'):
+            if os.path.exists(path):
+                os.remove(path)
+        with open(source_path, 'w') as f:
+            json.dump(current, f)
+
+
+def _download_sequential(session, url, part_path, size, accepts_ranges, validator, stats, chunk_size, timeout):
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) and accepts_ranges else 0
+    if size and offset > size:
+        offset = 0
+    headers = _range_headers(f'{offset}-', validator) if offset else {}
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        if response.status_code == 200:
+            offset = 0  # server ignored the range, or the file changed since (If-Range): start over
+        elif response.status_code != 206:
+            raise ValueError(f"Failed to download model: HTTP {response.status_code}")
+        stats.bytes_resumed = offset
+
+        with open(part_path, 'r+b' if offset else 'wb') as f:
+            f.seek(offset)
+            f.truncate()
+            for block in response.iter_content(chunk_size):
+                f.write(block)
+                stats.add(len(block))
+
+
+def _download_parallel(session, url, part_path, size, parallel, validator, stats, chunk_size, timeout):
+    """Split [0, size) into ranges fetched concurrently; finished ranges are recorded for resume"""
+    ranges_path = part_path + '.ranges'
+    span = -(-size // parallel)
+    ranges = [(start, min(start + span, size) - 1) for start in range(0, size, span)]
+    stats.ranges = len(ranges)
+
+    done = set()
+    if os.path.exists(part_path) and os.path.exists(ranges_path) and os.path.getsize(part_path) == size:
+        with open(ranges_path) as f:
+            done = {tuple(r) for r in json.load(f)}
+    else:
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+    stats.bytes_resumed = sum(end - start + 1 for start, end in done)
+    done_lock = threading.Lock()
+
+    def fetch_range(byte_range):
+        start, end = byte_range
+        headers = _range_headers(f'{start}-{end}', validator)
+        with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+            if response.status_code == 200 and validator:
+                raise ValueError("Remote model changed during the download; retry to fetch the new file")
+            if response.status_code != 206:
+                raise ValueError(f"Range request failed: HTTP {response.status_code}")
+            fd = os.open(part_path, os.O_WRONLY)
+            try:
+                position = start
+                for block in response.iter_content(chunk_size):
+                    os.pwrite(fd, block, position)
+                    position += len(block)
+                    stats.add(len(block))
+            finally:
+                os.close(fd)
+            if position != end + 1:
+                raise ValueError(f"Range {start}-{end} ended early at {position}")
+        with done_lock:
+            done.add(byte_range)
+            with open(ranges_path, 'w') as f:
+                json.dump(sorted(done), f)
+
+    pending = [r for r in ranges if r not in done]
+    with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='model-fetch') as pool:
+        for future in [pool.submit(fetch_range, r) for r in pending]:
+            future.result()
+    os.remove(ranges_path)
+
+
+def fetch_model(url, sha256=None, version=None, cache_dir=None, parallel=4,
+                chunk_size=CHUNK_SIZE, parallel_min_size=PARALLEL_MIN_SIZE, timeout=60, session=None):
+    """Download url into a versioned local cache and return (path, FetchStats)
+
+    With a version or sha256, a warm cache returns without touching the network. Otherwise the
+    version is derived from the URL and the remote ETag/Last-Modified, which costs one HEAD
+    request but fetches a file replaced at the same URL again. Partial downloads left by a
+    killed process are resumed if the remote file is unchanged.
+    """
+    cache_dir = cache_dir or os.environ.get('MODEL_CACHE_DIR', DEFAULT_CACHE_DIR)
+    filename = os.path.basename(urlparse(url).path) or 'model.keras'
+    session = session or requests.Session()
+    probe = None
+    if not version and not sha256:
+        probe = _probe(session, url, timeout)
+        version = hashlib.blake2b(f"{url}\n{probe[2]}".encode(), digest_size=8).hexdigest()
+    version = version or sha256[:16]
+    version_dir = os.path.join(cache_dir, version)
+    final_path = os.path.join(version_dir, filename)
+    part_path = final_path + '.part'
+    stats = FetchStats()
+
+    if os.path.exists(final_path):
+        stats.cache_hit = True
+        print(f"Model found in local cache: {final_path}")
+        return final_path, stats
+
+    os.makedirs(version_dir, exist_ok=True)
+    started = time.perf_counter()
+
+    size, accepts_ranges, validator = probe or _probe(session, url, timeout)
+    _prepare_part(part_path, size, validator)
+    if accepts_ranges and parallel > 1 and size >= parallel_min_size:
+        _download_parallel(session, url, part_path, size, parallel, validator, stats, chunk_size, timeout)
+    else:
+        _download_sequential(session, url, part_path, size, accepts_ranges, validator, stats, chunk_size, timeout)
+    stats.seconds = time.perf_counter() - started
+
+    if size and os.path.getsize(part_path) != size:
+        raise ValueError(f"Incomplete download: {os.path.getsize(part_path)} of {size} bytes")
+    if sha256:
+        actual = sha256_file(part_path)
+        if actual != sha256.lower():
+            os.remove(part_path)
+            os.remove(part_path + '.source')
+            raise ValueError(f"Checksum mismatch for {url}: expected {sha256}, got {actual}")
+
+    os.replace(part_path, final_path)
+    os.remove(part_path + '.source')
+    print(f"Model downloaded to {final_path}: {stats.as_dict()}")
+    return final_path, stats
+
+
+def fetch_model_from_env(timeout=60):
+    """MODEL_MANIFEST_URL (or MODEL_URL + optional MODEL_SHA256) -> local path of the verified model"""
+    manifest_url = os.environ.get('MODEL_MANIFEST_URL')
+    if manifest_url:
+        manifest = load_manifest(manifest_url, timeout)
+        url, sha256, version = manifest['url'], manifest.get('sha256'), manifest.get('version')
+    else:
+        url, sha256, version = os.environ.get('MODEL_URL'), os.environ.get('MODEL_SHA256'), None
+    if not url:
+        raise ValueError("MODEL_URL environment variable not set. Please configure your model URL.")
+
+    return fetch_model(url, sha256=sha256, version=version, timeout=timeout,
+                       parallel=int(os.environ.get('MODEL_FETCH_PARALLEL', 4)))
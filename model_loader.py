@@ -0,0 +1,211 @@
+"""
+Model loading with fast cold starts
+- A memory-mappable artifact layout (architecture JSON + one aligned weights file) so workers
+  read weights through the OS page cache instead of unpacking the .keras zip into private memory
+- A background loader so the server accepts requests while the model is still loading
+- Per-phase timing (import, fetch, deserialize, first call)
+- A TensorFlow-free page-cache prefetch for the gunicorn master (gunicorn --preload)
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+MMAP_MANIFEST = 'manifest.json'
+MMAP_WEIGHTS = 'weights.bin'
+_ALIGNMENT = 64
+
+
+def is_mmap_artifact(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, MMAP_MANIFEST))
+
+
+def write_weights(path, arrays):
+    """Write arrays back to back (64-byte aligned) into one file; returns their manifest entries"""
+    import numpy as np
+    entries = []
+    offset = 0
+    with open(path, 'wb') as f:
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            padding = -offset % _ALIGNMENT
+            f.write(b'\0' * padding)
+            offset += padding
+            f.write(array.tobytes())
+            entries.append({'offset': offset, 'nbytes': array.nbytes,
+                            'dtype': array.dtype.str, 'shape': list(array.shape)})
+            offset += array.nbytes
+    return entries
+
+
+def read_weights(path, entries):
+    """Zero-copy read-only views of every array in a weights file"""
+    if not entries:
+        return []
+    import numpy as np
+    mapped = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = []
+    for entry in entries:
+        raw = mapped[entry['offset']:entry['offset'] + entry['nbytes']]
+        arrays.append(raw.view(np.dtype(entry['dtype'])).reshape(entry['shape']))
+    return arrays
+
+
+def export_mmap_artifact(model, output_dir):
+    """Save a Keras model as <output_dir>/manifest.json + weights.bin"""
+    os.makedirs(output_dir, exist_ok=True)
+    entries = write_weights(os.path.join(output_dir, MMAP_WEIGHTS), model.get_weights())
+    manifest = {
+        'format': 'pneumonia-mmap-v1',
+        'architecture': json.loads(model.to_json()),
+        'weights': entries,
+    }
+    with open(os.path.join(output_dir, MMAP_MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+    print(f"Saved memory-mappable model to {output_dir}")
+    return output_dir
+
+
+def load_mmap_model(artifact_dir):
+    """Rebuild a Keras model from an export_mmap_artifact() directory"""
+    from tensorflow.keras.models import model_from_json
+
+    with open(os.path.join(artifact_dir, MMAP_MANIFEST)) as f:
+        manifest = json.load(f)
+    model = model_from_json(json.dumps(manifest['architecture']))
+    model.set_weights(read_weights(os.path.join(artifact_dir, MMAP_WEIGHTS), manifest['weights']))
+    return model
+
+
+def prefetch_model(path):
+    """Read a model file (or every file of an artifact directory) into the OS page cache; returns bytes read
+
+    gunicorn --preload does this in the master instead of loading the model: importing
+    TensorFlow and building a model can start runtime threads, and forking after that can hang
+    a worker. Each worker then builds its backend from the cached pages, without disk reads.
+    """
+    paths = [os.path.join(path, name) for name in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+    buffer = bytearray(1 << 20)
+    total = 0
+    for file_path in paths:
+        with open(file_path, 'rb') as f:
+            while True:
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                total += read
+    return total
+
+
+class LoadTimings:
+    """Wall-clock duration of each loading phase, in milliseconds"""
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    def total_ms(self):
+        return round(sum(self.phases.values()), 1)
+
+
+def load_local_backend(model_path, timings):
+    """Import the runtime and deserialize a local model file, recording both phases"""
+    with timings.phase('import'):
+        from backends import load_backend
+        if not model_path.endswith(('.tflite', '.onnx')):
+            import tensorflow  # noqa: F401 - the import alone is a large share of cold start
+            from runtime_config import apply_tensorflow
+            apply_tensorflow()
+
+    with timings.phase('deserialize'):
+        return load_backend(model_path)
+
+
+class BackgroundModelLoader:
+    """Load a model in a background thread; requests wait on get() only until it is ready"""
+
+    def __init__(self, load_fn, warmup_shape=(1, 256, 256, 1)):
+        self.load_fn = load_fn
+        self.warmup_shape = warmup_shape
+        self.timings = LoadTimings()
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+        self._backend = None
+        self._error = None
+
+    def start(self):
+        """Begin loading in a daemon thread and return immediately"""
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+        threading.Thread(target=self._load, name='model-loader', daemon=True).start()
+        return self
+
+    def load(self, warmup=True):
+        """Load synchronously in the calling thread (e.g. before gunicorn forks workers)"""
+        with self._lock:
+            if self._started:
+                return self.get()
+            self._started = True
+        self._load(warmup)
+        return self.get()
+
+    def _load(self, warmup=True):
+        try:
+            backend = self.load_fn(self.timings)
+            if warmup:
+                self._warm_up(backend)
+            self._backend = backend
+            print(f"Model ready in {self.timings.total_ms()} ms {self.timings.phases}")
+        except Exception as e:
+            self._error = e
+            print(f"Error loading model: {str(e)}")
+        finally:
+            self._ready.set()
+
+    def _warm_up(self, backend):
+        import numpy as np
+        with self.timings.phase('first_call'):
+            if hasattr(backend, 'warm_up'):
+                backend.warm_up()  # every traced batch-size bucket
+            backend.predict(np.zeros(self.warmup_shape, dtype=np.float32))
+
+    def warm_up(self):
+        """Run the first-call phase now (after a fork-after-load, in each worker)"""
+        self._warm_up(self.get())
+
+    @property
+    def ready(self):
+        return self._ready.is_set() and self._error is None
+
+    def get(self, timeout=None):
+        """Return the loaded backend, blocking until loading finishes"""
+        if not self._started:
+            self.start()
+        if not self._ready.wait(timeout):
+            raise TimeoutError("Model is still loading, please retry shortly.")
+        if self._error is not None:
+            raise RuntimeError(f"Model failed to load: {self._error}")
+        return self._backend
+
+    def status(self):
+        if not self._ready.is_set():
+            state = 'loading' if self._started else 'idle'
+        else:
+            state = 'failed' if self._error is not None else 'ready'
+        status = {'state': state, 'timings_ms': dict(self.timings.phases)}
+        if self._backend is not None:
+            status['backend'] = self._backend.name
+        if self._error is not None:
+            status['error'] = str(self._error)
+        return status
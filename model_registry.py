@@ -0,0 +1,522 @@
+"""
+Model registry with hot-swap and shadow scoring
+Versions (path, fingerprint, metadata) are kept in a JSON manifest. The serving version is
+swapped by loading and warming the new one off the request path and then replacing a single
+reference, so in-flight requests finish on the version they started with. A candidate can
+shadow-score a sampled fraction of batches on a background executor; its outputs are compared
+with the serving version's and never returned. Per-version latency and agreement are kept in
+memory for /model_versions and /metrics.
+
+    python model_registry.py register model_optimized.keras --version v2 --note "pruned"
+    python model_registry.py shadow v2 --fraction 0.1
+    python model_registry.py activate v2
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from calibration import load_calibration
+from model_loader import LoadTimings, load_local_backend
+from prediction_cache import model_fingerprint
+
+DEFAULT_MANIFEST = 'models.json'
+_LATENCY_WINDOW = 1024
+
+
+class VersionStats:
+    """Latency over the most recent batches, plus agreement with the serving version when shadowing"""
+
+    def __init__(self, window=_LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.batches = 0
+        self.images = 0
+        self.errors = 0
+        self.compared = 0
+        self.agreed = 0
+        self._diff_sum = 0.0
+        self.max_diff = 0.0
+
+    def observe(self, seconds, rows):
+        with self._lock:
+            self._latencies.append(seconds)
+            self.batches += 1
+            self.images += rows
+
+    def fail(self):
+        with self._lock:
+            self.errors += 1
+
+    def compare(self, primary, shadow, primary_labels, shadow_labels):
+        """Count label agreement and the (calibrated) probability difference, image by image"""
+        with self._lock:
+            rows = zip(primary.reshape(-1), shadow.reshape(-1), primary_labels.reshape(-1), shadow_labels.reshape(-1))
+            for a, b, label_a, label_b in rows:
+                diff = abs(float(a) - float(b))
+                self.compared += 1
+                self.agreed += int(label_a == label_b)
+                self._diff_sum += diff
+                self.max_diff = max(self.max_diff, diff)
+
+    def as_dict(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {'batches': self.batches, 'images': self.images, 'errors': self.errors}
+            if latencies:
+                stats['latency_ms'] = {
+                    'p50': round(latencies[len(latencies) // 2] * 1000, 3),
+                    'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 3),
+                    'mean': round(sum(latencies) / len(latencies) * 1000, 3),
+                }
+            if self.compared:
+                stats['compared'] = self.compared
+                stats['agreement'] = round(self.agreed / self.compared, 4)
+                stats['mean_abs_diff'] = round(self._diff_sum / self.compared, 6)
+                stats['max_abs_diff'] = round(self.max_diff, 6)
+            return stats
+
+
+class ModelVersion:
+    """One registered model file and, once loaded, its backend"""
+
+    def __init__(self, version, path, fingerprint=None, metadata=None, registered_at=None):
+        self.version = version
+        self.path = path
+        self.location = path  # path resolved against the manifest's directory
+        self.fingerprint = fingerprint
+        self.metadata = dict(metadata or {})
+        self.registered_at = registered_at or time.time()
+        self.backend = None
+        self.calibration = None  # loaded with the backend from the artifact next to the model
+        self.load_ms = None
+        self.stats = VersionStats()
+
+    def to_json(self):
+        return {'path': self.path, 'fingerprint': self.fingerprint,
+                'registered_at': self.registered_at, 'metadata': self.metadata}
+
+    def describe(self):
+        info = {'version': self.version, **self.to_json(), 'loaded': self.backend is not None}
+        if self.backend is not None:
+            info['backend'] = self.backend.name
+            info['load_ms'] = self.load_ms
+            info['calibration'] = {'method': self.calibration.method, 'threshold': self.calibration.threshold}
+        info['stats'] = self.stats.as_dict()
+        return info
+
+
+class ModelRegistry:
+    """Serve the active model version through predict(), shadow-scoring a candidate on a sample of batches
+
+    load_fn(path, timings) loads a backend (model_loader.load_local_backend by default). The
+    registry itself has the backend interface (name, predict, warm_up), so it can stand in for
+    a backend wherever one is expected.
+    """
+
+    def __init__(self, manifest_path=None, load_fn=load_local_backend, shadow_workers=1, max_shadow_pending=4, warmup_shape=(1, 256, 256, 1), seed=None):
+        self.manifest_path = manifest_path
+        self.load_fn = load_fn
+        self.max_shadow_pending = max_shadow_pending
+        self.warmup_shape = warmup_shape
+        self.versions = {}
+        self.shadow_dropped = 0
+        self.swaps = 0
+
+        # (active, backend, shadow, shadow backend, fraction), replaced as a whole so predict()
+        # reads a consistent set: a swap may release a version's backend while a request still uses it
+        self._serving = (None, None, None, None, 0.0)
+        self._lock = threading.Lock()         # registry edits and swaps
+        self._shadow_lock = threading.Lock()  # pending shadow job count
+        self._shadow_pending = 0
+        self._shadow_workers = shadow_workers
+        self._executor = None
+        self._random = random.Random(seed)
+        self._listeners = []
+        self._manifest_mtime = None
+        self._watcher = None
+        self._watcher_pid = None
+        self._stop = threading.Event()
+
+        if manifest_path and os.path.exists(manifest_path):
+            self._read_manifest()
+
+    # --- manifest ---
+
+    def _resolve(self, path):
+        """Paths in the manifest are relative to the manifest's directory"""
+        if self.manifest_path is None or os.path.isabs(path):
+            return path
+        return os.path.join(os.path.dirname(os.path.abspath(self.manifest_path)), path)
+
+    def _read_manifest(self):
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        self._manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+        for version, entry in manifest.get('versions', {}).items():
+            if version not in self.versions:
+                self.versions[version] = ModelVersion(version, entry['path'], entry.get('fingerprint'),
+                                                      entry.get('metadata'), entry.get('registered_at'))
+                self.versions[version].location = self._resolve(entry['path'])
+        shadow = manifest.get('shadow') or {}
+        return manifest.get('active'), shadow.get('version'), float(shadow.get('fraction', 0.0))
+
+    def save(self, active=None, shadow=None, fraction=None):
+        """Write the manifest atomically (by default with the current active/shadow versions)"""
+        if self.manifest_path is None:
+            return
+        current_active, current_shadow, current_fraction = self.wanted()
+        active = active if active is not None else current_active
+        shadow = shadow if shadow is not None else current_shadow
+        fraction = fraction if fraction is not None else current_fraction
+        manifest = {
+            'active': active,
+            'shadow': {'version': shadow, 'fraction': fraction} if shadow else None,
+            'versions': {version: entry.to_json() for version, entry in self.versions.items()},
+        }
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        self._manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+
+    def wanted(self):
+        """(active, shadow, fraction) as the manifest has them, falling back to what is being served"""
+        if self.manifest_path and os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            shadow = manifest.get('shadow') or {}
+            return manifest.get('active'), shadow.get('version'), float(shadow.get('fraction', 0.0))
+        active, _, shadow, _, fraction = self._serving
+        return (active.version if active else None, shadow.version if shadow else None, fraction)
+
+    def register(self, path, version=None, metadata=None):
+        """Record a model file under a version name (v1, v2, ... by default); it is loaded on activation"""
+        with self._lock:
+            version = version or f"v{len(self.versions) + 1}"
+            if version in self.versions:
+                raise ValueError(f"Model version '{version}' is already registered")
+            resolved = self._resolve(path)
+            if not os.path.exists(resolved):
+                raise ValueError(f"Model file not found: {resolved}")
+            metadata = dict(metadata or {})
+            metadata.setdefault('size_bytes', _size(resolved))
+            entry = ModelVersion(version, path, model_fingerprint(resolved), metadata)
+            entry.location = resolved
+            self.versions[version] = entry
+            return entry
+
+    def _get(self, version):
+        if version not in self.versions:
+            raise ValueError(f"Unknown model version '{version}'. Registered: {', '.join(self.versions) or 'none'}")
+        return self.versions[version]
+
+    # --- loading and swapping ---
+
+    def _ensure_loaded(self, entry, timings=None, warmup=True):
+        if entry.backend is None:
+            fingerprint = model_fingerprint(entry.location)
+            if entry.fingerprint and fingerprint != entry.fingerprint:
+                print(f"Model version {entry.version}: {entry.location} changed since it was registered")
+            entry.fingerprint = fingerprint
+            timings = timings or LoadTimings()
+            backend = self.load_fn(entry.location, timings)
+            if warmup:
+                self._warm(backend, timings)
+            entry.load_ms = timings.total_ms()
+            entry.calibration = load_calibration(entry.location)
+            entry.backend = backend
+        return entry
+
+    def _warm(self, backend, timings):
+        import numpy as np
+        with timings.phase('first_call'):
+            if hasattr(backend, 'warm_up'):
+                backend.warm_up()
+            backend.predict(np.zeros(self.warmup_shape, dtype=np.float32))
+
+    def on_activate(self, callback):
+        """callback(entry) runs after every swap (e.g. to re-key caches on the new model)"""
+        self._listeners.append(callback)
+
+    def activate(self, version, timings=None, warmup=True):
+        """Load and warm `version` outside the request path, then make it the serving version
+
+        Requests already running keep the backend they started with; the previous version's
+        backend is released once nothing serves or shadows it.
+        """
+        entry = self._ensure_loaded(self._get(version), timings, warmup)
+        with self._lock:
+            previous, _, shadow, _, fraction = self._serving
+            if shadow is entry:
+                shadow, fraction = None, 0.0
+            self._serve(entry, shadow, fraction)
+            if previous is not None and previous is not entry:
+                self.swaps += 1
+            self._release_unused()
+        print(f"Serving model version {version} ({entry.backend.name}, loaded in {entry.load_ms} ms)")
+        for callback in self._listeners:
+            callback(entry)
+        return entry
+
+    def set_shadow(self, version, fraction):
+        """Shadow-score `version` on `fraction` of batches (None or 0 turns shadowing off)"""
+        if not version or not fraction:
+            with self._lock:
+                self._serve(self._serving[0], None, 0.0)
+                self._release_unused()
+            return None
+        if not 0 < fraction <= 1:
+            raise ValueError(f"Shadow fraction must be in (0, 1], got {fraction}")
+        entry = self._ensure_loaded(self._get(version))
+        with self._lock:
+            active = self._serving[0]
+            if entry is active:
+                raise ValueError(f"Model version '{version}' is already serving")
+            self._serve(active, entry, float(fraction))
+            self._release_unused()
+        print(f"Shadow-scoring model version {version} on {fraction:.0%} of batches")
+        return entry
+
+    def _serve(self, active, shadow, fraction):
+        self._serving = (active, active.backend if active else None,
+                         shadow, shadow.backend if shadow else None, fraction)
+
+    def _release_unused(self):
+        # Requests that read the old _serving keep their own reference to the backend
+        active, _, shadow, _, _ = self._serving
+        for entry in self.versions.values():
+            if entry is not active and entry is not shadow:
+                entry.backend = None
+
+    def load_active(self, timings=None, default_path=None):
+        """Load the manifest's active version for a cold start (no warm-up; the caller's loader does that)
+
+        Without a manifest, default_path is registered as v1 and served.
+        """
+        active, shadow, fraction = self.wanted()
+        if active is None:
+            if default_path is None:
+                raise ValueError("No active model version in the registry")
+            active = self.register(default_path).version
+        self.activate(active, timings, warmup=False)
+        if shadow:
+            self.set_shadow(shadow, fraction)
+        return self
+
+    def sync(self):
+        """Apply manifest changes (new versions, active or shadow switches); True if anything changed"""
+        if not self.manifest_path or not os.path.exists(self.manifest_path):
+            return False
+        if os.stat(self.manifest_path).st_mtime_ns == self._manifest_mtime:
+            return False
+        active, shadow, fraction = self._read_manifest()
+        serving_active, _, serving_shadow, _, serving_fraction = self._serving
+        if active and (serving_active is None or serving_active.version != active):
+            self.activate(active)
+        current_shadow = serving_shadow.version if serving_shadow else None
+        if shadow != current_shadow or fraction != serving_fraction:
+            self.set_shadow(shadow, fraction)
+        return True
+
+    def watch(self, interval=5.0):
+        """Poll the manifest in a daemon thread so every worker follows `activate`/`shadow` edits
+
+        Threads do not survive a fork, so a forked worker calls this again to start its own.
+        """
+        if not self.manifest_path or (self._watcher is not None and self._watcher_pid == os.getpid()):
+            return self
+
+        def poll():
+            while not self._stop.wait(interval):
+                try:
+                    self.sync()
+                except Exception as e:
+                    print(f"Model registry sync failed: {str(e)}")
+
+        self._watcher = threading.Thread(target=poll, name='model-registry', daemon=True)
+        self._watcher_pid = os.getpid()
+        self._watcher.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    # --- serving ---
+
+    def current(self):
+        """The serving ModelVersion"""
+        active = self._serving[0]
+        if active is None:
+            raise RuntimeError("No model version is being served")
+        return active
+
+    def current_backend(self):
+        """The serving version's backend, read together with the version (never None mid-swap)"""
+        active, backend = self._serving[:2]
+        if active is None:
+            raise RuntimeError("No model version is being served")
+        return backend
+
+    @property
+    def name(self):
+        return self.current_backend().name
+
+    def warm_up(self):
+        _, backend, _, shadow_backend, _ = self._serving
+        for entry_backend in (backend, shadow_backend):
+            if hasattr(entry_backend, 'warm_up'):
+                entry_backend.warm_up()
+
+    def predict(self, batch):
+        """Predict with the serving version; sampled batches are also queued for the shadow"""
+        active, backend, shadow, shadow_backend, fraction = self._serving
+        if active is None:
+            raise RuntimeError("No model version is being served")
+        start = time.perf_counter()
+        try:
+            output = backend.predict(batch)
+        except Exception:
+            active.stats.fail()
+            raise
+        active.stats.observe(time.perf_counter() - start, len(batch))
+
+        if shadow is not None and self._random.random() < fraction:
+            self._submit_shadow(active, shadow, shadow_backend, batch, output)
+        return output
+
+    def _submit_shadow(self, active, shadow, backend, batch, output):
+        with self._shadow_lock:
+            if self._shadow_pending >= self.max_shadow_pending:
+                # Never queue behind a slow candidate: skip this sample instead
+                self.shadow_dropped += 1
+                return
+            self._shadow_pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._shadow_workers, thread_name_prefix='shadow')
+        # Copies: the caller may reuse its input buffer (e.g. a shared-memory slot) right away
+        self._executor.submit(self._run_shadow, active, shadow, backend, batch.copy(), output.copy())
+
+    def _run_shadow(self, active, shadow, backend, batch, primary):
+        try:
+            start = time.perf_counter()
+            output = backend.predict(batch)
+            shadow.stats.observe(time.perf_counter() - start, len(batch))
+            # Each version is judged with its own calibration and threshold
+            shadow.stats.compare(active.calibration.apply(primary), shadow.calibration.apply(output),
+                                 active.calibration.labels(primary), shadow.calibration.labels(output))
+        except Exception as e:
+            shadow.stats.fail()
+            print(f"Shadow prediction failed for {shadow.version}: {str(e)}")
+        finally:
+            with self._shadow_lock:
+                self._shadow_pending -= 1
+
+    def drain(self, timeout=10.0):
+        """Wait for queued shadow predictions (tests and benchmarks)"""
+        deadline = time.monotonic() + timeout
+        while self._shadow_pending and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return self._shadow_pending == 0
+
+    def stats(self):
+        active, _, shadow, _, fraction = self._serving
+        return {
+            'active': active.version if active else None,
+            'shadow': shadow.version if shadow else None,
+            'shadow_fraction': fraction,
+            'shadow_pending': self._shadow_pending,
+            'shadow_dropped': self.shadow_dropped,
+            'swaps': self.swaps,
+            'versions': [entry.describe() for entry in self.versions.values()],
+        }
+
+    def gauges(self):
+        """(name, labels, value) rows for metrics.register_gauges"""
+        yield 'model_swaps', None, self.swaps
+        yield 'shadow_dropped', None, self.shadow_dropped
+        for entry in self.versions.values():
+            stats = entry.stats.as_dict()
+            labels = {'version': entry.version}
+            yield 'model_version_images', labels, stats['images']
+            yield 'model_version_errors', labels, stats['errors']
+            if 'latency_ms' in stats:
+                yield 'model_version_latency_p95_seconds', labels, stats['latency_ms']['p95'] / 1000.0
+            if 'agreement' in stats:
+                yield 'model_version_agreement', labels, stats['agreement']
+
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def registry_from_env(**options):
+    """MODEL_REGISTRY names the manifest; without it the registry serves MODEL_PATH alone"""
+    return ModelRegistry(os.environ.get('MODEL_REGISTRY'),
+                         max_shadow_pending=int(os.environ.get('SHADOW_MAX_PENDING', 4)), **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the model versions served by app.py and api/predict.py")
+    parser.add_argument('--manifest', default=os.environ.get('MODEL_REGISTRY', DEFAULT_MANIFEST))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    register = commands.add_parser('register', help="Add a model file as a new version")
+    register.add_argument('path')
+    register.add_argument('--version')
+    register.add_argument('--note', help="Free-text note stored in the version metadata")
+    register.add_argument('--activate', action='store_true', help="Also make it the serving version")
+
+    activate = commands.add_parser('activate', help="Serve a version (running servers swap within MODEL_REGISTRY_POLL_SECONDS)")
+    activate.add_argument('version')
+
+    shadow = commands.add_parser('shadow', help="Shadow-score a version on a fraction of traffic")
+    shadow.add_argument('version', nargs='?')
+    shadow.add_argument('--fraction', type=float, default=0.1)
+    shadow.add_argument('--off', action='store_true')
+
+    commands.add_parser('list', help="Show the registered versions")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.manifest)
+    if args.command == 'register':
+        metadata = {'note': args.note} if args.note else {}
+        # Stored relative to the manifest, so the manifest and models can move together
+        path = os.path.relpath(os.path.abspath(args.path), os.path.dirname(os.path.abspath(args.manifest)))
+        entry = registry.register(path, args.version, metadata)
+        registry.save(active=entry.version if args.activate or registry.wanted()[0] is None else None)
+        print(f"Registered {entry.version}: {entry.path} ({entry.fingerprint})")
+    elif args.command == 'activate':
+        registry._get(args.version)
+        active, shadow, fraction = registry.wanted()
+        if shadow == args.version:
+            shadow, fraction = '', 0.0
+        registry.save(active=args.version, shadow=shadow, fraction=fraction)
+        print(f"Active version: {args.version}")
+    elif args.command == 'shadow':
+        if args.off or not args.version:
+            registry.save(shadow='', fraction=0.0)
+            print("Shadow scoring off")
+        else:
+            registry._get(args.version)
+            if not 0 < args.fraction <= 1:
+                parser.error("--fraction must be in (0, 1]")
+            registry.save(shadow=args.version, fraction=args.fraction)
+            print(f"Shadow version: {args.version} on {args.fraction:.0%} of traffic")
+
+    active, shadow, fraction = registry.wanted()
+    for version, entry in registry.versions.items():
+        role = ' (active)' if version == active else f' (shadow {fraction:.0%})' if version == shadow else ''
+        print(f"  {version}{role}: {entry.path} {entry.fingerprint} {json.dumps(entry.metadata)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,13 @@
 
 def load_model_from_url():
-    import requests
-    import io
+    from model_fetch import fetch_model
 
     model_url = "YOUR_MODEL_URL_HERE"  # Replace with actual URL
+    model_sha256 = None  # Optional: expected SHA-256 of the file
 
-    if not os.path.exists('model.keras'):
-        print("Downloading model from cloud storage...")
-        response = requests.get(model_url)
-        with open('model.keras', 'wb') as f:
-            f.write(response.content)
-        print("Model downloaded successfully")
+    # Streams to /tmp/model-cache/<version>/, resumes partial downloads,
+    # and returns immediately when the verified file is already cached
+    model_path, stats = fetch_model(model_url, sha256=model_sha256)
+    print(f"Model ready at {model_path}: {stats.as_dict()}")
 
-    return load_model('model.keras')
+    return load_model(model_path)
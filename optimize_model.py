@@ -4,11 +4,24 @@ Model optimization script for Vercel deployment
 Reduces model size and improves loading performance
 """
 import os
+import json
+import time
+import argparse
 import tensorflow as tf
 from tensorflow.keras.models import load_model, save_model
 import numpy as np
 import tempfile
 
+from backends import KerasBackend, load_backend
+from calibration import load_calibration
+from model_loader import export_mmap_artifact
+from preprocessing import preprocess_batch
+
+TFLITE_MODES = ('float32', 'float16', 'dynamic', 'int8')
+ONNX_MODES = ('float32', 'dynamic', 'int8')
+ONNX_OPSET = 17
+CALIBRATION_DIR = os.path.join('public', 'uploads')
+
 def optimize_model_for_vercel():
     """Optimize the model for serverless deployment"""
     print("Loading original model...")
@@ -69,19 +82,17 @@ def create_model_url_loader():
 
     url_loader_code = '''
 def load_model_from_url():
-    import requests
-    import io
+    from model_fetch import fetch_model
 
     model_url = "YOUR_MODEL_URL_HERE"  # Replace with actual URL
+    model_sha256 = None  # Optional: expected SHA-256 of the file
 
-    if not os.path.exists('model.keras'):
-        print("Downloading model from cloud storage...")
-        response = requests.get(model_url)
-        with open('model.keras', 'wb') as f:
-            f.write(response.content)
-        print("Model downloaded successfully")
+    # Streams to /tmp/model-cache/<version>/, resumes partial downloads,
+    # and returns immediately when the verified file is already cached
+    model_path, stats = fetch_model(model_url, sha256=model_sha256)
+    print(f"Model ready at {model_path}: {stats.as_dict()}")
 
-    return load_model('model.keras')
+    return load_model(model_path)
 '''
 
     with open('model_url_loader.py', 'w') as f:
@@ -90,7 +101,212 @@ def load_model_from_url():
     print("Created model_url_loader.py template")
     print("Edit it with your model URL and integrate into your API")
 
+def load_calibration_images(image_dir=CALIBRATION_DIR, limit=None):
+    """Preprocess sample X-rays exactly like getResult() does, returns (N, 256, 256, 1) float32"""
+    names = sorted(n for n in os.listdir(image_dir) if n.lower().endswith(('.jpg', '.jpeg', '.png')))
+    if limit:
+        names = names[:limit]
+
+    if not names:
+        raise ValueError(f"No calibration images found in {image_dir}")
+    return preprocess_batch([os.path.join(image_dir, n) for n in names]), names
+
+def export_tflite(model, output_path, mode='float16', calibration_images=None):
+    """Convert a Keras model to TFLite
+
+    Modes:
+      float32  - plain conversion, no quantization
+      float16  - weights stored as float16 (~2x smaller)
+      dynamic  - dynamic-range int8 weights, float activations (~4x smaller)
+      int8     - full-integer int8 weights and activations, calibrated on sample images
+    """
+    if mode not in TFLITE_MODES:
+        raise ValueError(f"Unknown TFLite mode '{mode}'. Expected one of: {', '.join(TFLITE_MODES)}")
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if mode == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == 'dynamic':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif mode == 'int8':
+        if calibration_images is None:
+            calibration_images, _ = load_calibration_images()
+
+        def representative_dataset():
+            for image in calibration_images:
+                yield [image[np.newaxis].astype(np.float32)]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+
+    tflite_model = converter.convert()
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+    print(f"Saved {mode} TFLite model: {output_path} ({len(tflite_model) / (1024*1024):.1f} MB)")
+    return output_path
+
+def export_onnx(model, output_path, mode='float32', calibration_images=None, opset=ONNX_OPSET):
+    """Convert a Keras model to ONNX, graph-optimized offline by ONNX Runtime
+
+    Modes:
+      float32  - plain conversion
+      dynamic  - int8 weights, activations quantized on the fly
+      int8     - static int8 (QDQ) weights and activations, calibrated on sample images
+    """
+    if mode not in ONNX_MODES:
+        raise ValueError(f"Unknown ONNX mode '{mode}'. Expected one of: {', '.join(ONNX_MODES)}")
+    import onnxruntime as ort
+    import tf2onnx
+
+    base = os.path.splitext(output_path)[0]
+    raw_path = f"{base}.raw.onnx"
+    signature = [tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name='image')]
+    tf2onnx.convert.from_keras(model, input_signature=signature, opset=opset, output_path=raw_path)
+
+    # Constant folding, node fusions and redundant-node removal are saved into the file, so
+    # sessions skip that work at load; the "extended" level stays portable across CPUs
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    options.optimized_model_filepath = output_path if mode == 'float32' else f"{base}.opt.onnx"
+    ort.InferenceSession(raw_path, sess_options=options, providers=['CPUExecutionProvider'])
+    os.remove(raw_path)
+
+    if mode != 'float32':
+        from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static
+        optimized_path = options.optimized_model_filepath
+        if mode == 'dynamic':
+            quantize_dynamic(optimized_path, output_path, weight_type=QuantType.QInt8)
+        else:
+            if calibration_images is None:
+                calibration_images, _ = load_calibration_images()
+
+            class SampleReader(CalibrationDataReader):
+                def __init__(self):
+                    self.rows = iter(calibration_images)
+
+                def get_next(self):
+                    row = next(self.rows, None)
+                    return None if row is None else {'image': row[np.newaxis].astype(np.float32)}
+
+            quantize_static(optimized_path, output_path, SampleReader(), quant_format=QuantFormat.QDQ,
+                            activation_type=QuantType.QInt8, weight_type=QuantType.QInt8)
+        os.remove(optimized_path)
+
+    print(f"Saved {mode} ONNX model: {output_path} ({os.path.getsize(output_path) / (1024*1024):.1f} MB)")
+    return output_path
+
+def _time_per_image(backend, images, runs):
+    """Per-image latency in ms for batch-of-one predictions, like getResult()"""
+    latencies = []
+    backend.predict(images[:1])  # warm up
+    for _ in range(runs):
+        for i in range(len(images)):
+            start = time.perf_counter()
+            backend.predict(images[i:i + 1])
+            latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+def _throughput(backend, images, batch_size=16):
+    """Images per second when predicting in batches, like the batch endpoint"""
+    backend.predict(images[:batch_size])  # warm up
+    start = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        backend.predict(images[i:i + batch_size])
+    return len(images) / (time.perf_counter() - start)
+
+def compare_backends(model_path, candidate_paths, images, runs=3):
+    """Accuracy/latency/throughput report of each exported model (.tflite, .onnx) against the Keras baseline"""
+    keras_backend = KerasBackend.load(model_path)
+    calibration = load_calibration(model_path)
+    baseline = keras_backend.predict(images)[:, 0]
+    baseline_labels = calibration.labels(baseline)
+
+    report = {'images': len(images), 'runs': runs, 'backends': {}}
+    candidates = [('keras', model_path, keras_backend)]
+    candidates += [(os.path.basename(p), p, load_backend(p)) for p in candidate_paths]
+
+    for name, path, backend in candidates:
+        probs = np.concatenate([backend.predict(images[i:i + 1])[:, 0] for i in range(len(images))])
+        latencies = _time_per_image(backend, images, runs)
+        report['backends'][name] = {
+            'path': path,
+            'size_mb': round(os.path.getsize(path) / (1024*1024), 2),
+            'latency_ms_mean': round(float(latencies.mean()), 2),
+            'latency_ms_p95': round(float(np.percentile(latencies, 95)), 2),
+            'images_per_sec_batch16': round(_throughput(backend, images), 1),
+            'max_abs_prob_diff': round(float(np.abs(probs - baseline).max()), 5),
+            'label_agreement': round(float(np.mean(calibration.labels(probs) == baseline_labels)), 4),
+        }
+        r = report['backends'][name]
+        print(f"{name:28s} {r['size_mb']:8.1f} MB  {r['latency_ms_mean']:8.2f} ms/img  "
+              f"{r['images_per_sec_batch16']:8.1f} img/s  "
+              f"max diff {r['max_abs_prob_diff']:.4f}  agreement {r['label_agreement']:.2%}")
+    return report
+
+def export_all_tflite(model_path, modes, report_path=None):
+    """Export the requested TFLite variants and optionally write a comparison report"""
+    model = load_model(model_path)
+    images, _ = load_calibration_images()
+    base = os.path.splitext(model_path)[0]
+
+    paths = [export_tflite(model, f"{base}_{mode}.tflite", mode, calibration_images=images) for mode in modes]
+
+    if report_path:
+        report = compare_backends(model_path, paths, images)
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Comparison report written to {report_path}")
+    return paths
+
+def export_all_onnx(model_path, modes, report_path=None):
+    """Export the requested ONNX variants and optionally write a comparison report"""
+    model = load_model(model_path)
+    images, _ = load_calibration_images()
+    base = os.path.splitext(model_path)[0]
+
+    paths = [export_onnx(model, f"{base}.onnx" if mode == 'float32' else f"{base}_{mode}.onnx", mode,
+                         calibration_images=images) for mode in modes]
+
+    if report_path:
+        report = compare_backends(model_path, paths, images)
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Comparison report written to {report_path}")
+    return paths
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Optimize model.keras for deployment")
+    parser.add_argument('--model', default='model.keras', help="Keras model to optimize")
+    parser.add_argument('--tflite', nargs='+', choices=TFLITE_MODES + ('all',),
+                        help="Export TFLite variants instead of the Vercel optimization")
+    parser.add_argument('--onnx', nargs='+', choices=ONNX_MODES + ('all',),
+                        help="Export ONNX variants (needs tf2onnx and onnxruntime)")
+    parser.add_argument('--report', help="Write a Keras vs TFLite/ONNX accuracy/latency report (JSON)")
+    parser.add_argument('--mmap', metavar='DIR',
+                        help="Export a memory-mappable artifact directory (serve with MODEL_PATH=DIR)")
+    args = parser.parse_args()
+
+    if args.mmap:
+        export_mmap_artifact(load_model(args.model), args.mmap)
+        raise SystemExit(0)
+
+    if args.onnx:
+        modes = ONNX_MODES if 'all' in args.onnx else tuple(args.onnx)
+        export_all_onnx(args.model, modes, args.report)
+        print("\nServe a variant with: MODEL_PATH=model.onnx gunicorn app:app")
+        raise SystemExit(0)
+
+    if args.tflite:
+        modes = TFLITE_MODES if 'all' in args.tflite else tuple(args.tflite)
+        export_all_tflite(args.model, modes, args.report)
+        print("\nServe a variant with: MODEL_PATH=model_float16.tflite gunicorn app:app")
+        raise SystemExit(0)
+
     print("Model Optimization for Vercel Deployment")
     print("=" * 50)
 
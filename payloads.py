@@ -0,0 +1,56 @@
+"""
+Request payload helpers shared by the serverless handlers
+Decodes base64 / data URL images and multipart/form-data bodies using only the standard library
+"""
+import base64
+import binascii
+from email import message_from_bytes
+from email.policy import HTTP
+
+
+def get_header(request, name, default=''):
+    """Case-insensitive header lookup on a Vercel-style request dict"""
+    headers = request.get('headers') or {}
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return default
+
+
+def body_bytes(body):
+    """Request bodies may arrive as str or bytes; return bytes without copying when possible"""
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        return body
+    return body.encode('latin-1') if body else b''
+
+
+def decode_base64_image(image_data):
+    """Decode raw base64 or a "data:image/...;base64," URL; raises ValueError if invalid"""
+    if not isinstance(image_data, str) or not image_data:
+        raise ValueError("Expected a non-empty base64 string")
+    if image_data.startswith('data:'):
+        # Handle data URL format: "data:image/jpeg;base64,..."
+        _, image_data = image_data.split(',', 1)
+    try:
+        return base64.b64decode(image_data, validate=False)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(str(e))
+
+
+def parse_multipart(body, content_type):
+    """Split a multipart/form-data body into (field_name, filename, bytes) tuples"""
+    if 'multipart/form-data' not in content_type.lower() or 'boundary=' not in content_type:
+        raise ValueError("Expected multipart/form-data with a boundary")
+
+    head = f"Content-Type: {content_type}\r\nMIME-Version: 1.0\r\n\r\n".encode('latin-1')
+    message = message_from_bytes(head + bytes(body_bytes(body)), policy=HTTP)
+    if not message.is_multipart():
+        raise ValueError("Malformed multipart body")
+
+    parts = []
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        filename = part.get_param('filename', header='content-disposition')
+        parts.append((name, filename, part.get_payload(decode=True) or b''))
+    return parts
@@ -0,0 +1,244 @@
+"""
+Content-addressed prediction cache
+Keys results by a hash of the raw uploaded bytes plus the model fingerprint, with an in-memory
+LRU tier and an optional SQLite tier that survives worker restarts
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Bytes hashed from each end of the model file for its fingerprint (plus size and mtime)
+_FINGERPRINT_SAMPLE = 1 << 20
+
+
+def hash_bytes(data):
+    """Fast content hash of raw image bytes"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _update_file_digest(digest, path):
+    stat = os.stat(path)
+    digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(_FINGERPRINT_SAMPLE))
+        if stat.st_size > 2 * _FINGERPRINT_SAMPLE:
+            f.seek(-_FINGERPRINT_SAMPLE, os.SEEK_END)
+            digest.update(f.read())
+
+
+def model_fingerprint(model_path):
+    """Identify a model file (or artifact directory) by size, mtime and a hash of its first and last megabyte"""
+    digest = hashlib.blake2b(digest_size=8)
+    if os.path.isdir(model_path):
+        for name in sorted(os.listdir(model_path)):
+            digest.update(name.encode())
+            _update_file_digest(digest, os.path.join(model_path, name))
+    else:
+        _update_file_digest(digest, model_path)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """Two-tier cache of JSON-serializable prediction results"""
+
+    def __init__(self, max_entries=1024, disk_path=None, max_disk_entries=100000, check_interval=1.0):
+        self.max_entries = int(max_entries)
+        self.max_disk_entries = int(max_disk_entries)
+        self.check_interval = check_interval
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_path = None
+        self._model_stat = None
+        self._fingerprint = None
+        self._last_check = 0.0
+
+        self.disk_path = disk_path or None
+        self._db = None
+        self._disk_writes = 0
+        if self.disk_path:
+            with self._lock:
+                self._database_locked()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(before=self._before_fork, after_in_parent=self._after_fork_in_parent,
+                                after_in_child=self._after_fork)
+
+    def _database_locked(self):
+        """This process's SQLite connection, opened on first use (None without a disk tier)"""
+        if self._db is None and self.disk_path:
+            self._db = sqlite3.connect(self.disk_path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS predictions '
+                             '(key TEXT PRIMARY KEY, fingerprint TEXT, value TEXT, created REAL)')
+        return self._db
+
+    def _before_fork(self):
+        # SQLite connections must not cross a fork (gunicorn --preload): close it while holding
+        # the lock so no thread reopens it in between; parent and child each reopen on first use
+        self._lock.acquire()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _after_fork_in_parent(self):
+        self._lock.release()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 or self.disk_path is not None
+
+    @property
+    def fingerprint(self):
+        return self._fingerprint
+
+    def watch_model(self, model_path):
+        """Tie cached results to a model file; entries are dropped when the file changes"""
+        with self._lock:
+            self._model_path = model_path
+            self._model_stat = None
+            self._refresh_locked(force=True)
+
+    def set_fingerprint(self, fingerprint):
+        """Tie cached results to an explicit model identity (e.g. the MODEL_URL it came from)"""
+        with self._lock:
+            self._model_path = None
+            if fingerprint != self._fingerprint:
+                self._invalidate_locked(fingerprint)
+
+    def _refresh_locked(self, force=False):
+        if self._model_path is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+
+        try:
+            stat = os.stat(self._model_path)
+        except OSError:
+            return
+        key = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        if key == self._model_stat:
+            return
+        self._model_stat = key
+        fingerprint = model_fingerprint(self._model_path)
+        if fingerprint != self._fingerprint:
+            self._invalidate_locked(fingerprint)
+
+    def _invalidate_locked(self, fingerprint):
+        if self._fingerprint is not None:
+            self.invalidations += 1
+            print(f"Model changed, invalidating prediction cache ({len(self._memory)} entries)")
+        self._memory.clear()
+        self._fingerprint = fingerprint
+        if self.disk_path:
+            self._database_locked().execute('DELETE FROM predictions WHERE fingerprint != ?', (fingerprint,))
+
+    def key(self, image_bytes):
+        return hash_bytes(image_bytes)
+
+    def get(self, image_bytes, key=None):
+        """Return the cached result for these bytes under the current model, or None"""
+        if not self.enabled:
+            return None
+        key = key or self.key(image_bytes)
+        with self._lock:
+            self._refresh_locked()
+            full_key = f"{self._fingerprint}:{key}"
+
+            value = self._memory.get(full_key)
+            if value is not None:
+                self._memory.move_to_end(full_key)
+                self.hits += 1
+                return value
+
+            if self.disk_path:
+                row = self._database_locked().execute('SELECT value FROM predictions WHERE key = ?', (full_key,)).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._store_memory_locked(full_key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, image_bytes, value, key=None):
+        if not self.enabled:
+            return
+        key = key or self.key(image_bytes)
+        with self._lock:
+            full_key = f"{self._fingerprint}:{key}"
+            self._store_memory_locked(full_key, value)
+            if self.disk_path:
+                self._database_locked().execute('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)',
+                                 (full_key, self._fingerprint, json.dumps(value), time.time()))
+                self._trim_disk_locked()
+
+    def _store_memory_locked(self, full_key, value):
+        if self.max_entries <= 0:
+            return
+        self._memory[full_key] = value
+        self._memory.move_to_end(full_key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _trim_disk_locked(self):
+        # Only count rows every 64 writes: most inserts don't need a trim
+        self._disk_writes += 1
+        if self.max_disk_entries <= 0 or self._disk_writes % 64:
+            return
+        db = self._database_locked()
+        count = db.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+        excess = count - self.max_disk_entries
+        if excess > 0:
+            db.execute('DELETE FROM predictions WHERE key IN '
+                             '(SELECT key FROM predictions ORDER BY created LIMIT ?)', (excess,))
+            self.evictions += excess
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self.disk_path:
+                self._database_locked().execute('DELETE FROM predictions')
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'fingerprint': self._fingerprint,
+                'memory_entries': len(self._memory),
+                'max_entries': self.max_entries,
+                'disk': self.disk_path is not None,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def cache_from_env():
+    """PREDICTION_CACHE_SIZE entries in memory (0 disables), PREDICTION_CACHE_DB for the SQLite tier"""
+    return PredictionCache(
+        max_entries=int(os.environ.get('PREDICTION_CACHE_SIZE', 1024)),
+        disk_path=os.environ.get('PREDICTION_CACHE_DB') or None,
+    )
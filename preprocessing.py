@@ -0,0 +1,130 @@
+"""
+Shared image preprocessing for app.py and api/predict.py
+Decodes straight to grayscale and fills a (N, 256, 256, 1) float32 batch without going through PIL
+"""
+import numpy as np
+import cv2
+
+from image_validation import InvalidImage, check, jpeg_size
+
+IMAGE_SIZE = 256
+
+# JPEG can be decoded at 1/2, 1/4 or 1/8 resolution for almost free
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+)
+
+# Keep at least this much oversampling after a reduced decode so the final
+# INTER_AREA resize still matches the full-resolution result closely
+_MIN_OVERSAMPLE = 2
+
+
+def reduction_factor(height, width, size=IMAGE_SIZE):
+    """Largest JPEG reduced-decode factor that still leaves enough pixels for an accurate resize"""
+    for factor, _ in _REDUCED_FLAGS:
+        if min(height, width) // factor >= size * _MIN_OVERSAMPLE:
+            return factor
+    return 1
+
+
+def _reduced_flag(data, size):
+    dims = jpeg_size(data)
+    if dims is None:
+        return cv2.IMREAD_GRAYSCALE
+    factor = reduction_factor(*dims, size=size)
+    for f, flag in _REDUCED_FLAGS:
+        if f == factor:
+            return flag
+    return cv2.IMREAD_GRAYSCALE
+
+
+def decode_grayscale(source, reduced=True, size=IMAGE_SIZE):
+    """Decode a file path or encoded image bytes to a 2-D uint8 array, or None if unreadable
+
+    With reduced=True, large JPEGs are decoded at a fraction of their resolution.
+    """
+    if isinstance(source, str):
+        if not reduced:
+            return cv2.imread(source, cv2.IMREAD_GRAYSCALE)
+        try:
+            with open(source, 'rb') as f:
+                source = f.read()
+        except OSError:
+            return None
+
+    buffer = np.frombuffer(source, np.uint8)
+    if buffer.size == 0:
+        return None
+    flag = _reduced_flag(buffer, size) if reduced else cv2.IMREAD_GRAYSCALE
+    return cv2.imdecode(buffer, flag)
+
+
+def decode_checked(data, size=IMAGE_SIZE):
+    """Validate encoded bytes from their header, then decode them to a 2-D uint8 array
+
+    Large JPEGs are decoded at the reduced scale that keeps the result within the per-image
+    memory limit. Raises image_validation.InvalidImage (a ValueError carrying an HTTP status)
+    instead of returning None.
+    """
+    info, factor = check(data)
+    if info.format == 'jpeg':
+        factor = max(factor, reduction_factor(info.height, info.width, size))
+    flag = dict(_REDUCED_FLAGS).get(factor, cv2.IMREAD_GRAYSCALE)
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if image is None:
+        raise InvalidImage(f"{info.format.upper()} image could not be decoded. Please ensure it's a valid image file.")
+    return image
+
+
+def allocate_batch(n, size=IMAGE_SIZE):
+    """Preallocate a model input batch that preprocess_batch() can fill"""
+    return np.empty((n, size, size, 1), dtype=np.float32)
+
+
+def resize_gray(image, height=IMAGE_SIZE, width=IMAGE_SIZE, out=None):
+    """Resize a 2-D uint8 image to (height, width) uint8, into out if given"""
+    if out is None:
+        out = np.empty((height, width), dtype=np.uint8)
+
+    # INTER_AREA when shrinking and INTER_CUBIC when enlarging track PIL's default
+    # antialiased bicubic resize that the model was served with
+    shrinking = image.shape[0] >= height and image.shape[1] >= width
+    interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_CUBIC
+    cv2.resize(image, (width, height), dst=out, interpolation=interpolation)
+    return out
+
+
+def resize_into(image, out, scratch=None):
+    """Resize a 2-D uint8 image and write it normalized to [0, 1] into out (a (H, W) or (H, W, 1) float32 view)"""
+    height, width = out.shape[:2]
+    scratch = resize_gray(image, height, width, scratch)
+
+    target = out[..., 0] if out.ndim == 3 else out
+    np.divide(scratch, np.float32(255.0), out=target, dtype=np.float32)
+    return out
+
+
+def preprocess_batch(sources, out=None, reduced=True, size=IMAGE_SIZE):
+    """Decode and preprocess a list of paths / encoded bytes / decoded uint8 arrays into one batch
+
+    Returns an (N, size, size, 1) float32 array. Raises ValueError naming the first unreadable image.
+    """
+    if out is None:
+        out = allocate_batch(len(sources), size)
+    elif out.shape[0] < len(sources) or out.shape[1:] != (size, size, 1):
+        raise ValueError(f"Batch buffer of shape {out.shape} cannot hold {len(sources)} images")
+
+    scratch = np.empty((size, size), dtype=np.uint8)
+    for i, source in enumerate(sources):
+        image = source if isinstance(source, np.ndarray) and source.ndim == 2 else decode_grayscale(source, reduced, size)
+        if image is None:
+            raise ValueError(f"Image {i} could not be decoded. Please ensure it's a valid image file.")
+        resize_into(image, out[i], scratch)
+    return out[:len(sources)]
+
+
+def preprocess(source, reduced=True, size=IMAGE_SIZE):
+    """Preprocess a single image into a (1, size, size, 1) batch"""
+    return preprocess_batch([source], reduced=reduced, size=size)
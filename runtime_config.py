@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+CPU threading and affinity for inference workers
+
+Resolves intra-op, inter-op, OpenMP and OpenCV thread counts per worker and applies them
+before TensorFlow starts, so N workers share the cores instead of each spawning a thread
+per core. Settings come from (lowest to highest priority) the core count split across the
+gunicorn workers (--workers, else WEB_CONCURRENCY), an autotuned result (RUNTIME_AUTOTUNE=1), a JSON file
+(RUNTIME_CONFIG) and individual environment variables:
+
+    TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS, OMP_NUM_THREADS, OPENCV_THREADS,
+    TF_ENABLE_ONEDNN_OPTS (0/1), WORKER_CPU_PINNING (1 pins gunicorn workers to disjoint cores)
+
+    python runtime_config.py --autotune --workers 4   # benchmark and cache the best setting
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ENV_VARS = {
+    'intra_op_threads': 'TF_INTRA_OP_THREADS',
+    'inter_op_threads': 'TF_INTER_OP_THREADS',
+    'omp_threads': 'OMP_NUM_THREADS',
+    'opencv_threads': 'OPENCV_THREADS',
+    'onednn': 'TF_ENABLE_ONEDNN_OPTS',
+    'pin_cpus': 'WORKER_CPU_PINNING',
+}
+BOOLEAN_KEYS = ('onednn', 'pin_cpus')
+
+DEFAULT_TUNE_CACHE = os.path.join('/tmp', 'runtime-tune.json')
+
+# Resolved configuration handed from the gunicorn master to its workers
+_RESOLVED_ENV = 'RUNTIME_CONFIG_RESOLVED'
+
+current = None
+
+
+def available_cpus():
+    """CPUs this process may run on (respects container cpusets)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def worker_count():
+    return max(int(os.environ.get('WEB_CONCURRENCY', 1)), 1)
+
+
+def default_config(workers=1, cpus=None):
+    """Split the available cores evenly across workers"""
+    cores = len(cpus) if cpus is not None else len(available_cpus())
+    budget = max(cores // max(workers, 1), 1)
+    return {
+        'intra_op_threads': budget,
+        'inter_op_threads': 2 if budget >= 4 else 1,
+        'omp_threads': budget,
+        'opencv_threads': None,
+        'onednn': None,
+        'pin_cpus': False,
+    }
+
+
+def _parse(key, value):
+    if value is None or value == '':
+        return None
+    if key in BOOLEAN_KEYS:
+        return str(value).lower() in ('1', 'true', 'yes', 'on')
+    value = int(value)
+    if value < 0:
+        raise ValueError(f"{key} must be >= 0, got {value}")
+    return value
+
+
+def config_from_env():
+    return {key: _parse(key, os.environ[var]) for key, var in ENV_VARS.items() if os.environ.get(var)}
+
+
+def config_from_file(path):
+    with open(path) as f:
+        data = json.load(f)
+    unknown = set(data) - set(ENV_VARS)
+    if unknown:
+        raise ValueError(f"Unknown runtime config keys in {path}: {', '.join(sorted(unknown))}")
+    return {key: _parse(key, value) for key, value in data.items()}
+
+
+def resolve_config(workers=None, config_path=None, autotune_model=None):
+    """Merge defaults, autotuned, file and environment settings (later wins)"""
+    workers = workers or worker_count()
+    config = default_config(workers)
+
+    if autotune_model is None and os.environ.get('RUNTIME_AUTOTUNE', '0') == '1':
+        autotune_model = os.environ.get('MODEL_PATH', 'model.keras')
+    if autotune_model and os.path.exists(autotune_model):
+        config.update(autotune(autotune_model, workers))
+
+    config_path = config_path or os.environ.get('RUNTIME_CONFIG')
+    if config_path:
+        config.update(config_from_file(config_path))
+    config.update(config_from_env())
+    return config
+
+
+def apply_environment(config):
+    """Export thread settings read by TensorFlow, oneDNN/OpenMP and the TFLite/ONNX backends at import time"""
+    if config.get('omp_threads'):
+        os.environ['OMP_NUM_THREADS'] = str(config['omp_threads'])
+    if config.get('intra_op_threads'):
+        os.environ['TF_NUM_INTRAOP_THREADS'] = str(config['intra_op_threads'])
+        os.environ.setdefault('TFLITE_NUM_THREADS', str(config['intra_op_threads']))
+        os.environ.setdefault('ONNX_INTRA_OP_THREADS', str(config['intra_op_threads']))
+    if config.get('inter_op_threads'):
+        os.environ['TF_NUM_INTEROP_THREADS'] = str(config['inter_op_threads'])
+        os.environ.setdefault('ONNX_INTER_OP_THREADS', str(config['inter_op_threads']))
+    if config.get('onednn') is not None:
+        os.environ['TF_ENABLE_ONEDNN_OPTS'] = '1' if config['onednn'] else '0'
+    os.environ[_RESOLVED_ENV] = json.dumps(config)
+
+
+def apply_opencv(config):
+    if config.get('opencv_threads') is not None:
+        import cv2
+        cv2.setNumThreads(config['opencv_threads'])
+
+
+def apply_tensorflow(config=None):
+    """Set TF's thread pools explicitly; only effective before the TF runtime has run anything"""
+    config = config or current
+    if not config or 'tensorflow' not in sys.modules:
+        return
+    import tensorflow as tf
+    try:
+        if config.get('intra_op_threads'):
+            tf.config.threading.set_intra_op_parallelism_threads(config['intra_op_threads'])
+        if config.get('inter_op_threads'):
+            tf.config.threading.set_inter_op_parallelism_threads(config['inter_op_threads'])
+    except RuntimeError as e:
+        print(f"TensorFlow threads already initialized, keeping environment settings: {e}")
+
+
+def cpu_set_for_worker(index, workers, cpus=None):
+    """Contiguous, disjoint slice of the CPUs for worker `index` (0-based)"""
+    cpus = cpus if cpus is not None else available_cpus()
+    workers = max(workers, 1)
+    if workers > len(cpus):
+        return [cpus[index % len(cpus)]]
+    span = len(cpus) // workers
+    start = (index % workers) * span
+    end = len(cpus) if index % workers == workers - 1 else start + span
+    return cpus[start:end]
+
+
+class CpuSlots:
+    """Slot indices handed out by the gunicorn master: each live worker holds the lowest free one
+
+    Worker ages keep counting up across restarts, so they can't be used as slots: a
+    replacement must take over the slice its predecessor freed.
+    """
+
+    def __init__(self):
+        self.held = {}  # worker -> slot
+
+    def acquire(self, worker):
+        used = set(self.held.values())
+        slot = next(i for i in range(len(used) + 1) if i not in used)
+        self.held[worker] = slot
+        return slot
+
+    def release(self, worker):
+        return self.held.pop(worker, None)
+
+
+def pin_worker(index, workers, config=None):
+    """Restrict the calling process to its CPU slice when pinning is enabled; returns the CPUs or None"""
+    config = config or current or {}
+    if not config.get('pin_cpus') or not hasattr(os, 'sched_setaffinity'):
+        return None
+    cpus = cpu_set_for_worker(index, workers)
+    os.sched_setaffinity(0, cpus)
+    print(f"Worker {index} pinned to CPUs {cpus}")
+    return cpus
+
+
+def configure(workers=None):
+    """Resolve and apply the runtime configuration once per process; returns it
+
+    Must run before TensorFlow is imported. A gunicorn master that already resolved the
+    configuration passes it to its workers through the environment.
+    """
+    global current
+    if current is not None:
+        return current
+    inherited = os.environ.get(_RESOLVED_ENV)
+    config = json.loads(inherited) if inherited else resolve_config(workers)
+    apply_environment(config)
+    apply_opencv(config)
+    current = config
+    if not inherited:
+        print(f"Runtime threads: {json.dumps(config)}")
+    return config
+
+
+# Autotuning: every candidate runs in a fresh process, since TF thread pools can't be resized
+
+def candidate_configs(budget):
+    intra = sorted({budget, max(budget // 2, 1), 1}, reverse=True)
+    inter = (1, 2) if budget > 1 else (1,)
+    return [{'intra_op_threads': i, 'inter_op_threads': j, 'omp_threads': i} for i in intra for j in inter]
+
+
+def measure_config(config, model_path, cpus, batch_size=8, seconds=3.0):
+    """Images/sec of model_path under config, measured in a subprocess limited to cpus"""
+    command = [sys.executable, os.path.abspath(__file__), '--measure', json.dumps(config),
+               '--model', model_path, '--cpus', ','.join(map(str, cpus)),
+               '--batch-size', str(batch_size), '--seconds', str(seconds)]
+    env = dict(os.environ)
+    env.pop(_RESOLVED_ENV, None)
+    output = subprocess.run(command, env=env, capture_output=True, text=True, timeout=600)
+    if output.returncode != 0:
+        print(f"Autotune candidate {config} failed: {output.stderr.strip()[-500:]}")
+        return 0.0
+    return json.loads(output.stdout.strip().splitlines()[-1])['images_per_sec']
+
+
+def _measure_here(config, model_path, cpus, batch_size, seconds):
+    """Child side of measure_config()"""
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    apply_environment(config)
+
+    import numpy as np
+    from benchmark import SAMPLE_DIR, load_samples
+    from backends import load_backend
+    from preprocessing import preprocess_batch
+
+    images = preprocess_batch([data for _, data in load_samples(SAMPLE_DIR)])
+    batch = images[np.arange(batch_size) % len(images)]
+    backend = load_backend(model_path)
+    backend.predict(batch)  # warm up
+
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        backend.predict(batch)
+        count += batch_size
+    return count / (time.perf_counter() - started)
+
+
+def _tune_key(model_path, workers, cpus):
+    from prediction_cache import model_fingerprint
+    return f"{len(cpus)}cpu:{workers}w:{model_fingerprint(model_path)}"
+
+
+def autotune(model_path, workers=1, cache_path=None, measure_fn=measure_config):
+    """Benchmark candidate thread settings on one worker's share of the CPUs and cache the fastest"""
+    cache_path = cache_path or os.environ.get('RUNTIME_TUNE_CACHE', DEFAULT_TUNE_CACHE)
+    cpus = available_cpus()
+    key = _tune_key(model_path, workers, cpus)
+
+    cache = {}
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+    if key in cache:
+        return cache[key]['config']
+
+    worker_cpus = cpu_set_for_worker(0, workers, cpus)
+    results = []
+    for candidate in candidate_configs(len(worker_cpus)):
+        rate = measure_fn(candidate, model_path, worker_cpus)
+        print(f"Autotune {candidate}: {rate:.1f} images/sec")
+        results.append((rate, candidate))
+    best_rate, best = max(results, key=lambda r: r[0])
+    if best_rate <= 0:
+        print("Autotune failed for every candidate, keeping defaults")
+        return {}
+
+    cache[key] = {'config': best, 'images_per_sec': round(best_rate, 2),
+                  'results': [dict(c, images_per_sec=round(r, 2)) for r, c in results]}
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, cache_path)
+    print(f"Autotune picked {best} ({best_rate:.1f} images/sec per worker)")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or autotune the inference thread configuration")
+    parser.add_argument('--model', default=os.environ.get('MODEL_PATH', 'model.keras'))
+    parser.add_argument('--workers', type=int, default=worker_count())
+    parser.add_argument('--autotune', action='store_true', help="Benchmark candidates and cache the best")
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    parser.add_argument('--cpus', default='', help=argparse.SUPPRESS)
+    parser.add_argument('--batch-size', type=int, default=8, help=argparse.SUPPRESS)
+    parser.add_argument('--seconds', type=float, default=3.0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        cpus = [int(c) for c in args.cpus.split(',') if c]
+        rate = _measure_here(json.loads(args.measure), args.model, cpus, args.batch_size, args.seconds)
+        print(json.dumps({'images_per_sec': rate}))
+        return
+
+    config = resolve_config(args.workers, autotune_model=args.model if args.autotune else None)
+    print(json.dumps(config, indent=2))
+
+
+if __name__ == "__main__":
+    main()
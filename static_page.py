@@ -0,0 +1,118 @@
+"""
+Pre-rendered index page with compressed variants, ETags and fingerprinted assets
+The template is read once; its inline <style> and <script> blocks become separate assets named
+by a hash of their content (cacheable forever), and every resource is compressed ahead of time
+with gzip (and brotli when the module is installed) so requests only pick a variant.
+"""
+import gzip
+import hashlib
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSET_PREFIX = '/assets/'
+HTML_CACHE_CONTROL = 'no-cache'  # always revalidate; the ETag makes that a 304
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Only attribute-less blocks are inline code; <script src=...> tags are left alone
+_INLINE_BLOCKS = (
+    (re.compile(r'<style>(.*?)</style>', re.S), 'css', 'text/css; charset=utf-8',
+     '<link rel="stylesheet" href="{url}">'),
+    (re.compile(r'<script>(.*?)</script>', re.S), 'js', 'text/javascript; charset=utf-8',
+     '<script src="{url}"></script>'),
+)
+
+
+def choose_encoding(accept_encoding, available):
+    """Best of br > gzip > identity that the client accepts (q=0 excludes an encoding)"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    for encoding in ('br', 'gzip'):
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if encoding in available and q > 0:
+            return encoding
+    return 'identity'
+
+
+class Resource:
+    """One response body, precompressed, with a strong ETag per encoding"""
+
+    def __init__(self, body, content_type, cache_control):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:20]
+        self.variants = {'identity': body}
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body):
+            self.variants['gzip'] = compressed
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                self.variants['br'] = compressed
+
+    def etag(self, encoding='identity'):
+        return f'"{self.digest}"' if encoding == 'identity' else f'"{self.digest}-{encoding}"'
+
+    def not_modified(self, if_none_match):
+        if not if_none_match:
+            return False
+        tags = {tag.strip() for tag in if_none_match.split(',')}
+        return '*' in tags or any(self.etag(encoding) in tags for encoding in self.variants)
+
+    def respond(self, accept_encoding=None, if_none_match=None):
+        """(status, headers, body bytes) for a GET with these request headers"""
+        encoding = choose_encoding(accept_encoding, self.variants)
+        headers = {
+            'Content-Type': self.content_type,
+            'Cache-Control': self.cache_control,
+            'ETag': self.etag(encoding),
+            'Vary': 'Accept-Encoding',
+        }
+        if self.not_modified(if_none_match):
+            return 304, headers, b''
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        body = self.variants[encoding]
+        headers['Content-Length'] = str(len(body))
+        return 200, headers, body
+
+
+class Page:
+    """The index template with its inline CSS/JS moved to fingerprinted assets"""
+
+    def __init__(self, template_path, asset_prefix=ASSET_PREFIX):
+        with open(template_path, 'r', encoding='utf-8') as f:
+            html = f.read()
+        self.assets = {}
+        for pattern, extension, content_type, tag in _INLINE_BLOCKS:
+            html = pattern.sub(lambda match: self._extract(match.group(1), extension, content_type,
+                                                           tag, asset_prefix), html)
+        self.html = Resource(html, 'text/html; charset=utf-8', HTML_CACHE_CONTROL)
+        self.asset_prefix = asset_prefix
+
+    def _extract(self, code, extension, content_type, tag, asset_prefix):
+        resource = Resource(code.strip() + '\n', content_type, ASSET_CACHE_CONTROL)
+        name = f"index.{resource.digest[:12]}.{extension}"
+        self.assets[name] = resource
+        return tag.format(url=asset_prefix + name)
+
+    def resource_for(self, path):
+        """The asset for an asset path, None for an unknown asset, and the page for anything else"""
+        path = (path or '/').split('?', 1)[0]
+        if path.startswith(self.asset_prefix):
+            return self.assets.get(path[len(self.asset_prefix):])
+        return self.html
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Test script for admission control (includes an HTTP load generator run against an overloaded handler)
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+
+import predict
+from admission import AdmissionController, Deadline, DeadlineExceeded, Overloaded, parse_deadline, parse_priority
+from batching import BatchScheduler
+from benchmark import load_samples
+from loadtest import run_level
+from prediction_cache import PredictionCache
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'uploads')
+
+
+class SaturatedBackend:
+    """One model replica: predictions run one at a time and take `seconds` each"""
+    name = 'fake'
+
+    def __init__(self, seconds=0.01):
+        self.seconds = seconds
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        with self._lock:
+            self.calls += 1
+            time.sleep(self.seconds)
+        return batch.reshape(batch.shape[0], -1).mean(axis=1, keepdims=True)
+
+
+def test_parse_headers():
+    assert parse_priority(None) == 'normal' and parse_priority(' URGENT ') == 'urgent'
+    assert parse_deadline(None, 25000).remaining() <= 25.0
+    assert parse_deadline('60000', 25000).remaining() <= 25.0  # capped by the server
+    assert parse_deadline('500', 25000).remaining() <= 0.5
+    assert parse_deadline(None, 0).remaining() is None
+    for bad in (lambda: parse_priority('asap'), lambda: parse_deadline('soon', 1000), lambda: parse_deadline('-5', 1000)):
+        try:
+            bad()
+            raise AssertionError("Expected ValueError")
+        except ValueError:
+            pass
+
+
+def _admit_in_background(controller, priority, admitted, deadline=None):
+    def run():
+        try:
+            with controller.admit(priority, deadline):
+                admitted.append(priority)
+        except Overloaded as e:
+            admitted.append(f"{priority}:{e.status}")
+    thread = threading.Thread(target=run)
+    thread.start()
+    time.sleep(0.02)  # let it queue before the next one arrives
+    return thread
+
+
+def test_priority_lanes():
+    """Queued urgent studies are admitted before normal ones, and bulk jobs last"""
+    controller = AdmissionController(max_in_flight=1, max_queue=8)
+    admitted = []
+    holder = controller.admit('normal')
+    threads = [_admit_in_background(controller, priority, admitted)
+               for priority in ('bulk', 'bulk', 'normal', 'urgent', 'normal')]
+    assert controller.stats()['queued'] == {'urgent': 1, 'normal': 2, 'bulk': 2}
+    holder.release()
+    for thread in threads:
+        thread.join()
+    assert admitted == ['urgent', 'normal', 'normal', 'bulk', 'bulk'], admitted
+    assert controller.stats()['in_flight'] == 0
+    print(f"Admission order: {admitted}")
+
+
+def test_fast_shedding():
+    """A full queue answers 429 at once; bulk has its own cap and urgent evicts the newest bulk waiter"""
+    controller = AdmissionController(max_in_flight=1, max_queue=2, bulk_queue=2)
+    holder = controller.admit()
+    outcomes = []
+    waiting = [_admit_in_background(controller, 'bulk', outcomes) for _ in range(2)]
+
+    start = time.perf_counter()
+    try:
+        controller.admit('normal')
+        raise AssertionError("Expected Overloaded")
+    except Overloaded as e:
+        assert e.status == 429 and e.retry_after >= 1
+    assert time.perf_counter() - start < 0.005
+
+    urgent = _admit_in_background(controller, 'urgent', outcomes)
+    assert outcomes == ['bulk:429'] and controller.stats()['shed']['evicted'] == 1
+    holder.release()
+    for thread in waiting + [urgent]:
+        thread.join()
+    assert outcomes == ['bulk:429', 'urgent', 'bulk']
+    print(f"Shed: {controller.stats()['shed']}")
+
+
+def test_deadlines():
+    """Requests that can't be admitted in time get 503; expired work is skipped by the batch scheduler"""
+    controller = AdmissionController(max_in_flight=1, max_queue=8, initial_service_seconds=0.05)
+    holder = controller.admit()
+    try:
+        controller.admit(deadline=Deadline(0.01))  # expected wait 50 ms > 10 ms budget
+        raise AssertionError("Expected Overloaded")
+    except Overloaded as e:
+        assert e.status == 503
+    start = time.perf_counter()
+    try:
+        controller.admit(deadline=Deadline(0.08))  # might fit, but the slot never frees
+        raise AssertionError("Expected Overloaded")
+    except Overloaded as e:
+        assert e.status == 503 and time.perf_counter() - start < 0.2
+    holder.release()
+    assert controller.stats()['shed']['deadline'] == 2 and controller.stats()['queued']['normal'] == 0
+
+    seen = []
+    scheduler = BatchScheduler(lambda batch: seen.append(len(batch)) or batch.reshape(len(batch), -1)[:, :1],
+                               max_batch_size=8, max_wait_ms=20).start()
+    try:
+        expired = scheduler.submit(np.zeros((4, 4, 1), np.float32), Deadline(0.001))
+        live = scheduler.submit(np.ones((4, 4, 1), np.float32), Deadline(5))
+        assert live.result(5)[0] == 1.0
+        try:
+            expired.result(5)
+            raise AssertionError("Expected DeadlineExceeded")
+        except DeadlineExceeded as e:
+            assert e.status == 504
+        assert seen == [1] and scheduler.stats()['expired'] == 1
+    finally:
+        scheduler.stop()
+
+
+def test_async_admission():
+    """admit_async queues on the event loop; a cancelled waiter gives up its place (or its slot)"""
+    controller = AdmissionController(max_in_flight=1, max_queue=4)
+
+    async def scenario():
+        holder = await controller.admit_async()
+        order = []
+
+        async def client(priority):
+            with await controller.admit_async(priority):
+                order.append(priority)
+                await asyncio.sleep(0.01)
+
+        normal = asyncio.create_task(client('normal'))
+        urgent_first = asyncio.create_task(client('urgent'))
+        abandoned = asyncio.create_task(client('urgent'))
+        await asyncio.sleep(0.02)
+        assert controller.stats()['queued'] == {'urgent': 2, 'normal': 1, 'bulk': 0}
+        abandoned.cancel()  # the client disconnected while queued
+        await asyncio.sleep(0)
+        assert controller.stats()['queued']['urgent'] == 1
+
+        holder.release()
+        await asyncio.gather(normal, urgent_first)
+        assert order == ['urgent', 'normal'], order
+
+        holder = await controller.admit_async()
+        try:
+            await controller.admit_async(deadline=Deadline(0.3))
+            raise AssertionError("Expected Overloaded")
+        except Overloaded as e:
+            assert e.status == 503
+        holder.release()
+
+    asyncio.run(scenario())
+    stats = controller.stats()
+    assert stats['in_flight'] == 0 and sum(stats['queued'].values()) == 0
+    print(f"Async admission: {stats['admitted']}")
+
+
+def test_handler_sheds_and_checks_deadlines():
+    """api/predict.handler: 429 + Retry-After when full, 400 for bad headers, 504 once the deadline passed"""
+    saved = predict.admission, predict.model, predict.prediction_cache
+    predict.model = SaturatedBackend(0.0)
+    predict.prediction_cache = PredictionCache(max_entries=0)
+    image = load_samples(SAMPLE_DIR)[0][1]
+
+    def post(**headers):
+        headers.setdefault('Content-Type', 'application/octet-stream')
+        return predict.handler({'method': 'POST', 'body': image, 'headers': headers})
+
+    try:
+        predict.admission = AdmissionController(max_in_flight=1, max_queue=0, default_deadline_ms=25000)
+        with predict.admission.admit():
+            result = post()
+            assert result['statusCode'] == 429 and int(result['headers']['Retry-After']) >= 1
+            assert 'retry_after' in json.loads(result['body'])
+            batch = predict.batch_handler({'method': 'POST', 'body': json.dumps({'images': []}), 'headers': {}})
+            assert batch['statusCode'] == 429  # multi-image studies are admitted the same way
+        assert post()['statusCode'] == 200
+        assert post(**{'X-Priority': 'whenever'})['statusCode'] == 400
+        assert post(**{'X-Deadline-Ms': '0.001'})['statusCode'] == 504
+        assert predict.handler({'method': 'OPTIONS'})['statusCode'] == 200
+    finally:
+        predict.admission, predict.model, predict.prediction_cache = saved
+
+
+class _HandlerServer(BaseHTTPRequestHandler):
+    """Serves api/predict.handler over HTTP for the load generator"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        result = predict.handler({'method': 'POST', 'body': body, 'headers': dict(self.headers)})
+        payload = result['body'].encode()
+        self.send_response(result['statusCode'])
+        for name, value in result['headers'].items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # room for every client's connection; shedding is the handler's job
+
+
+def _overload(controller, samples, clients=48, requests=192):
+    predict.admission = controller
+    server = _Server(('127.0.0.1', 0), _HandlerServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/api/predict'
+        return run_level(url, samples, clients, requests, timeout=30)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_tail_latency_bounded_under_overload():
+    """48 closed-loop clients against one 10 ms model: the queue bound keeps p99 flat and sheds the rest"""
+    saved = predict.admission, predict.model, predict.prediction_cache
+    predict.model = SaturatedBackend(0.01)
+    predict.prediction_cache = PredictionCache(max_entries=0)
+    samples = load_samples(SAMPLE_DIR)
+    try:
+        unbounded = _overload(AdmissionController(max_in_flight=0), samples)
+        bounded = _overload(AdmissionController(max_in_flight=2, max_queue=4, default_deadline_ms=25000), samples)
+    finally:
+        predict.admission, predict.model, predict.prediction_cache = saved
+
+    for name, result in (('unbounded', unbounded), ('bounded', bounded)):
+        print(f"{name:9s} p50 {result['p50_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms  statuses {result['statuses']}")
+    assert unbounded['statuses'] == {'200': 192}
+    assert bounded['statuses'].get('429', 0) > 0
+    # Every admitted request waited behind at most max_in_flight + max_queue others
+    assert bounded['p99_ms'] < unbounded['p99_ms'] / 2
+
+
+if __name__ == "__main__":
+    print("Testing admission control...\n")
+    test_parse_headers()
+    test_priority_lanes()
+    test_fast_shedding()
+    test_deadlines()
+    test_async_admission()
+    test_handler_sheds_and_checks_deadlines()
+    test_tail_latency_bounded_under_overload()
+    print("\nAll tests completed!")
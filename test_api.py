@@ -89,6 +89,25 @@ def test_index_api():
     except Exception as e:
         print(f"Index API test failed: {e}")
 
+def test_cheap_requests_skip_heavy_imports():
+    """Preflights and 4xx answers come from a fresh import without NumPy, OpenCV or TensorFlow"""
+    import subprocess
+    script = (
+        "import json, sys\n"
+        "sys.path.insert(0, sys.argv[1])\n"
+        "import predict\n"
+        "statuses = [predict.handler(r)['statusCode'] for r in ({'method': 'OPTIONS'}, {'method': 'GET'},\n"
+        "            {'method': 'POST', 'body': ''}, {'method': 'POST', 'body': '{}'})]\n"
+        "print(json.dumps([statuses, [m for m in ('numpy', 'cv2', 'tensorflow') if m in sys.modules]]))\n"
+    )
+    api_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
+    env = dict(os.environ, MODEL_LOAD_MODE='lazy')
+    output = subprocess.run([sys.executable, '-c', script, api_dir], capture_output=True, text=True, env=env, check=True)
+    statuses, heavy = json.loads(output.stdout.strip().splitlines()[-1])
+    assert statuses == [200, 405, 400, 400], statuses
+    assert heavy == [], heavy
+    print(f"Cheap requests answered with {statuses}, no heavy imports")
+
 if __name__ == "__main__":
     print("Testing Vercel API functions...\n")
 
@@ -98,4 +117,7 @@ if __name__ == "__main__":
     print("\n2. Testing predict API:")
     test_predict_api()
 
+    print("\n3. Testing cheap requests:")
+    test_cheap_requests_skip_heavy_imports()
+
     print("\nAll tests completed!")
\ No newline at end of file
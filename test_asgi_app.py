@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Test script for the async (Quart) app, serving a stand-in model
+"""
+import asyncio
+import io
+import os
+import tempfile
+
+import pytest
+
+pytest.importorskip('quart')
+
+from werkzeug.datastructures import FileStorage
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'uploads', 'NORMAL2-IM-0229-0001.jpeg')
+
+
+class MeanPixelBackend:
+    """Stand-in model: the mean pixel value as the 'probability'"""
+    name = 'fake'
+
+    def predict(self, batch):
+        return batch.reshape(batch.shape[0], -1).mean(axis=1, keepdims=True)
+
+
+# app.py reads its configuration at import time; the placeholder file only has to exist
+_model_dir = tempfile.mkdtemp()
+with open(os.path.join(_model_dir, 'stub.onnx'), 'wb') as f:
+    f.write(b'placeholder')
+os.environ.update({'MODEL_PATH': os.path.join(_model_dir, 'stub.onnx'), 'MODEL_LOAD_MODE': 'background',
+                   'SAVE_UPLOADS': '0', 'TTA_VARIANTS': '1'})
+
+import asgi_app  # noqa: E402
+import app as sync_app  # noqa: E402
+from calibration import Calibration  # noqa: E402
+from image_validation import max_request_bytes  # noqa: E402
+from model_loader import BackgroundModelLoader  # noqa: E402
+
+# Serve the stand-in instead of the registry's (unloadable) placeholder
+sync_app.registry = None
+sync_app.calibration = Calibration()
+sync_app.model_loader = BackgroundModelLoader(lambda timings: MeanPixelBackend())
+sync_app.model_loader.load(warmup=False)
+
+with open(SAMPLE_IMAGE, 'rb') as f:
+    IMAGE_BYTES = f.read()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def render_capture(rendered, template, **context):
+    """Stands in for render_template: index.html fills its result box from JavaScript"""
+    rendered.append(context)
+    return template
+
+
+async def post(path, **kwargs):
+    client = asgi_app.app.test_client()
+    response = await client.post(path, **kwargs)
+    return response.status_code, response
+
+
+def test_index_page():
+    async def scenario():
+        client = asgi_app.app.test_client()
+        response = await client.get('/', headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200 and response.headers['Content-Encoding'] == 'gzip'
+        etag = response.headers['ETag']
+        response = await client.get('/', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+    run(scenario())
+
+
+def test_binary_and_form_predictions_agree():
+    """Raw bodies and form uploads on /predict and /api/predict give the same answer as app.py"""
+    sync_app.prediction_cache.clear()
+    expected = sync_app.getResultFromBytes(IMAGE_BYTES)
+    rendered = []
+    saved_render = asgi_app.render_template
+    asgi_app.render_template = lambda template, **context: render_capture(rendered, template, **context)
+
+    async def scenario():
+        status, response = await post('/api/predict', data=IMAGE_BYTES,
+                                      headers={'Content-Type': 'application/octet-stream'})
+        assert status == 200
+        body = await response.get_json()
+        assert (body['prediction'], body['percentage']) == expected
+
+        status, response = await post('/predict', data=IMAGE_BYTES, headers={'Content-Type': 'image/jpeg'})
+        assert status == 200 and (await response.get_json())['percentage'] == expected[1]
+
+        upload = FileStorage(io.BytesIO(IMAGE_BYTES), filename='xray.jpeg', content_type='image/jpeg')
+        status, response = await post('/api/predict', files={'image': upload})
+        assert status == 200 and (await response.get_json())['prediction'] == expected[0]
+
+        upload = FileStorage(io.BytesIO(IMAGE_BYTES), filename='xray.jpeg', content_type='image/jpeg')
+        status, response = await post('/predict', files={'image': upload})
+        assert status == 200 and rendered[-1]['prediction_text'] == f"{expected[0]} ({expected[1]}%)"
+
+        status, response = await post('/api/predict', data=IMAGE_BYTES,
+                                      headers={'Content-Type': 'application/octet-stream', 'X-TTA-Variants': '4'})
+        body = await response.get_json()
+        assert status == 200 and body['tta_variants'] == 4 and 'uncertainty' in body
+
+        status, response = await post('/api/predict', data=b'not an image',
+                                      headers={'Content-Type': 'application/octet-stream'})
+        assert status == 415
+    try:
+        run(scenario())
+    finally:
+        asgi_app.render_template = saved_render
+    print(f"ASGI predictions match app.py: {expected}")
+
+
+def test_form_uploads_use_tta_variants():
+    """Like app.py, form uploads to /predict average TTA_VARIANTS variants when it is set"""
+    saved = asgi_app.TTA_VARIANTS, asgi_app.render_template
+    rendered = []
+    asgi_app.TTA_VARIANTS = 4
+    asgi_app.render_template = lambda template, **context: render_capture(rendered, template, **context)
+
+    async def scenario():
+        upload = FileStorage(io.BytesIO(IMAGE_BYTES), filename='xray.jpeg', content_type='image/jpeg')
+        status, response = await post('/predict', files={'image': upload})
+        assert status == 200 and '% ± ' in rendered[-1]['prediction_text']
+    try:
+        run(scenario())
+    finally:
+        asgi_app.TTA_VARIANTS, asgi_app.render_template = saved
+
+
+class UnreadableBody(io.RawIOBase):
+    """A request body of `size` bytes that fails the test if the server starts reading it"""
+
+    def __init__(self, size):
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.position = self.size if whence == io.SEEK_END else offset  # the test client measures it
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        raise AssertionError("The oversized body was read")
+
+
+def test_oversized_bodies_refused_before_reading():
+    """Flask and Quart answer 413 from Content-Length alone, before reading a byte of the body"""
+    too_large = max_request_bytes() + 1
+    headers = {'Content-Type': 'application/octet-stream'}
+
+    flask_client = sync_app.app.test_client()
+    for path in ('/predict', '/api/predict', '/explain'):
+        response = flask_client.post(path, input_stream=UnreadableBody(too_large), headers=headers)
+        assert response.status_code == 413 and 'too large' in response.get_json()['error'], path
+    # /api/explain takes several images per request, so the same body is read and then refused per image
+    response = flask_client.post('/api/explain', data=b'\0' * too_large, headers=headers)
+    assert response.status_code == 413 and 'Error explaining image' in response.get_json()['error']
+
+    async def scenario():
+        for path in ('/predict', '/api/predict'):
+            status, response = await post(path, data=b'x', headers=dict(headers, **{'Content-Length': str(too_large)}))
+            assert status == 413 and 'too large' in (await response.get_json())['error'], path
+    run(scenario())
+    print(f"Bodies over {too_large - 1} bytes refused with 413")
+
+
+def test_metrics_endpoint_follows_metrics_enabled():
+    """Like app.py, /metrics is a 404 when METRICS_ENABLED=0 swapped in the null registry"""
+    from metrics import NullRegistry
+    saved = asgi_app.metrics, sync_app.metrics
+
+    async def scenario(expected):
+        response = await asgi_app.app.test_client().get('/metrics')
+        assert response.status_code == expected
+        return (await response.get_data()).decode()
+
+    try:
+        assert '# TYPE' in run(scenario(200))
+        asgi_app.metrics = sync_app.metrics = NullRegistry()
+        assert 'disabled' in run(scenario(404))
+        assert sync_app.app.test_client().get('/metrics').status_code == 404
+    finally:
+        asgi_app.metrics, sync_app.metrics = saved
+
+
+def test_admission_sheds_with_retry_after():
+    saved = asgi_app.admission
+
+    async def scenario():
+        holder = await asgi_app.admission.admit_async()
+        with holder:
+            status, response = await post('/api/predict', data=IMAGE_BYTES,
+                                          headers={'Content-Type': 'application/octet-stream'})
+            assert status == 429 and int(response.headers['Retry-After']) >= 1
+
+    from admission import AdmissionController
+    asgi_app.admission = AdmissionController(max_in_flight=1, max_queue=0)
+    try:
+        run(scenario())
+    finally:
+        asgi_app.admission = saved
+
+
+if __name__ == "__main__":
+    print("Testing ASGI app...\n")
+    test_index_page()
+    test_binary_and_form_predictions_agree()
+    test_form_uploads_use_tta_variants()
+    test_oversized_bodies_refused_before_reading()
+    test_metrics_endpoint_follows_metrics_enabled()
+    test_admission_sheds_with_retry_after()
+    print("\nAll tests completed!")
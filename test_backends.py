@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Test script for the inference backend helpers (no TensorFlow required)
+"""
+import numpy as np
+
+from backends import KerasBackend, bucket_for, dequantize, load_backend, pad_to_bucket, quantize
+
+
+def test_int8_quantization_roundtrip():
+    """Quantizing and dequantizing stays within one quantization step"""
+    details = {'dtype': np.int8, 'quantization': (1.0 / 255.0, -128)}
+    values = np.linspace(0.0, 1.0, 1000, dtype=np.float32)
+
+    quantized = quantize(values, details)
+    assert quantized.dtype == np.int8
+    restored = dequantize(quantized, details)
+    assert np.abs(restored - values).max() <= 1.0 / 255.0
+    print("int8 quantization roundtrip OK")
+
+
+def test_float_tensors_pass_through():
+    """float32 input/output tensors are not touched"""
+    details = {'dtype': np.float32, 'quantization': (0.0, 0)}
+    values = np.random.rand(2, 8, 8, 1).astype(np.float32)
+    assert quantize(values, details) is values
+    assert dequantize(values, details) is values
+    print("float32 tensors pass through")
+
+
+def test_unknown_backend_rejected():
+    """An unknown MODEL_BACKEND fails with a clear error"""
+    try:
+        load_backend('model.keras', backend='caffe')
+        raise AssertionError("Expected ValueError")
+    except ValueError as e:
+        assert 'caffe' in str(e)
+    print("Unknown backend rejected")
+
+
+class TracedKerasBackend(KerasBackend):
+    """KerasBackend whose "traced" functions are plain NumPy, recording the shapes they receive"""
+
+    def __init__(self, *args, **kwargs):
+        self.calls = []
+        super().__init__(*args, **kwargs)
+
+    def _trace(self, bucket):
+        def fn(x):
+            assert x.shape[0] == bucket, "inputs must arrive padded to the traced bucket"
+            self.calls.append(bucket)
+            return x.reshape(bucket, -1).mean(axis=1, keepdims=True)
+        return fn
+
+
+class FakeModel:
+    input_shape = (None, 4, 4, 1)
+
+
+def test_bucket_padding():
+    """Batches are zero-padded up to the nearest bucket"""
+    buckets = (1, 2, 4, 8)
+    assert [bucket_for(n, buckets) for n in (1, 2, 3, 5, 8, 9)] == [1, 2, 4, 8, 8, 8]
+    batch = np.ones((3, 4, 4, 1), dtype=np.float32)
+    padded, bucket = pad_to_bucket(batch, buckets)
+    assert bucket == 4 and padded.shape == (4, 4, 4, 1)
+    assert padded[3].sum() == 0 and padded[:3].sum() == batch.sum()
+    assert pad_to_bucket(padded, buckets)[0] is padded
+    print("Bucket padding OK")
+
+
+def test_compiled_predict_uses_buckets():
+    """Outputs are trimmed to the real batch; batches beyond the largest bucket are split"""
+    backend = TracedKerasBackend(FakeModel(), buckets=(1, 4, 2))
+    assert backend.buckets == (1, 2, 4)
+
+    batch = np.random.rand(7, 4, 4, 1).astype(np.float32)
+    output = backend.predict(batch)
+    assert output.shape == (7, 1)
+    assert np.allclose(output[:, 0], batch.reshape(7, -1).mean(axis=1), atol=1e-6)
+    assert backend.calls == [4, 4]
+
+    backend.calls.clear()
+    backend.warm_up()
+    assert sorted(backend.calls) == [1, 2, 4]
+    print(f"Compiled predict OK, buckets {backend.buckets}")
+
+
+if __name__ == "__main__":
+    print("Testing inference backends...\n")
+    test_int8_quantization_roundtrip()
+    test_float_tensors_pass_through()
+    test_unknown_backend_rejected()
+    test_bucket_padding()
+    test_compiled_predict_uses_buckets()
+    print("\nAll tests completed!")
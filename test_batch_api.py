@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Test script for the batch prediction handler, using a stand-in model (no TensorFlow required)
+"""
+import base64
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+
+import predict
+from preprocessing import preprocess_batch
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'uploads')
+
+
+class FakeBackend:
+    """Returns the mean pixel value as the pneumonia probability and records batch sizes"""
+    name = 'fake'
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict(self, batch):
+        self.batch_sizes.append(batch.shape[0])
+        return batch.reshape(batch.shape[0], -1).mean(axis=1, keepdims=True)
+
+
+class MockRequest:
+    def __init__(self, method, body=None, headers=None):
+        self.data = {'method': method, 'body': body, 'headers': headers or {}}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+
+def sample_bytes(n):
+    names = sorted(os.listdir(SAMPLE_DIR))[:n]
+    result = []
+    for name in names:
+        with open(os.path.join(SAMPLE_DIR, name), 'rb') as f:
+            result.append(f.read())
+    return result
+
+
+def install_fake_model():
+    fake = FakeBackend()
+    predict.model = fake
+    return fake
+
+
+def test_json_batch_with_item_errors():
+    """Valid images are scored in order; bad items get their own error"""
+    fake = install_fake_model()
+    images = sample_bytes(3)
+    payload = [base64.b64encode(images[0]).decode(),
+               'data:image/jpeg;base64,' + base64.b64encode(images[1]).decode(),
+               base64.b64encode(b'definitely not a jpeg').decode(),
+               base64.b64encode(images[2]).decode()]
+
+    result = predict.batch_handler(MockRequest('POST', json.dumps({'images': payload})))
+    assert result['statusCode'] == 200
+    data = json.loads(result['body'])
+    assert data['count'] == 4 and data['errors'] == 1
+    assert [r['index'] for r in data['results']] == [0, 1, 2, 3]
+    assert 'error' in data['results'][2]
+
+    for i, image in zip((0, 1, 3), images):
+        expected = predict.interpret(float(preprocess_batch([image]).mean()))[1]
+        assert abs(data['results'][i]['percentage'] - expected) < 0.02
+    assert fake.batch_sizes == [3]
+    print(f"JSON batch OK: {data['results']}")
+
+
+def test_chunked_forward_passes():
+    """Large requests run as several forward passes of at most BATCH_CHUNK_SIZE"""
+    fake = install_fake_model()
+    images = sample_bytes(10)
+    results = predict.getResults(images, chunk_size=4)
+    assert fake.batch_sizes == [4, 4, 2]
+    assert [r['index'] for r in results] == list(range(10))
+    print("Chunked forward passes OK")
+
+
+def test_multipart_batch():
+    """Several file fields in one multipart body"""
+    install_fake_model()
+    boundary = 'testboundary123'
+    body = b''
+    for i, image in enumerate(sample_bytes(2)):
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="images"; filename="x{i}.jpeg"\r\n'
+                 f'Content-Type: image/jpeg\r\n\r\n').encode() + image + b'\r\n'
+    body += f'--{boundary}--\r\n'.encode()
+
+    headers = {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    result = predict.batch_handler(MockRequest('POST', body, headers))
+    data = json.loads(result['body'])
+    assert result['statusCode'] == 200
+    assert data['count'] == 2 and data['errors'] == 0
+    print("Multipart batch OK")
+
+
+def test_request_errors():
+    """Whole-request problems still fail fast"""
+    install_fake_model()
+    assert predict.batch_handler(MockRequest('GET'))['statusCode'] == 405
+    assert predict.batch_handler(MockRequest('POST', '{"image": "abc"}'))['statusCode'] == 400
+    too_many = json.dumps({'images': ['x'] * (predict.MAX_BATCH_IMAGES + 1)})
+    assert predict.batch_handler(MockRequest('POST', too_many))['statusCode'] == 413
+    print("Request-level errors OK")
+
+
+if __name__ == "__main__":
+    print("Testing batch prediction API...\n")
+    test_json_batch_with_item_errors()
+    test_chunked_forward_passes()
+    test_multipart_batch()
+    test_request_errors()
+    print("\nAll tests completed!")
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Test script for the micro-batching scheduler (no TensorFlow required)
+"""
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from batching import BatchScheduler
+from deadlines import Deadline, DeadlineExceeded
+
+
+def mean_model(batch):
+    """Stand-in for model.predict: one output per image, the mean pixel value"""
+    return batch.reshape(batch.shape[0], -1).mean(axis=1, keepdims=True)
+
+
+def test_results_routed_to_callers():
+    """Each caller gets the output row for its own image"""
+    scheduler = BatchScheduler(mean_model, max_batch_size=8, max_wait_ms=20).start()
+    try:
+        images = [np.full((1, 4, 4, 1), i / 10.0, dtype=np.float32) for i in range(20)]
+        results = [None] * len(images)
+
+        def worker(i):
+            results[i] = scheduler.predict(images[i], timeout=5)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(images))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for i, row in enumerate(results):
+            assert row.shape == (1,)
+            assert abs(float(row[0]) - i / 10.0) < 1e-6
+        print("Results routed correctly")
+    finally:
+        scheduler.stop()
+
+
+def test_concurrent_requests_are_batched():
+    """Requests arriving within max_wait share a forward pass"""
+    calls = []
+
+    def recording_model(batch):
+        calls.append(batch.shape[0])
+        return mean_model(batch)
+
+    scheduler = BatchScheduler(recording_model, max_batch_size=16, max_wait_ms=50).start()
+    try:
+        futures = [scheduler.submit(np.zeros((4, 4, 1), dtype=np.float32)) for _ in range(16)]
+        for f in futures:
+            f.result(timeout=5)
+
+        stats = scheduler.stats()
+        assert sum(calls) == 16
+        assert len(calls) < 16
+        assert stats['items'] == 16
+        assert stats['batches'] == len(calls)
+        assert sum(size * n for size, n in stats['batch_size_histogram'].items()) == 16
+        print(f"Batch sizes: {calls}")
+    finally:
+        scheduler.stop()
+
+
+def test_max_wait_flushes_partial_batch():
+    """A lone request is not held longer than roughly max_wait"""
+    scheduler = BatchScheduler(mean_model, max_batch_size=64, max_wait_ms=10).start()
+    try:
+        start = time.monotonic()
+        scheduler.predict(np.zeros((4, 4, 1), dtype=np.float32), timeout=5)
+        elapsed = time.monotonic() - start
+        assert elapsed < 1.0
+        assert scheduler.stats()['queue_wait_ms']['max'] >= 5.0
+        print(f"Single request latency: {elapsed * 1000:.1f} ms")
+    finally:
+        scheduler.stop()
+
+
+def test_model_errors_propagate():
+    """A failing forward pass fails every request in the batch, not the scheduler"""
+    def broken_model(batch):
+        raise RuntimeError("boom")
+
+    scheduler = BatchScheduler(broken_model, max_batch_size=4, max_wait_ms=5).start()
+    try:
+        future = scheduler.submit(np.zeros((4, 4, 1), dtype=np.float32))
+        try:
+            future.result(timeout=5)
+            raise AssertionError("Expected RuntimeError")
+        except RuntimeError as e:
+            assert str(e) == "boom"
+        assert scheduler.stats()['errors'] == 1
+        print("Model errors propagate to callers")
+    finally:
+        scheduler.stop()
+
+
+def test_deadlines_without_admission():
+    """Expired items fail with DeadlineExceeded; the scheduler doesn't pull in the HTTP admission layer"""
+    scheduler = BatchScheduler(mean_model, max_batch_size=8, max_wait_ms=20).start()
+    try:
+        expired = scheduler.submit(np.zeros((4, 4, 1), np.float32), Deadline(0.0))
+        try:
+            expired.result(5)
+            raise AssertionError("Expected DeadlineExceeded")
+        except DeadlineExceeded as e:
+            assert e.status == 504
+    finally:
+        scheduler.stop()
+    code = "import sys, batching; assert 'admission' not in sys.modules"
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    print("Deadlines enforced without admission")
+
+
+if __name__ == "__main__":
+    print("Testing batch scheduler...\n")
+    test_results_routed_to_callers()
+    test_concurrent_requests_are_batched()
+    test_max_wait_flushes_partial_batch()
+    test_model_errors_propagate()
+    test_deadlines_without_admission()
+    print("\nAll tests completed!")
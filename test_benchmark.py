@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Test script for the benchmark report helpers and regression gate
+"""
+from benchmark import check_gate, flatten, summarize
+
+
+def sample_report(p95, throughput):
+    return {
+        'meta': {'commit': 'abc123', 'images': 30},
+        'stages': {'forward': {'p95_ms': p95, 'count': 30}},
+        'entry_points': {'api_handler': {'4': {'p95_ms': p95 * 2, 'images_per_sec': throughput}}},
+        'peak_rss_mb': 500.0,
+    }
+
+
+def test_summarize_percentiles():
+    """Latencies in seconds become ms percentiles and throughput"""
+    summary = summarize([0.01] * 99 + [0.1], images=100)
+    assert summary['p50_ms'] == 10.0
+    assert summary['p99_ms'] > 10.0
+    assert summary['images_per_sec'] == round(100 / 1.09, 2)
+    print(f"Summary: {summary}")
+
+
+def test_threshold_gate():
+    """Absolute thresholds on dotted metric paths"""
+    report = sample_report(p95=12.0, throughput=100.0)
+    assert 'stages.forward.p95_ms' in flatten(report)
+    assert check_gate(report, {'stages.forward.p95_ms': 20}) == []
+    failures = check_gate(report, {'stages.forward.p95_ms': 10, 'stages.decode.p95_ms': 5})
+    assert len(failures) == 2
+    print(f"Threshold failures: {failures}")
+
+
+def test_baseline_gate():
+    """Slower latency or lower throughput than the baseline beyond the allowance fails"""
+    baseline = sample_report(p95=10.0, throughput=100.0)
+    assert check_gate(sample_report(p95=10.5, throughput=96.0), baseline=baseline, max_regression=0.1) == []
+
+    failures = check_gate(sample_report(p95=13.0, throughput=80.0), baseline=baseline, max_regression=0.1)
+    assert any('stages.forward.p95_ms' in f for f in failures)
+    assert any('images_per_sec' in f for f in failures)
+    assert not any(f.startswith('meta.') for f in failures)
+    print(f"Baseline failures: {failures}")
+
+
+if __name__ == "__main__":
+    print("Testing benchmark helpers...\n")
+    test_summarize_percentiles()
+    test_threshold_gate()
+    test_baseline_gate()
+    print("\nAll tests completed!")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test script for the binary (non-base64) upload path of the predict handler
+"""
+import base64
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+
+import predict
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'uploads', 'NORMAL2-IM-0229-0001.jpeg')
+
+
+class FakeBackend:
+    name = 'fake'
+
+    def predict(self, batch):
+        return batch.reshape(batch.shape[0], -1).mean(axis=1, keepdims=True)
+
+
+class MockRequest:
+    def __init__(self, method, body=None, headers=None, encoding=None):
+        self.data = {'method': method, 'body': body, 'headers': headers or {}, 'encoding': encoding}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+
+def read_sample():
+    with open(SAMPLE_IMAGE, 'rb') as f:
+        return f.read()
+
+
+def json_prediction(request):
+    predict.model = FakeBackend()
+    predict.prediction_cache.clear()
+    result = predict.handler(request)
+    assert result['statusCode'] == 200, result
+    return json.loads(result['body'])
+
+
+def test_octet_stream_matches_json_base64():
+    """Raw bytes give the same answer as the legacy base64 JSON body"""
+    image = read_sample()
+    raw = json_prediction(MockRequest('POST', image, {'Content-Type': 'application/octet-stream'}))
+    legacy = json_prediction(MockRequest('POST', json.dumps({'image': base64.b64encode(image).decode()})))
+    assert raw == legacy
+    print(f"Binary upload OK: {raw}")
+
+
+def test_base64_wrapped_binary_body():
+    """Vercel delivers binary bodies base64 encoded with encoding='base64'"""
+    image = read_sample()
+    wrapped = MockRequest('POST', base64.b64encode(image).decode(), {'content-type': 'image/jpeg'}, encoding='base64')
+    assert json_prediction(wrapped)['prediction'] in ('Normal', 'Pneumonia')
+    print("Wrapped binary body OK")
+
+
+def test_multipart_upload():
+    """A classic form upload with an "image" field"""
+    boundary = 'formboundary'
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="x.jpeg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n').encode() + read_sample() + f'\r\n--{boundary}--\r\n'.encode()
+    headers = {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    assert json_prediction(MockRequest('POST', body, headers))['prediction'] in ('Normal', 'Pneumonia')
+    print("Multipart upload OK")
+
+
+def test_undecodable_binary_body():
+    """Garbage bytes are an unsupported type (415) and a broken JPEG a 400, not a server error"""
+    predict.model = FakeBackend()
+    result = predict.handler(MockRequest('POST', b'\x00\x01garbage', {'Content-Type': 'application/octet-stream'}))
+    assert result['statusCode'] == 415
+    result = predict.handler(MockRequest('POST', b'\xff\xd8\xff\xe0\x00\x10JFIF', {'Content-Type': 'image/jpeg'}))
+    assert result['statusCode'] == 400
+    print("Undecodable body rejected")
+
+
+if __name__ == "__main__":
+    print("Testing binary uploads...\n")
+    test_octet_stream_matches_json_base64()
+    test_base64_wrapped_binary_body()
+    test_multipart_upload()
+    test_undecodable_binary_body()
+    print("\nAll tests completed!")
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Test script for the offline bulk scorer
+"""
+import csv
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+
+from bulk_score import ResultWriter, iter_images, score
+from calibration import Calibration
+from preprocessing import preprocess
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'uploads')
+SAMPLES = sorted(os.listdir(SAMPLE_DIR))[:5]
+
+
+def mean_pixel(batch):
+    """Fake model: mean pixel value per image"""
+    return batch.reshape(batch.shape[0], -1).mean(axis=1, keepdims=True)
+
+
+def make_image_dir(root):
+    image_dir = os.path.join(root, 'images')
+    os.makedirs(os.path.join(image_dir, 'nested'))
+    for name in SAMPLES[:3]:
+        shutil.copy(os.path.join(SAMPLE_DIR, name), image_dir)
+    for name in SAMPLES[3:]:
+        shutil.copy(os.path.join(SAMPLE_DIR, name), os.path.join(image_dir, 'nested'))
+    with open(os.path.join(image_dir, 'broken.jpg'), 'wb') as f:
+        f.write(b'not an image')
+    with open(os.path.join(image_dir, 'notes.txt'), 'w') as f:
+        f.write('ignored')
+    return image_dir
+
+
+def read_rows(path):
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            return list(csv.DictReader(f))
+        return [json.loads(line) for line in f]
+
+
+def test_directory_matches_single_image_path():
+    """Process-pool scoring gives the same probabilities as preprocess() + model"""
+    with tempfile.TemporaryDirectory() as root:
+        image_dir = make_image_dir(root)
+        output = os.path.join(root, 'scores.jsonl')
+        stats = score(image_dir, ResultWriter(output), mean_pixel, batch_size=4, workers=2, chunk_size=2,
+                      calibration=Calibration(threshold=0.5))
+        assert stats['scored'] == len(SAMPLES) and stats['failed'] == 1
+
+        rows = {row['name']: row for row in read_rows(output)}
+        assert rows['broken.jpg']['error'] and rows['broken.jpg']['probability'] is None
+        for name in SAMPLES[:3]:
+            expected = float(mean_pixel(preprocess(os.path.join(SAMPLE_DIR, name)))[0, 0])
+            assert abs(rows[name]['probability'] - expected) < 1e-5
+            assert rows[name]['label'] == ("Pneumonia" if expected > 0.5 else "Normal")
+        assert os.path.join('nested', SAMPLES[3]) in rows
+        print(f"Scored {stats['scored']} images at {stats['images_per_sec']} images/sec")
+
+
+def test_archives():
+    """zip and tar.gz sources yield the same images as the directory"""
+    with tempfile.TemporaryDirectory() as root:
+        image_dir = make_image_dir(root)
+        expected = {name for name, _ in iter_images(image_dir)}
+
+        zip_path = os.path.join(root, 'images.zip')
+        with zipfile.ZipFile(zip_path, 'w') as archive:
+            for name in expected:
+                archive.write(os.path.join(image_dir, name), name)
+        tar_path = os.path.join(root, 'images.tar.gz')
+        with tarfile.open(tar_path, 'w:gz') as archive:
+            for name in expected:
+                archive.add(os.path.join(image_dir, name), name)
+
+        for source in (zip_path, tar_path):
+            names = [name for name, payload in iter_images(source)]
+            assert set(names) == expected
+            output = os.path.join(root, os.path.basename(source) + '.csv')
+            stats = score(source, ResultWriter(output), mean_pixel, batch_size=8, workers=0)
+            assert stats['scored'] + stats['failed'] == len(expected)
+            assert len(read_rows(output)) == len(expected)
+        print(f"Archives scored: {sorted(expected)}")
+
+
+def test_resume_from_checkpoint():
+    """A second run skips images already in the output, including after a torn last line"""
+    with tempfile.TemporaryDirectory() as root:
+        image_dir = make_image_dir(root)
+        output = os.path.join(root, 'scores.csv')
+        writer = ResultWriter(output)
+        first = next(iter_images(image_dir))[0]
+        writer.write([{'name': first, 'probability': 0.1, 'label': 'Normal', 'percentage': 10.0, 'error': None}])
+        writer.close()
+        with open(output, 'a') as f:
+            f.write('half-written,0.')
+
+        stats = score(image_dir, ResultWriter(output), mean_pixel, batch_size=4, workers=0)
+        assert stats['skipped'] == 1
+        assert stats['scored'] + stats['failed'] == len(SAMPLES)
+
+        rows = read_rows(output)
+        names = [row['name'] for row in rows]
+        assert len(names) == len(set(names)) == len(SAMPLES) + 1
+        assert 'half-written' not in names
+        print(f"Resumed with {stats}")
+
+
+def test_parquet_output():
+    """Parquet dataset parts (skipped when pyarrow is not installed)"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("pyarrow not installed - skipping")
+        return
+    with tempfile.TemporaryDirectory() as root:
+        image_dir = make_image_dir(root)
+        output = os.path.join(root, 'scores.parquet')
+        score(image_dir, ResultWriter(output, parquet_rows=2), mean_pixel, batch_size=4, workers=0)
+        table = pq.read_table(output)
+        assert table.num_rows == len(SAMPLES) + 1
+        stats = score(image_dir, ResultWriter(output), mean_pixel, workers=0)
+        assert stats['skipped'] == len(SAMPLES) + 1 and stats['scored'] == 0
+        print(f"Parquet rows: {table.num_rows}")
+
+
+if __name__ == "__main__":
+    print("Testing bulk scoring...\n")
+    test_directory_matches_single_image_path()
+    test_archives()
+    test_resume_from_checkpoint()
+    test_parquet_output()
+    print("\nAll tests completed!")
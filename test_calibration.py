@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Test script for probability calibration and the decision threshold
+"""
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+
+import predict
+from bulk_score import ResultWriter, score
+from calibration import (Calibration, calibration_path, fit, fit_isotonic, fit_temperature, label_from_name,
+                         load_calibration, read_scores, score_labelled, threshold_for_sensitivity)
+from prediction_cache import PredictionCache
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'uploads')
+
+
+def mean_pixel(batch):
+    """Stand-in model: the mean pixel value as the 'probability'"""
+    return batch.reshape(batch.shape[0], -1).mean(axis=1, keepdims=True)
+
+
+def overconfident_scores(n=20000, temperature=3.0, seed=0):
+    """Labels drawn from sigmoid(z) but reported as sigmoid(z * temperature)"""
+    rng = np.random.default_rng(seed)
+    z = rng.normal(0.0, 2.0, n)
+    labels = (rng.random(n) < 1 / (1 + np.exp(-z))).astype(np.int8)
+    return 1 / (1 + np.exp(-z * temperature)), labels
+
+
+def test_labels_from_names():
+    assert label_from_name('person3_virus_15.jpeg') == 1
+    assert label_from_name('person103_bacteria_489.jpeg') == 1
+    assert label_from_name('NORMAL2-IM-0229-0001.jpeg') == 0
+    assert label_from_name('IM-0021-0001.jpeg') == 0
+    assert label_from_name('test/PNEUMONIA/scan.png') == 1
+    assert label_from_name('test/NORMAL/person1_virus_2.jpeg') == 0  # the folder wins
+    assert label_from_name('upload.png') is None
+    counts = np.bincount([label_from_name(name) for name in os.listdir(SAMPLE_DIR)])
+    print(f"Sample labels: {counts[0]} normal, {counts[1]} pneumonia")
+
+
+def test_temperature_and_isotonic_fits():
+    """Temperature recovers the overconfidence factor; both fits lower the log loss and ECE"""
+    probabilities, labels = overconfident_scores()
+    temperature = fit_temperature(probabilities, labels)
+    assert abs(temperature - 3.0) < 0.15, temperature
+
+    for method in ('temperature', 'isotonic'):
+        calibration = fit(probabilities, labels, method, target_sensitivity=None)
+        before, after = calibration.metadata['uncalibrated'], calibration.metadata['calibrated']
+        assert after['log_loss'] < before['log_loss'] and after['ece'] < before['ece'] / 2, (method, before, after)
+        print(f"{method}: log loss {before['log_loss']} -> {after['log_loss']}, ECE {before['ece']} -> {after['ece']}")
+
+    xs, ys = fit_isotonic(probabilities, labels)
+    assert len(xs) <= 256 and xs == sorted(xs) and ys == sorted(ys)
+
+
+def test_threshold_meets_target_sensitivity():
+    probabilities, labels = overconfident_scores(seed=1)
+    for target in (0.8, 0.95, 0.99):
+        threshold = threshold_for_sensitivity(probabilities, labels, target)
+        sensitivity = (probabilities[labels == 1] > threshold).mean()
+        assert target <= sensitivity < target + 0.01, (target, sensitivity)
+    calibration = fit(probabilities, labels, 'temperature', target_sensitivity=0.95)
+    assert calibration.metadata['calibrated']['sensitivity'] >= 0.95
+    print(f"Threshold for 95% sensitivity: {calibration.threshold:.4f} "
+          f"(specificity {calibration.metadata['calibrated']['specificity']})")
+
+
+def test_artifact_and_batch_interpretation():
+    """The artifact loads next to the model; batches and single values give the same answers"""
+    probabilities, labels = overconfident_scores(n=2000)
+    with tempfile.TemporaryDirectory() as root:
+        model_path = os.path.join(root, 'model.keras')
+        assert calibration_path(model_path) == os.path.join(root, 'model.calibration.json')
+
+        default = load_calibration(model_path)
+        assert default.method == 'none' and default.interpret(0.96) == ('Pneumonia', 96.0)
+        assert default.interpret(0.95) == ('Normal', 95.0)
+
+        for method in ('temperature', 'isotonic'):
+            fit(probabilities, labels, method).save(calibration_path(model_path))
+            calibration = load_calibration(model_path)
+            assert calibration.method == method
+
+            raw = np.linspace(0, 1, 101, dtype=np.float32).reshape(-1, 1)
+            batch = calibration.interpret_batch(raw)
+            assert batch == [calibration.interpret(float(p)) for p in raw[:, 0]]
+            assert [label for label, _ in batch] == ['Pneumonia' if p else 'Normal' for p in calibration.labels(raw[:, 0])]
+
+        with open(calibration_path(model_path)) as f:
+            assert json.load(f)['format'] == 'pneumonia-calibration-v1'
+        os.environ['DECISION_THRESHOLD'] = '0.5'
+        try:
+            assert load_calibration(model_path).threshold == 0.5
+        finally:
+            del os.environ['DECISION_THRESHOLD']
+
+    try:
+        Calibration('platt')
+        raise AssertionError("Expected ValueError")
+    except ValueError:
+        pass
+
+
+def test_streaming_scores_match_bulk_results():
+    """Scoring the labelled samples directly and refitting from bulk_score output agree"""
+    probabilities, labels = score_labelled(SAMPLE_DIR, mean_pixel, batch_size=8, workers=0, chunk_size=4)
+    assert probabilities.shape == labels.shape == (30,)
+    assert labels.sum() == 15
+
+    with tempfile.TemporaryDirectory() as root:
+        output = os.path.join(root, 'scores.csv')
+        score(SAMPLE_DIR, ResultWriter(output), mean_pixel, batch_size=8, workers=0, progress_seconds=0)
+        from_file, file_labels = read_scores(output)
+    assert np.array_equal(np.sort(labels), np.sort(file_labels))
+    assert np.allclose(np.sort(probabilities), np.sort(from_file), atol=1e-6)
+
+    calibration = fit(probabilities, labels, 'temperature', target_sensitivity=0.9)
+    print(f"Mean-pixel stand-in: T={calibration.temperature:.3f}, threshold {calibration.threshold:.4f}, "
+          f"{calibration.metadata['calibrated']}")
+
+
+class CountingBackend:
+    name = 'fake'
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, batch):
+        self.calls += 1
+        return mean_pixel(batch)
+
+
+def test_cached_predictions_follow_the_threshold():
+    """The cache holds raw probabilities, so moving the threshold flips cached labels without rescoring"""
+    saved = predict.model, predict.calibration, predict.prediction_cache
+    predict.model = CountingBackend()
+    predict.prediction_cache = PredictionCache(max_entries=16)
+    with open(os.path.join(SAMPLE_DIR, sorted(os.listdir(SAMPLE_DIR))[0]), 'rb') as f:
+        image_bytes = f.read()
+    try:
+        predict.calibration = Calibration(threshold=0.99)
+        label, percentage = predict.getResult(image_bytes)
+        assert label == 'Normal'
+        probability = 1 - percentage / 100
+
+        predict.calibration = Calibration(threshold=probability / 2)
+        assert predict.getResult(image_bytes)[0] == 'Pneumonia'
+        assert predict.getResultTTA(image_bytes, 4)[0] == 'Pneumonia'
+        predict.calibration = Calibration(threshold=0.99)
+        assert predict.getResultTTA(image_bytes, 4)[0] == 'Normal'
+        assert predict.model.calls == 2  # one plain and one TTA forward pass; the rest were cache hits
+        assert predict.prediction_cache.stats()['hits'] == 2
+    finally:
+        predict.model, predict.calibration, predict.prediction_cache = saved
+    print(f"Cached probability {probability:.4f} relabelled at each threshold")
+
+
+if __name__ == "__main__":
+    print("Testing calibration...\n")
+    test_labels_from_names()
+    test_temperature_and_isotonic_fits()
+    test_threshold_meets_target_sensitivity()
+    test_artifact_and_batch_interpretation()
+    test_streaming_scores_match_bulk_results()
+    test_cached_predictions_follow_the_threshold()
+    print("\nAll tests completed!")
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Test script for Grad-CAM explanations (fake gradient pass, no TensorFlow required)
+"""
+import base64
+import json
+import os
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+
+import explain
+import predict
+from gradcam import Explainer, encode, normalize_cams, overlay
+from prediction_cache import PredictionCache
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'uploads')
+
+
+def load_samples(count):
+    names = sorted(os.listdir(SAMPLE_DIR))[:count]
+    samples = []
+    for name in names:
+        with open(os.path.join(SAMPLE_DIR, name), 'rb') as f:
+            samples.append(f.read())
+    return samples
+
+
+class FakeGradCAM:
+    """Centre-weighted 8x8 map and the mean pixel as the score, recording batch sizes"""
+    calls = []
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, batch):
+        FakeGradCAM.calls.append(batch.shape[0])
+        cams = np.zeros((batch.shape[0], 8, 8), dtype=np.float32)
+        cams[:, 3:5, 3:5] = 1.0
+        return cams, batch.reshape(batch.shape[0], -1).mean(axis=1)
+
+
+class FakeKerasBackend:
+    name = 'keras'
+    model = object()
+
+    def predict(self, batch):
+        return batch.reshape(batch.shape[0], -1).mean(axis=1, keepdims=True)
+
+
+class FakeTFLiteBackend:
+    name = 'tflite'
+
+    def predict(self, batch):
+        return np.zeros((batch.shape[0], 1), dtype=np.float32)
+
+
+class MockRequest:
+    def __init__(self, method, body=None, headers=None):
+        self.data = {'method': method, 'body': body, 'headers': headers or {}}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+
+def make_explainer(backend=None):
+    FakeGradCAM.calls = []
+    backend = backend or FakeKerasBackend()
+    return Explainer(lambda: backend, cache=PredictionCache(max_entries=16), gradcam_factory=FakeGradCAM)
+
+
+def test_normalize_cams():
+    cams = np.array([[[0.0, 2.0], [-1.0, 1.0]], [[0.0, 0.0], [0.0, 0.0]]])
+    normalized = normalize_cams(cams)
+    assert np.allclose(normalized[0], [[0.0, 1.0], [0.0, 0.5]])
+    assert not normalized[1].any()
+    print("Per-map normalization OK")
+
+
+def test_overlay_and_encode():
+    """Overlays are BGR uint8 at the input size and encode to decodable WebP and PNG"""
+    images = np.random.default_rng(0).random((3, 64, 64, 1), dtype=np.float32)
+    cams = normalize_cams(np.random.default_rng(1).random((3, 8, 8)))
+    blended = overlay(images, cams, size=64)
+    assert blended.shape == (3, 64, 64, 3) and blended.dtype == np.uint8
+
+    for fmt, magic in (('webp', b'RIFF'), ('png', b'\x89PNG')):
+        data = encode(blended[0], fmt)
+        assert data.startswith(magic)
+        decoded = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        assert decoded.shape == (64, 64, 3)
+        print(f"{fmt}: {len(data)} bytes")
+
+    try:
+        encode(blended[0], 'gif')
+        raise AssertionError("Expected ValueError")
+    except ValueError:
+        pass
+
+
+def test_batched_and_cached():
+    """Uncached images share one gradient pass; repeats come from the cache"""
+    explainer = make_explainer()
+    samples = load_samples(3)
+
+    results, timings = explainer.explain(samples)
+    assert FakeGradCAM.calls == [3]
+    assert [r['cached'] for r in results] == [False, False, False]
+    assert set(timings) == {'preprocess', 'gradcam', 'overlay'}
+
+    again, timings = explainer.explain(samples[:2] + load_samples(4)[3:])
+    assert FakeGradCAM.calls == [3, 1]
+    assert [r['cached'] for r in again] == [True, True, False]
+    assert again[0]['image'] == results[0]['image']
+    assert again[0]['probability'] == results[0]['probability']
+
+    # Each output format is cached separately
+    png, _ = explainer.explain(samples[:1], 'png')
+    assert png[0]['content_type'] == 'image/png' and not png[0]['cached']
+    print(f"Gradient passes: {FakeGradCAM.calls}")
+
+
+def test_requires_keras_backend():
+    explainer = make_explainer(FakeTFLiteBackend())
+    try:
+        explainer.explain(load_samples(1))
+        raise AssertionError("Expected ValueError")
+    except ValueError as e:
+        print(f"Rejected: {e}")
+
+
+def test_explain_cache_follows_the_model():
+    """api/explain.py keys its cache to the model predict.py loaded: a new model misses it"""
+    saved = explain.explainer.get_backend, explain.explainer.gradcam_factory, predict._model_path
+    explain.explainer.get_backend = lambda deadline=None: FakeKerasBackend()
+    explain.explainer.gradcam_factory = FakeGradCAM
+    samples = load_samples(1)
+    with tempfile.TemporaryDirectory() as root:
+        paths = []
+        for version in ('v1', 'v2'):
+            paths.append(os.path.join(root, f'model-{version}.keras'))
+            with open(paths[-1], 'w') as f:
+                f.write(version)
+        try:
+            predict.watch_model(paths[0])
+            explain.explainer.explain(samples)
+            assert explain.explainer.explain(samples)[0][0]['cached']
+            predict.watch_model(paths[1])  # a redeployed file or a registry swap
+            assert not explain.explainer.explain(samples)[0][0]['cached']
+        finally:
+            explain.explainer.get_backend, explain.explainer.gradcam_factory, predict._model_path = saved
+    print("Explain cache re-keyed with the model")
+
+
+def test_handler():
+    """api/explain.py returns one data URL per image and rejects bad requests"""
+    explain.explainer = make_explainer()
+    samples = load_samples(2)
+
+    body = json.dumps({'images': [base64.b64encode(data).decode() for data in samples], 'format': 'png'})
+    result = explain.handler(MockRequest('POST', body))
+    assert result['statusCode'] == 200, result
+    payload = json.loads(result['body'])
+    assert len(payload['results']) == 2
+    assert payload['results'][0]['heatmap'].startswith('data:image/png;base64,')
+    assert payload['results'][0]['prediction'] in ('Normal', 'Pneumonia')
+
+    binary = explain.handler(MockRequest('POST', samples[0], {'Content-Type': 'application/octet-stream'}))
+    assert binary['statusCode'] == 200
+    assert json.loads(binary['body'])['results'][0]['heatmap'].startswith('data:image/webp;base64,')
+
+    assert explain.handler(MockRequest('GET'))['statusCode'] == 405
+    assert explain.handler(MockRequest('POST', json.dumps({'images': []})))['statusCode'] == 400
+    assert explain.handler(MockRequest('POST', json.dumps({'image': 'abc', 'format': 'gif'})))['statusCode'] == 400
+    too_many = json.dumps({'images': ['abc'] * (explain.MAX_EXPLAIN_IMAGES + 1)})
+    assert explain.handler(MockRequest('POST', too_many))['statusCode'] == 413
+    print(f"Handler timings: {payload['timings_ms']}")
+
+
+if __name__ == "__main__":
+    print("Testing Grad-CAM explanations...\n")
+    test_normalize_cams()
+    test_overlay_and_encode()
+    test_batched_and_cached()
+    test_requires_keras_backend()
+    test_explain_cache_follows_the_model()
+    test_handler()
+    print("\nAll tests completed!")
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Test script for header-only image validation (includes seeded fuzzing with malformed files)
+"""
+import os
+import struct
+import time
+import zlib
+
+import cv2
+import numpy as np
+
+import image_validation
+from image_validation import ImageTooLarge, InvalidImage, UnsupportedImageType, check, sniff
+from preprocessing import decode_checked
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'uploads')
+
+
+def sample_bytes(count=3):
+    samples = []
+    for name in sorted(os.listdir(SAMPLE_DIR))[:count]:
+        with open(os.path.join(SAMPLE_DIR, name), 'rb') as f:
+            samples.append(f.read())
+    return samples
+
+
+def encoded(extension, image, params=()):
+    ok, buffer = cv2.imencode(extension, image, list(params))
+    assert ok
+    return buffer.tobytes()
+
+
+def png_header(width, height, bit_depth=8, colour_type=0):
+    """A PNG signature and IHDR chunk claiming the given size, with no pixel data"""
+    ihdr = struct.pack('>IIBBBBB', width, height, bit_depth, colour_type, 0, 0, 0)
+    chunk = b'IHDR' + ihdr
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', len(ihdr)) + chunk + struct.pack('>I', zlib.crc32(chunk))
+
+
+def tiff_mm(image):
+    """Uncompressed big-endian ('MM') TIFF, as OpenCV only writes little-endian ones"""
+    height, width = image.shape[:2]
+    samples = 1 if image.ndim == 2 else image.shape[2]
+    pixels = image.tobytes()
+    entries = 9
+    bits_offset = 8 + 2 + 12 * entries + 4
+    pixel_offset = bits_offset + 2 * samples
+
+    def entry(tag, kind, count, value):
+        field = struct.pack('>H', value) + b'\x00\x00' if kind == 3 and count == 1 else struct.pack('>I', value)
+        return struct.pack('>HHI', tag, kind, count) + field
+
+    directory = b''.join([
+        entry(256, 3, 1, width), entry(257, 3, 1, height),
+        entry(258, 3, samples, 8 if samples == 1 else bits_offset),
+        entry(259, 3, 1, 1), entry(262, 3, 1, 1 if samples == 1 else 2),
+        entry(273, 4, 1, pixel_offset), entry(277, 3, 1, samples),
+        entry(278, 3, 1, height), entry(279, 4, 1, len(pixels)),
+    ])
+    bits = struct.pack('>' + 'H' * samples, *[8] * samples) if samples > 2 else b''
+    return (b'MM\x00*' + struct.pack('>I', 8) + struct.pack('>H', entries) + directory + b'\x00' * 4
+            + bits + pixels)
+
+
+def test_sniff_matches_decoder():
+    """Header dimensions agree with what OpenCV decodes, for every supported format"""
+    gray = np.random.default_rng(0).integers(0, 255, (120, 200), dtype=np.uint8)
+    colour = np.dstack([gray, gray, gray])
+    cases = [(data, None) for data in sample_bytes()] + [
+        (encoded('.png', gray), ('png', 8, 1)),
+        (encoded('.png', gray.astype(np.uint16) * 256), ('png', 16, 1)),
+        (encoded('.bmp', colour), ('bmp', 24, 3)),
+        (encoded('.webp', colour, [cv2.IMWRITE_WEBP_QUALITY, 80]), ('webp', 8, 3)),
+        (encoded('.webp', colour, [cv2.IMWRITE_WEBP_QUALITY, 101]), ('webp', 8, 4)),
+        (encoded('.tiff', gray), ('tiff', 8, 1)),
+        (tiff_mm(colour), ('tiff', 8, 3)),
+    ]
+    for data, expected in cases:
+        info = sniff(data)
+        shape = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE).shape
+        assert (info.height, info.width) == shape, (info, shape)
+        if expected:
+            assert (info.format, info.bit_depth, info.channels) == expected, info
+    print(f"Sniffed {len(cases)} images")
+
+
+def test_unsupported_types():
+    """Other file types are a 415 naming the type where it is recognisable"""
+    cases = {
+        b'GIF89a\x10\x00\x10\x00': 'gif',
+        b'%PDF-1.7\n': 'pdf',
+        b'\x00' * 128 + b'DICM' + b'\x00' * 16: 'dicom',
+        b'plain text, not an image': None,
+    }
+    for data, name in cases.items():
+        try:
+            sniff(data)
+            raise AssertionError(f"Expected UnsupportedImageType for {data[:8]!r}")
+        except UnsupportedImageType as e:
+            assert e.status == 415
+            assert name is None or name in str(e)
+    print("Unsupported types rejected with 415")
+
+
+def test_decompression_bomb_rejected_before_decode():
+    """A 40000x40000 PNG header in a few dozen bytes is refused from the header alone"""
+    bomb = png_header(40000, 40000)
+    start = time.perf_counter()
+    try:
+        decode_checked(bomb)
+        raise AssertionError("Expected ImageTooLarge")
+    except ImageTooLarge as e:
+        assert e.status == 413
+    assert time.perf_counter() - start < 0.01
+
+    # Within the pixel limit but over the decode budget (16-bit samples count double)
+    try:
+        check(png_header(6000, 4000, bit_depth=16), max_decode_bytes=32 << 20)
+        raise AssertionError("Expected ImageTooLarge")
+    except ImageTooLarge as e:
+        print(f"Rejected: {e}")
+
+    try:
+        check(b'\xff\xd8' + b'\x00' * 64, max_bytes=32)
+        raise AssertionError("Expected ImageTooLarge")
+    except ImageTooLarge:
+        pass
+
+
+def test_large_jpeg_routed_to_reduced_decode():
+    """A JPEG over the decode budget is decoded at the reduced scale that fits it"""
+    image = cv2.resize(cv2.imdecode(np.frombuffer(sample_bytes(1)[0], np.uint8), cv2.IMREAD_GRAYSCALE), (3000, 2400))
+    data = encoded('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    budget = 1 << 20
+
+    info, factor = check(data, max_decode_bytes=budget)
+    assert (info.height, info.width) == (2400, 3000) and factor == 4
+
+    original = image_validation.MAX_DECODE_BYTES
+    image_validation.MAX_DECODE_BYTES = budget
+    try:
+        decoded = decode_checked(data)
+    finally:
+        image_validation.MAX_DECODE_BYTES = original
+    assert decoded.shape == (600, 750) and decoded.nbytes <= budget
+
+    try:
+        check(data, max_decode_bytes=100000)
+        raise AssertionError("Expected ImageTooLarge")
+    except ImageTooLarge:
+        pass
+    print(f"3000x2400 JPEG decoded at 1/{factor}: {decoded.nbytes} bytes")
+
+
+def _mutations(data, rng, count):
+    """Truncations at random lengths plus random byte flips in the first 64 bytes"""
+    for length in rng.integers(0, min(len(data), 2048), count):
+        yield data[:length]
+    for _ in range(count):
+        mutated = bytearray(data)
+        for position in rng.integers(0, min(len(data), 64), 3):
+            mutated[position] = rng.integers(0, 256)
+        yield bytes(mutated)
+
+
+def test_fuzz_malformed_inputs():
+    """Malformed files either decode within the memory ceiling or raise InvalidImage, nothing else"""
+    rng = np.random.default_rng(2024)
+    gray = rng.integers(0, 255, (64, 96), dtype=np.uint8)
+    seeds = sample_bytes(2) + [encoded('.png', gray), encoded('.bmp', gray), encoded('.webp', gray),
+                               encoded('.tiff', gray), tiff_mm(np.dstack([gray] * 3)), png_header(300, 200)]
+    outcomes = {'decoded': 0, 'rejected': 0}
+    for seed in seeds:
+        for data in _mutations(seed, rng, 40):
+            try:
+                image = decode_checked(data)
+            except InvalidImage as e:
+                assert e.status in (400, 413, 415)
+                outcomes['rejected'] += 1
+                continue
+            assert image.ndim == 2 and image.dtype == np.uint8
+            assert image.nbytes <= image_validation.MAX_DECODE_BYTES
+            outcomes['decoded'] += 1
+
+    for _ in range(200):
+        data = rng.integers(0, 256, rng.integers(0, 256), dtype=np.uint8).tobytes()
+        try:
+            decode_checked(data)
+        except InvalidImage:
+            outcomes['rejected'] += 1
+    print(f"Fuzz outcomes: {outcomes}")
+
+
+if __name__ == "__main__":
+    print("Testing image validation...\n")
+    test_sniff_matches_decoder()
+    test_unsupported_types()
+    test_decompression_bomb_rejected_before_decode()
+    test_large_jpeg_routed_to_reduced_decode()
+    test_fuzz_malformed_inputs()
+    print("\nAll tests completed!")
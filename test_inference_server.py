@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Test script for the shared-memory inference server (fake model, no TensorFlow required)
+"""
+import multiprocessing
+import os
+import stat
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from inference_server import InferenceClient, InferenceServer, _shutdown, key_path
+from preprocessing import preprocess, preprocess_batch
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'uploads')
+
+
+def mean_pixel(batch):
+    """Fake model: mean pixel value per image, slow enough for requests to queue up"""
+    time.sleep(0.005)
+    return batch.reshape(batch.shape[0], -1).mean(axis=1, keepdims=True)
+
+
+def failing_model(batch):
+    raise ValueError("model exploded")
+
+
+def start_server(root, predict_fn=mean_pixel):
+    address = os.path.join(root, 'inference.sock')
+    server = InferenceServer(predict_fn, address, authkey=b'test', max_batch_size=16, max_wait_ms=5).start()
+    return server, address
+
+
+def random_batch(n, seed):
+    return np.random.default_rng(seed).random((n, 256, 256, 1), dtype=np.float32)
+
+
+def test_predict_roundtrip():
+    """Rows sent through shared memory come back as the model's outputs, in order"""
+    with tempfile.TemporaryDirectory() as root:
+        server, address = start_server(root)
+        try:
+            client = InferenceClient(address, authkey=b'test', slots=4)
+            batch = random_batch(10, seed=0)
+            output = client.predict(batch)
+            assert output.shape == (10, 1)
+            assert np.allclose(output[:, 0], batch.reshape(10, -1).mean(axis=1), atol=1e-6)
+            assert client.status()['state'] == 'ready'
+            client.close()
+            print(f"Roundtrip OK, server stats: {server.stats()['batch_size_histogram']}")
+        finally:
+            server.close()
+
+
+def test_preprocess_into_slot():
+    """An upload preprocessed into a slot scores the same as the in-process path"""
+    path = os.path.join(SAMPLE_DIR, sorted(os.listdir(SAMPLE_DIR))[0])
+    with open(path, 'rb') as f:
+        image_bytes = f.read()
+    with tempfile.TemporaryDirectory() as root:
+        server, address = start_server(root)
+        try:
+            client = InferenceClient(address, authkey=b'test')
+            with client.slot() as slot:
+                preprocess_batch([image_bytes], out=slot.array)
+                prediction = slot.predict()
+            expected = preprocess(image_bytes).mean()
+            assert abs(float(prediction[0]) - expected) < 1e-6
+            print(f"Slot prediction: {float(prediction[0]):.6f}")
+        finally:
+            server.close()
+
+
+def _worker_process(address, seed, results):
+    client = InferenceClient(address, authkey=b'test', slots=8)
+    batch = random_batch(8, seed)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        outputs = list(pool.map(lambda row: client.predict(row[np.newaxis])[0, 0], batch))
+    expected = batch.reshape(8, -1).mean(axis=1)
+    results.put((seed, bool(np.allclose(outputs, expected, atol=1e-6))))
+
+
+def test_batches_across_worker_processes():
+    """Concurrent requests from separate processes are answered correctly and share batches"""
+    context = multiprocessing.get_context('fork')
+    with tempfile.TemporaryDirectory() as root:
+        server, address = start_server(root)
+        try:
+            results = context.Queue()
+            workers = [context.Process(target=_worker_process, args=(address, seed, results)) for seed in range(3)]
+            for worker in workers:
+                worker.start()
+            outcomes = dict(results.get(timeout=30) for _ in workers)
+            for worker in workers:
+                worker.join(10)
+            assert outcomes == {0: True, 1: True, 2: True}
+
+            stats = server.stats()
+            assert stats['items'] == 24
+            assert stats['mean_batch_size'] > 1
+            print(f"Cross-process batching: mean batch {stats['mean_batch_size']}, {stats['batch_size_histogram']}")
+        finally:
+            server.close()
+
+
+def test_multi_row_requests_share_a_small_ring():
+    """Threads each sending several rows (TTA) through a ring smaller than their sum never deadlock"""
+    with tempfile.TemporaryDirectory() as root:
+        server, address = start_server(root)
+        try:
+            client = InferenceClient(address, authkey=b'test', slots=4, timeout=2)
+            batches = [random_batch(3, seed) for seed in range(8)]
+
+            def request(batch):
+                return np.allclose(client.predict(batch)[:, 0], batch.reshape(3, -1).mean(axis=1), atol=1e-6)
+
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                for _ in range(3):
+                    assert all(pool.map(request, batches))
+            assert client._ring.free.qsize() == 4
+            try:
+                client.take(5)
+                raise AssertionError("Expected ValueError")
+            except ValueError:
+                pass
+            client.close()
+            print("Multi-row requests took whole chunks of the ring")
+        finally:
+            server.close()
+
+
+def test_model_errors_reach_the_client():
+    """A failing forward pass raises on the client instead of hanging"""
+    with tempfile.TemporaryDirectory() as root:
+        server, address = start_server(root, failing_model)
+        try:
+            client = InferenceClient(address, authkey=b'test', timeout=5)
+            try:
+                client.predict(random_batch(1, seed=1))
+                raise AssertionError("Expected RuntimeError")
+            except RuntimeError as e:
+                assert 'model exploded' in str(e)
+            print("Model error propagated")
+        finally:
+            server.close()
+
+
+def test_slots_held_across_a_reconnect():
+    """A slot taken before the connection dropped can't score (or free) a slot of the new ring"""
+    with tempfile.TemporaryDirectory() as root:
+        server, address = start_server(root)
+        try:
+            client = InferenceClient(address, authkey=b'test', slots=2, timeout=5)
+            stale = client.slot()
+            stale.array[0] = 1.0
+            old_ring = client._ring
+            _shutdown(client._conn)  # the connection dies while the slot is held
+            deadline = time.time() + 5
+            while client._conn is not None and time.time() < deadline:
+                time.sleep(0.01)
+
+            batch = random_batch(2, seed=2)
+            fresh = [client.slot(), client.slot()]  # reconnects: both slots of the new ring
+            assert sorted(slot.index for slot in fresh) == [0, 1]
+            for slot, row in zip(fresh, batch):
+                slot.array[0] = row
+            try:
+                stale.submit()
+                raise AssertionError("Expected ConnectionError")
+            except ConnectionError:
+                pass
+            stale.array[0] = 0.5  # still mapped while held
+            stale.release()  # dropped: its index belongs to the new ring's slot holders
+            assert client._ring.free.qsize() == 0
+            outputs = [float(slot.predict()[0]) for slot in fresh]
+            assert np.allclose(outputs, batch.reshape(2, -1).mean(axis=1), atol=1e-6)
+            for slot in fresh:
+                slot.release()
+            assert client._ring.free.qsize() == 2
+            assert old_ring.shm.buf is None  # unmapped once its last slot was released
+            client.close()
+            print("Stale slot refused after reconnect")
+        finally:
+            server.close()
+
+
+def test_authkey_required():
+    """TCP needs an explicit key; a Unix socket gets a random key file only its owner can read"""
+    saved = os.environ.pop('INFERENCE_SERVER_AUTHKEY', None)
+    try:
+        for cls in (InferenceServer, InferenceClient):
+            try:
+                cls(*(([mean_pixel] if cls is InferenceServer else []) + ['127.0.0.1:6000']))
+                raise AssertionError("Expected ValueError")
+            except ValueError as e:
+                assert 'INFERENCE_SERVER_AUTHKEY' in str(e)
+
+        with tempfile.TemporaryDirectory() as root:
+            address = os.path.join(root, 'inference.sock')
+            client = InferenceClient(address, timeout=5)
+            assert client.status()['state'] == 'unavailable'  # no server, no key file yet
+
+            server = InferenceServer(mean_pixel, address).start()
+            try:
+                mode = stat.S_IMODE(os.stat(key_path(address)).st_mode)
+                assert mode == 0o600, oct(mode)
+                assert client.status()['state'] == 'ready'
+                client.close()
+                assert InferenceClient(address, authkey=b'pneumonia-inference', timeout=1).status()['state'] == 'unavailable'
+            finally:
+                server.close()
+            assert not os.path.exists(key_path(address))
+    finally:
+        if saved is not None:
+            os.environ['INFERENCE_SERVER_AUTHKEY'] = saved
+    print("Authkey enforced")
+
+
+if __name__ == "__main__":
+    print("Testing inference server...\n")
+    test_predict_roundtrip()
+    test_preprocess_into_slot()
+    test_batches_across_worker_processes()
+    test_multi_row_requests_share_a_small_ring()
+    test_model_errors_reach_the_client()
+    test_slots_held_across_a_reconnect()
+    test_authkey_required()
+    print("\nAll tests completed!")
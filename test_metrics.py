@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Test script for the metrics registry and Prometheus rendering
+"""
+import contextlib
+import io
+import json
+import time
+
+from metrics import MetricsRegistry, NullRegistry
+
+
+def test_stages_and_requests():
+    """Stage timers feed histograms; requests and errors are counted per endpoint"""
+    registry = MetricsRegistry()
+    with registry.request('predict'):
+        with registry.stage('decode'):
+            time.sleep(0.002)
+        with registry.stage('inference'):
+            pass
+
+    with registry.request('predict') as req:
+        req.fail(ValueError("bad image"))
+
+    try:
+        with registry.request('predict'):
+            raise KeyError('image')
+    except KeyError:
+        pass
+
+    snapshot = registry.snapshot()
+    assert snapshot['counters']['requests_total{endpoint="predict"}'] == 3
+    assert snapshot['counters']['errors_total{endpoint="predict",type="ValueError"}'] == 1
+    assert snapshot['counters']['errors_total{endpoint="predict",type="KeyError"}'] == 1
+    assert snapshot['histograms']['stage_seconds{stage="decode"}']['sum'] >= 0.002
+    print(f"Snapshot: {snapshot['counters']}")
+
+
+def test_prometheus_format():
+    """Histogram buckets are cumulative and end with +Inf; gauges come from callbacks"""
+    registry = MetricsRegistry()
+    for value in (0.0005, 0.003, 0.2, 50.0):
+        registry.observe('stage_seconds', value, {'stage': 'inference'})
+    registry.register_gauges(lambda: [('batch_queue_depth', None, 7)])
+
+    text = registry.render_prometheus()
+    assert '# TYPE pneumonia_stage_seconds histogram' in text
+    assert 'pneumonia_stage_seconds_bucket{stage="inference",le="0.001"} 1' in text
+    assert 'pneumonia_stage_seconds_bucket{stage="inference",le="0.25"} 3' in text
+    assert 'pneumonia_stage_seconds_bucket{stage="inference",le="+Inf"} 4' in text
+    assert 'pneumonia_stage_seconds_count{stage="inference"} 4' in text
+    assert 'pneumonia_batch_queue_depth 7' in text
+    print("Prometheus format OK")
+
+
+def test_json_logs():
+    """One JSON line per request with its stage timings"""
+    registry = MetricsRegistry(json_logs=True)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        with registry.request('api_predict'):
+            with registry.stage('parse'):
+                pass
+
+    record = json.loads(output.getvalue().strip())
+    assert record['endpoint'] == 'api_predict'
+    assert 'parse' in record['stages_ms']
+    assert record['error'] is None
+    print(f"JSON log: {record}")
+
+
+def test_disabled_registry_is_noop():
+    """METRICS_ENABLED=0 swaps in a registry that records nothing"""
+    registry = NullRegistry()
+    with registry.request('predict') as req:
+        with registry.stage('decode'):
+            pass
+        req.fail('ValueError')
+    assert registry.render_prometheus() == ''
+    assert registry.stage('a') is registry.stage('b')
+    print("Null registry OK")
+
+
+if __name__ == "__main__":
+    print("Testing metrics...\n")
+    test_stages_and_requests()
+    test_prometheus_format()
+    test_json_logs()
+    test_disabled_registry_is_noop()
+    print("\nAll tests completed!")
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Test script for the model fetcher against a local HTTP server stand-in
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from model_fetch import fetch_model
+
+PAYLOAD = os.urandom(3 * 1024 * 1024 + 123)
+PAYLOAD_SHA256 = hashlib.sha256(PAYLOAD).hexdigest()
+CUT = 16 * 64 * 1024  # where interrupted downloads stop (a whole number of 64 KB chunks)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves `payload` with optional Range/If-Range support and records the requests it sees"""
+    supports_ranges = True
+    requests_seen = []
+    payload = PAYLOAD
+    etag = '"v1"'
+    cut_after = None  # drop the connection after this many bytes of a full-file response
+    head_etag = None  # what HEAD reports, if not the current etag
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, status, length, extra=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(length))
+        if self.supports_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        etag = (self.head_etag or self.etag) if self.command == 'HEAD' else self.etag
+        if etag:
+            self.send_header('ETag', etag)
+        for key, value in (extra or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+
+    def do_HEAD(self):
+        RangeHandler.requests_seen.append(('HEAD', None))
+        self._headers(200, len(self.payload))
+
+    def do_GET(self):
+        header = self.headers.get('Range')
+        RangeHandler.requests_seen.append(('GET', header, self.headers.get('If-Range')))
+        match = re.match(r'bytes=(\d+)-(\d*)', header or '')
+        if_range = self.headers.get('If-Range')
+        if match and self.supports_ranges and (if_range is None or if_range == self.etag):
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(self.payload) - 1
+            body = self.payload[start:end + 1]
+            self._headers(206, len(body), {'Content-Range': f'bytes {start}-{end}/{len(self.payload)}'})
+        else:
+            body = self.payload
+            self._headers(200, len(body))
+            if self.cut_after is not None:
+                self.wfile.write(body[:self.cut_after])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+        self.wfile.write(body)
+
+
+def serve(supports_ranges=True, payload=PAYLOAD, etag='"v1"', cut_after=None):
+    RangeHandler.supports_ranges = supports_ranges
+    RangeHandler.requests_seen = []
+    RangeHandler.payload = payload
+    RangeHandler.etag = etag
+    RangeHandler.cut_after = cut_after
+    RangeHandler.head_etag = None
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/model.keras'
+
+
+def test_parallel_download_and_warm_cache():
+    """Large files are fetched in parallel ranges; a second fetch never touches the network"""
+    server, url = serve()
+    try:
+        with tempfile.TemporaryDirectory() as cache:
+            path, stats = fetch_model(url, sha256=PAYLOAD_SHA256, cache_dir=cache,
+                                      parallel=4, parallel_min_size=1024, chunk_size=64 * 1024)
+            with open(path, 'rb') as f:
+                assert f.read() == PAYLOAD
+            assert stats.ranges == 4
+            assert stats.bytes_downloaded == len(PAYLOAD)
+            assert stats.as_dict()['throughput_mb_s'] > 0
+
+            seen = len(RangeHandler.requests_seen)
+            again, stats = fetch_model(url, sha256=PAYLOAD_SHA256, cache_dir=cache)
+            assert again == path and stats.cache_hit
+            assert len(RangeHandler.requests_seen) == seen
+    finally:
+        server.shutdown()
+    print("Parallel download and warm cache OK")
+
+
+def interrupted_download(url, cache, **kwargs):
+    """Start a sequential fetch that the server cuts off part way"""
+    try:
+        fetch_model(url, cache_dir=cache, parallel=1, chunk_size=64 * 1024, **kwargs)
+        raise AssertionError("Expected the download to fail")
+    except (requests.RequestException, ValueError):
+        pass
+
+
+def test_resume_partial_download():
+    """An interrupted sequential download continues from where it stopped, guarded by If-Range"""
+    server, url = serve(cut_after=CUT)
+    try:
+        with tempfile.TemporaryDirectory() as cache:
+            interrupted_download(url, cache, sha256=PAYLOAD_SHA256)
+            RangeHandler.cut_after = None
+
+            path, stats = fetch_model(url, sha256=PAYLOAD_SHA256, cache_dir=cache, parallel=1)
+            with open(path, 'rb') as f:
+                assert f.read() == PAYLOAD
+            assert stats.bytes_resumed == CUT
+            assert stats.bytes_downloaded == len(PAYLOAD) - CUT
+            assert ('GET', f'bytes={CUT}-', '"v1"') in RangeHandler.requests_seen
+            assert sorted(os.listdir(os.path.dirname(path))) == ['model.keras']
+    finally:
+        server.shutdown()
+    print("Resume OK")
+
+
+def test_changed_remote_file_restarts():
+    """A partial download of a file that was replaced since is discarded, not appended to"""
+    replacement = os.urandom(len(PAYLOAD))
+    server, url = serve(cut_after=CUT)
+    try:
+        with tempfile.TemporaryDirectory() as cache:
+            interrupted_download(url, cache, version='pinned')
+            RangeHandler.cut_after = None
+            RangeHandler.payload, RangeHandler.etag = replacement, '"v2"'
+
+            path, stats = fetch_model(url, version='pinned', cache_dir=cache, parallel=1)
+            with open(path, 'rb') as f:
+                assert f.read() == replacement
+            assert stats.bytes_resumed == 0 and stats.bytes_downloaded == len(replacement)
+
+            # Replaced between the HEAD and the resume: If-Range turns the resume into a full download
+            RangeHandler.payload, RangeHandler.etag, RangeHandler.cut_after = PAYLOAD, '"v1"', CUT
+            interrupted_download(url, cache, version='raced')
+            RangeHandler.cut_after = None
+            RangeHandler.payload, RangeHandler.etag, RangeHandler.head_etag = replacement, '"v2"', '"v1"'
+            path, stats = fetch_model(url, version='raced', cache_dir=cache, parallel=1)
+            with open(path, 'rb') as f:
+                assert f.read() == replacement
+            assert ('GET', f'bytes={CUT}-', '"v1"') in RangeHandler.requests_seen
+            assert stats.bytes_resumed == 0
+    finally:
+        server.shutdown()
+    print("Changed remote file re-downloaded")
+
+
+def test_default_version_follows_etag():
+    """Without a version or checksum, a file replaced at the same URL is fetched again"""
+    server, url = serve()
+    try:
+        with tempfile.TemporaryDirectory() as cache:
+            first, _ = fetch_model(url, cache_dir=cache, parallel=1)
+            again, stats = fetch_model(url, cache_dir=cache, parallel=1)
+            assert again == first and stats.cache_hit
+
+            replacement = os.urandom(1024)
+            RangeHandler.payload, RangeHandler.etag = replacement, '"v2"'
+            second, stats = fetch_model(url, cache_dir=cache, parallel=1)
+            assert second != first and not stats.cache_hit
+            with open(second, 'rb') as f:
+                assert f.read() == replacement
+    finally:
+        server.shutdown()
+    print("Default version keyed by ETag")
+
+
+def test_server_without_ranges():
+    """Servers that ignore Range still work (full sequential download)"""
+    server, url = serve(supports_ranges=False)
+    try:
+        with tempfile.TemporaryDirectory() as cache:
+            path, stats = fetch_model(url, cache_dir=cache, parallel=4, parallel_min_size=1024)
+            with open(path, 'rb') as f:
+                assert f.read() == PAYLOAD
+            assert stats.ranges == 1
+    finally:
+        server.shutdown()
+    print("No-range server OK")
+
+
+def test_checksum_mismatch_rejected():
+    """A corrupted or wrong file is never promoted into the cache"""
+    server, url = serve()
+    try:
+        with tempfile.TemporaryDirectory() as cache:
+            try:
+                fetch_model(url, sha256='0' * 64, cache_dir=cache, parallel=1)
+                raise AssertionError("Expected ValueError")
+            except ValueError as e:
+                assert 'Checksum mismatch' in str(e)
+            leftovers = [n for _, _, files in os.walk(cache) for n in files]
+            assert leftovers == []
+    finally:
+        server.shutdown()
+    print("Checksum mismatch rejected")
+
+
+if __name__ == "__main__":
+    print("Testing model fetcher...\n")
+    test_parallel_download_and_warm_cache()
+    test_resume_partial_download()
+    test_changed_remote_file_restarts()
+    test_default_version_follows_etag()
+    test_server_without_ranges()
+    test_checksum_mismatch_rejected()
+    print("\nAll tests completed!")
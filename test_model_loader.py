@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Test script for the memory-mapped weights layout and the background model loader
+"""
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from model_loader import BackgroundModelLoader, prefetch_model, read_weights, write_weights
+
+
+class FakeBackend:
+    name = 'fake'
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, batch):
+        self.calls += 1
+        return np.zeros((batch.shape[0], 1), dtype=np.float32)
+
+
+def test_weights_roundtrip_is_zero_copy():
+    """Arrays come back identical, aligned, and backed by the mapped file"""
+    rng = np.random.default_rng(0)
+    arrays = [rng.standard_normal((3, 3, 1, 8)).astype(np.float32),
+              rng.standard_normal(8).astype(np.float32),
+              np.arange(7, dtype=np.int64),
+              rng.standard_normal((16, 1)).astype(np.float16)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'weights.bin')
+        entries = write_weights(path, arrays)
+        loaded = read_weights(path, entries)
+
+        for original, mapped, entry in zip(arrays, loaded, entries):
+            assert entry['offset'] % 64 == 0
+            assert mapped.dtype == original.dtype and mapped.shape == original.shape
+            assert np.array_equal(mapped, original)
+            assert not mapped.flags.writeable
+        del loaded
+    print("Weights roundtrip OK")
+
+
+def test_background_loader_does_not_block():
+    """start() returns immediately; get() waits for the load and warm-up"""
+    release = threading.Event()
+    backend = FakeBackend()
+
+    def slow_load(timings):
+        with timings.phase('deserialize'):
+            release.wait(5)
+        return backend
+
+    loader = BackgroundModelLoader(slow_load, warmup_shape=(1, 8, 8, 1))
+    started = time.monotonic()
+    loader.start()
+    assert time.monotonic() - started < 0.5
+    assert loader.status()['state'] == 'loading'
+
+    release.set()
+    assert loader.get(timeout=5) is backend
+    status = loader.status()
+    assert status['state'] == 'ready'
+    assert set(status['timings_ms']) == {'deserialize', 'first_call'}
+    assert backend.calls == 1
+    print(f"Loader status: {status}")
+
+
+def test_load_failure_is_reported():
+    """A failed load surfaces on get() and in status()"""
+    def broken_load(timings):
+        raise FileNotFoundError("model.keras")
+
+    loader = BackgroundModelLoader(broken_load).start()
+    try:
+        loader.get(timeout=5)
+        raise AssertionError("Expected RuntimeError")
+    except RuntimeError as e:
+        assert 'model.keras' in str(e)
+    assert loader.status()['state'] == 'failed'
+    print("Load failure reported")
+
+
+def test_preload_skips_warmup():
+    """load(warmup=False) loads synchronously without running inference"""
+    backend = FakeBackend()
+    loader = BackgroundModelLoader(lambda timings: backend)
+    assert loader.load(warmup=False) is backend
+    assert backend.calls == 0
+    loader.warm_up()
+    assert backend.calls == 1
+    print("Preload without warm-up OK")
+
+
+class WeightsBackend:
+    """Sums an image with the first weight array, loaded from a weights file"""
+    name = 'fake'
+
+    def __init__(self, weights):
+        self.weights = weights
+
+    def predict(self, batch):
+        return batch.reshape(batch.shape[0], -1).sum(axis=1, keepdims=True) + self.weights[0].sum()
+
+
+def _worker_after_fork(loader, results):
+    batch = np.ones((2, 4, 4, 1), dtype=np.float32)
+    results.put(loader.start().get(10).predict(batch)[:, 0].tolist())
+
+
+def test_preload_prefetches_and_workers_load_after_fork():
+    """gunicorn --preload: the master only reads the files, each forked worker builds its own backend"""
+    context = multiprocessing.get_context('fork')
+    arrays = [np.full((3, 3), 0.5, dtype=np.float32), np.arange(5, dtype=np.float32)]
+    with tempfile.TemporaryDirectory() as root:
+        weights = os.path.join(root, 'weights.bin')
+        entries = write_weights(weights, arrays)
+        assert prefetch_model(root) == os.path.getsize(weights)
+        assert prefetch_model(weights) == os.path.getsize(weights)
+
+        loads = []
+        loader = BackgroundModelLoader(lambda timings: loads.append(os.getpid()) or WeightsBackend(read_weights(weights, entries)))
+        results = context.Queue()
+        worker = context.Process(target=_worker_after_fork, args=(loader, results))
+        worker.start()
+        outputs = results.get(timeout=30)
+        worker.join(10)
+        assert worker.exitcode == 0 and outputs == [20.5, 20.5]
+        assert loads == [] and loader.status()['state'] == 'idle'  # nothing was loaded in the master
+    print("Preload prefetched in the master, loaded in the worker")
+
+
+if __name__ == "__main__":
+    print("Testing model loader...\n")
+    test_weights_roundtrip_is_zero_copy()
+    test_background_loader_does_not_block()
+    test_load_failure_is_reported()
+    test_preload_skips_warmup()
+    test_preload_prefetches_and_workers_load_after_fork()
+    print("\nAll tests completed!")
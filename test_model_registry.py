@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Test script for the model registry (hot-swap and shadow scoring with stand-in backends)
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from model_registry import ModelRegistry
+
+
+class ConstantBackend:
+    """Predicts the probability written in its model file, after an optional delay"""
+    name = 'fake'
+
+    def __init__(self, value, delay=0.0):
+        self.value = value
+        self.delay = delay
+        self.calls = 0
+
+    def predict(self, batch):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return np.full((len(batch), 1), self.value, dtype=np.float32)
+
+
+def model_file(root, name, value):
+    path = os.path.join(root, name)
+    with open(path, 'w') as f:
+        f.write(str(value))
+    return path
+
+
+def fake_loader(load_seconds=0.0, delays=None):
+    """load_fn that 'deserializes' a model file into a ConstantBackend"""
+    delays = delays or {}
+
+    def load(path, timings):
+        with timings.phase('deserialize'):
+            time.sleep(load_seconds)
+            with open(path) as f:
+                value = float(f.read())
+        return ConstantBackend(value, delays.get(os.path.basename(path), 0.0))
+    return load
+
+
+BATCH = np.zeros((2, 8, 8, 1), dtype=np.float32)
+
+
+def test_manifest_roundtrip():
+    """Versions, fingerprints and the active/shadow choice survive a save and reload"""
+    with tempfile.TemporaryDirectory() as root:
+        model_file(root, 'a.keras', 0.2)
+        model_file(root, 'b.keras', 0.9)
+        manifest = os.path.join(root, 'models.json')
+
+        registry = ModelRegistry(manifest, load_fn=fake_loader())
+        v1 = registry.register('a.keras', metadata={'note': 'baseline'})
+        v2 = registry.register('b.keras', version='pruned')
+        assert (v1.version, v2.version) == ('v1', 'pruned')
+        assert v1.fingerprint != v2.fingerprint and v1.metadata['size_bytes'] == 3
+        registry.save(active='v1', shadow='pruned', fraction=0.25)
+        try:
+            registry.register('a.keras', version='v1')
+            raise AssertionError("Expected ValueError")
+        except ValueError:
+            pass
+
+        with open(manifest) as f:
+            assert json.load(f)['versions']['v1']['path'] == 'a.keras'  # relative to the manifest
+
+        reloaded = ModelRegistry(manifest, load_fn=fake_loader()).load_active()
+        assert reloaded.current().version == 'v1'
+        assert reloaded.predict(BATCH)[0, 0] == np.float32(0.2)
+        assert reloaded.stats()['shadow'] == 'pruned' and reloaded.stats()['shadow_fraction'] == 0.25
+    print("Manifest roundtrip OK")
+
+
+def test_hot_swap_under_traffic():
+    """Requests keep flowing while the next version loads; every answer comes from exactly one version"""
+    with tempfile.TemporaryDirectory() as root:
+        registry = ModelRegistry(load_fn=fake_loader(load_seconds=0.3))
+        registry.load_active(default_path=model_file(root, 'a.keras', 0.2))
+        registry.register(model_file(root, 'b.keras', 0.9), version='v2')
+        swapped = []
+        registry.on_activate(lambda entry: swapped.append(entry.version))
+
+        stop = threading.Event()
+        outputs, latencies, errors = [], [], []
+
+        def client():
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    outputs.append(float(registry.predict(BATCH)[0, 0]))
+                except Exception as e:
+                    errors.append(e)
+                latencies.append(time.perf_counter() - start)
+                time.sleep(0.001)
+
+        clients = [threading.Thread(target=client) for _ in range(4)]
+        for thread in clients:
+            thread.start()
+        time.sleep(0.05)
+        registry.activate('v2')
+        time.sleep(0.05)
+        stop.set()
+        for thread in clients:
+            thread.join()
+
+        assert not errors
+        assert set(np.round(outputs, 3)) == {0.2, 0.9}
+        assert outputs[-1] == np.float32(0.9)
+        # The 0.3 s load happened beside the traffic, not in front of it
+        assert max(latencies) < 0.1, max(latencies)
+        assert swapped == ['v2'] and registry.swaps == 1
+        assert registry.versions['v1'].backend is None  # released after the swap
+        print(f"{len(outputs)} requests across the swap, max latency {max(latencies) * 1000:.1f} ms")
+
+
+class SwapsMidRequest(ModelRegistry):
+    """Completes a swap right after a request thread has read what is being served"""
+    swap_to = None
+
+    @property
+    def _serving(self):
+        serving = self.__dict__['_serving']
+        if self.swap_to and threading.current_thread().name == 'request':
+            version, self.swap_to = self.swap_to, None
+            swapper = threading.Thread(target=self.activate, args=(version,), kwargs={'warmup': False})
+            swapper.start()
+            swapper.join()
+        return serving
+
+    @_serving.setter
+    def _serving(self, value):
+        self.__dict__['_serving'] = value
+
+
+def test_swap_never_fails_an_in_flight_request():
+    """The old version's backend is released by a swap while a request that picked it is still running"""
+    with tempfile.TemporaryDirectory() as root:
+        registry = SwapsMidRequest(load_fn=fake_loader())
+        registry.load_active(default_path=model_file(root, 'a.keras', 0.2))
+        registry.register(model_file(root, 'b.keras', 0.9), version='v2')
+        results = []
+
+        def request(call, swap_to):
+            registry.swap_to = swap_to
+            try:
+                results.append(call())
+            except Exception as e:
+                results.append(e)
+
+        for call, swap_to in ((lambda: float(registry.predict(BATCH)[0, 0]), 'v2'),
+                              (lambda: registry.current_backend().value, 'v1')):
+            thread = threading.Thread(target=request, args=(call, swap_to), name='request')
+            thread.start()
+            thread.join()
+
+        # Each request finished on the version it started with, though that backend was released under it
+        assert results == [np.float32(0.2), np.float32(0.9)], results
+        assert registry.swaps == 2 and registry.versions['v2'].backend is None
+        print("In-flight requests survived the swap")
+
+
+def test_shadow_scoring_off_the_request_path():
+    """A slow candidate scores a sample of batches in the background and reports agreement"""
+    with tempfile.TemporaryDirectory() as root:
+        registry = ModelRegistry(load_fn=fake_loader(delays={'slow.keras': 0.02}), max_shadow_pending=2, seed=1)
+        registry.load_active(default_path=model_file(root, 'a.keras', 0.97))
+        registry.register(model_file(root, 'slow.keras', 0.5), version='candidate')
+        registry.set_shadow('candidate', 0.5)
+
+        start = time.perf_counter()
+        for _ in range(200):
+            assert registry.predict(BATCH)[0, 0] == np.float32(0.97)
+        elapsed = time.perf_counter() - start
+        assert registry.drain()
+
+        stats = {entry['version']: entry['stats'] for entry in registry.stats()['versions']}
+        shadow = stats['candidate']
+        assert stats['v1']['batches'] == 200
+        assert shadow['batches'] > 0 and shadow['agreement'] == 0.0  # 0.97 vs 0.5 at the 0.95 threshold
+        assert abs(shadow['mean_abs_diff'] - 0.47) < 1e-6
+        # Samples arriving while two shadow batches are pending are dropped, not queued
+        assert registry.shadow_dropped > 0
+        assert shadow['batches'] + registry.shadow_dropped < 200
+        assert elapsed < 0.02 * shadow['batches'], "shadow latency leaked into requests"
+        print(f"Shadowed {shadow['batches']} batches, dropped {registry.shadow_dropped}, "
+              f"200 requests in {elapsed * 1000:.1f} ms")
+
+        registry.set_shadow(None, 0)
+        assert registry.versions['candidate'].backend is None
+        registry.close()
+
+
+def test_sync_follows_manifest_edits():
+    """A server process picks up `activate`/`shadow` edits made by another process"""
+    with tempfile.TemporaryDirectory() as root:
+        manifest = os.path.join(root, 'models.json')
+        model_file(root, 'a.keras', 0.2)
+        model_file(root, 'b.keras', 0.9)
+        cli = ModelRegistry(manifest)
+        cli.register('a.keras')
+        cli.save(active='v1')
+
+        server = ModelRegistry(manifest, load_fn=fake_loader()).load_active()
+        assert not server.sync()
+
+        cli = ModelRegistry(manifest)
+        cli.register('b.keras')
+        cli.save(shadow='v2', fraction=0.1)
+        time.sleep(0.01)
+        assert server.sync()
+        assert server.stats()['shadow'] == 'v2' and server.current().version == 'v1'
+
+        cli = ModelRegistry(manifest)
+        cli.save(active='v2', shadow='', fraction=0.0)
+        assert server.sync()
+        assert server.current().version == 'v2' and server.stats()['shadow'] is None
+        assert server.predict(BATCH)[0, 0] == np.float32(0.9)
+
+        try:
+            server.activate('v3')
+            raise AssertionError("Expected ValueError")
+        except ValueError as e:
+            assert 'v3' in str(e)
+    print("Manifest edits applied")
+
+
+if __name__ == "__main__":
+    print("Testing model registry...\n")
+    test_manifest_roundtrip()
+    test_hot_swap_under_traffic()
+    test_swap_never_fails_an_in_flight_request()
+    test_shadow_scoring_off_the_request_path()
+    test_sync_follows_manifest_edits()
+    print("\nAll tests completed!")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Test script for the ONNX Runtime backend (skips the parts whose runtimes are not installed)
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from backends import onnx_options_from_env
+from preprocessing import preprocess_batch
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_DIR = os.path.join(ROOT, 'public', 'uploads')
+MODEL_PATH = os.path.join(ROOT, 'model.keras')
+
+
+def sample_batch(limit=None):
+    names = sorted(os.listdir(SAMPLE_DIR))[:limit]
+    return preprocess_batch([os.path.join(SAMPLE_DIR, name) for name in names])
+
+
+def test_options_from_env():
+    """Thread counts and memory arena settings come from the environment"""
+    names = ('ONNX_INTRA_OP_THREADS', 'ONNX_INTER_OP_THREADS', 'ONNX_MEMORY_ARENA', 'ONNX_MEMORY_PATTERN')
+    saved = {name: os.environ.pop(name, None) for name in names}
+    try:
+        assert onnx_options_from_env() == {'enable_cpu_mem_arena': True, 'enable_mem_pattern': True}
+        os.environ.update({'ONNX_INTRA_OP_THREADS': '2', 'ONNX_INTER_OP_THREADS': '1', 'ONNX_MEMORY_ARENA': '0'})
+        assert onnx_options_from_env() == {'enable_cpu_mem_arena': False, 'enable_mem_pattern': True,
+                                           'intra_op_threads': 2, 'inter_op_threads': 1}
+    finally:
+        for name, value in saved.items():
+            os.environ.pop(name, None)
+            if value is not None:
+                os.environ[name] = value
+    print("ONNX options parsed")
+
+
+def test_backend_runs_an_onnx_graph():
+    """OnnxBackend serves any (N, 256, 256, 1) -> (N, 1) graph; here the mean pixel value"""
+    try:
+        import onnxruntime  # noqa: F401
+        from onnx import TensorProto, helper, save
+    except ImportError:
+        print("onnx/onnxruntime not installed - skipping")
+        return
+    from backends import OnnxBackend, load_backend
+
+    graph = helper.make_graph(
+        [helper.make_node('ReduceMean', ['image'], ['mean'], axes=[1, 2, 3], keepdims=0),
+         helper.make_node('Unsqueeze', ['mean', 'axis'], ['probability'])],
+        'mean_pixel',
+        [helper.make_tensor_value_info('image', TensorProto.FLOAT, [None, 256, 256, 1])],
+        [helper.make_tensor_value_info('probability', TensorProto.FLOAT, [None, 1])],
+        initializer=[helper.make_tensor('axis', TensorProto.INT64, [1], [1])],
+    )
+    # IR version 8 loads on any recent ONNX Runtime, whatever onnx version wrote it
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)], ir_version=8)
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'mean.onnx')
+        save(model, path)
+        backend = load_backend(path)
+        assert isinstance(backend, OnnxBackend)
+
+        batch = sample_batch(5)
+        output = backend.predict(batch)
+        assert output.shape == (5, 1)
+        assert np.allclose(output[:, 0], batch.reshape(5, -1).mean(axis=1), atol=1e-5)
+
+        limited = OnnxBackend(path, intra_op_threads=1, enable_cpu_mem_arena=False)
+        assert limited.session.get_session_options().intra_op_num_threads == 1
+        assert not limited.session.get_session_options().enable_cpu_mem_arena
+        print(f"ONNX graph output: {np.round(output[:, 0], 4)}")
+
+
+def test_parity_with_keras():
+    """The exported ONNX model matches Keras on the sample images (needs TF, tf2onnx, onnxruntime and model.keras)"""
+    try:
+        import onnxruntime  # noqa: F401
+        import tensorflow  # noqa: F401
+        import tf2onnx  # noqa: F401
+    except ImportError:
+        print("tensorflow/tf2onnx/onnxruntime not installed - skipping")
+        return
+    if not os.path.exists(MODEL_PATH):
+        print("model.keras not found - skipping")
+        return
+    from tensorflow.keras.models import load_model
+
+    from backends import KerasBackend, load_backend
+    from optimize_model import export_onnx
+
+    images = sample_batch()
+    model = load_model(MODEL_PATH)
+    expected = KerasBackend(model).predict(images)[:, 0]
+    with tempfile.TemporaryDirectory() as root:
+        for mode, tolerance in (('float32', 1e-4), ('dynamic', 0.05)):
+            path = export_onnx(model, os.path.join(root, f'model_{mode}.onnx'), mode, calibration_images=images)
+            probs = load_backend(path).predict(images)[:, 0]
+            diff = float(np.abs(probs - expected).max())
+            assert diff <= tolerance, f"{mode}: max difference {diff}"
+            if mode == 'float32':
+                assert np.array_equal(probs > 0.95, expected > 0.95)
+            print(f"{mode}: max |ONNX - Keras| = {diff:.6f}")
+
+
+if __name__ == "__main__":
+    print("Testing ONNX backend...\n")
+    test_options_from_env()
+    test_backend_runs_an_onnx_graph()
+    test_parity_with_keras()
+    print("\nAll tests completed!")
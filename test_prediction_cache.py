@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Test script for the content-addressed prediction cache
+"""
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+
+from prediction_cache import PredictionCache
+
+
+def write_model(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def test_lru_hits_and_evictions():
+    """Bounded memory tier evicts least recently used entries"""
+    cache = PredictionCache(max_entries=2)
+    cache.set_fingerprint('model-a')
+
+    cache.put(b'image-1', ['Normal', 12.5])
+    cache.put(b'image-2', ['Pneumonia', 97.1])
+    assert cache.get(b'image-1') == ['Normal', 12.5]  # image-1 is now most recent
+    cache.put(b'image-3', ['Normal', 3.0])             # evicts image-2
+
+    assert cache.get(b'image-2') is None
+    assert cache.get(b'image-3') == ['Normal', 3.0]
+    stats = cache.stats()
+    assert stats['hits'] == 2 and stats['misses'] == 1 and stats['evictions'] == 1
+    print(f"LRU stats: {stats}")
+
+
+def test_disk_tier_survives_restart():
+    """SQLite entries are served by a fresh cache instance for the same model"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, 'cache.db')
+        first = PredictionCache(max_entries=4, disk_path=db)
+        first.set_fingerprint('model-a')
+        first.put(b'image-1', ['Pneumonia', 99.0])
+
+        second = PredictionCache(max_entries=4, disk_path=db)
+        second.set_fingerprint('model-a')
+        assert second.get(b'image-1') == ['Pneumonia', 99.0]
+        assert second.stats()['disk_hits'] == 1
+
+        third = PredictionCache(max_entries=4, disk_path=db)
+        third.set_fingerprint('model-b')
+        assert third.get(b'image-1') is None
+    print("Disk tier persists per model fingerprint")
+
+
+def _forked_worker(cache, results):
+    inherited = cache._db is not None
+    value = cache.get(b'image-1')
+    cache.put(b'image-2', ['Normal', 4.0])
+    results.put((inherited, value))
+
+
+def test_forked_workers_open_their_own_connection():
+    """No SQLite connection crosses a fork (gunicorn --preload); both sides reopen on first use"""
+    context = multiprocessing.get_context('fork')
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = PredictionCache(max_entries=0, disk_path=os.path.join(tmp, 'cache.db'))
+        cache.set_fingerprint('model-a')
+        cache.put(b'image-1', ['Pneumonia', 99.0])
+        before = cache._db
+
+        results = context.Queue()
+        worker = context.Process(target=_forked_worker, args=(cache, results))
+        worker.start()
+        inherited, value = results.get(timeout=30)
+        worker.join(10)
+        assert worker.exitcode == 0
+        assert not inherited and value == ['Pneumonia', 99.0]
+
+        try:
+            before.execute('SELECT 1')
+            raise AssertionError("Expected the pre-fork connection to be closed")
+        except sqlite3.ProgrammingError:
+            pass
+        assert cache.get(b'image-2') == ['Normal', 4.0]  # reopened, and sees the worker's write
+    print("Forked worker used its own SQLite connection")
+
+
+def test_invalidates_when_model_file_changes():
+    """Replacing the model file drops previously cached predictions"""
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = os.path.join(tmp, 'model.keras')
+        write_model(model_path, b'weights v1')
+
+        cache = PredictionCache(max_entries=8, check_interval=0.0)
+        cache.watch_model(model_path)
+        cache.put(b'image-1', ['Normal', 10.0])
+        assert cache.get(b'image-1') == ['Normal', 10.0]
+
+        write_model(model_path, b'weights v2, retrained')
+        os.utime(model_path, ns=(time.time_ns(), time.time_ns() + 1000))
+        assert cache.get(b'image-1') is None
+        assert cache.stats()['invalidations'] == 1
+    print("Model change invalidates cache")
+
+
+def test_disabled_cache():
+    """PREDICTION_CACHE_SIZE=0 without a database turns the cache off"""
+    cache = PredictionCache(max_entries=0)
+    cache.put(b'image-1', ['Normal', 1.0])
+    assert cache.get(b'image-1') is None
+    assert cache.stats()['misses'] == 0
+    print("Disabled cache is a no-op")
+
+
+if __name__ == "__main__":
+    print("Testing prediction cache...\n")
+    test_lru_hits_and_evictions()
+    test_disk_tier_survives_restart()
+    test_forked_workers_open_their_own_connection()
+    test_invalidates_when_model_file_changes()
+    test_disabled_cache()
+    print("\nAll tests completed!")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Tolerance tests: shared preprocessing vs the original cv2 -> PIL -> NumPy path
+"""
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from image_validation import sniff
+from preprocessing import (allocate_batch, decode_grayscale, jpeg_size, preprocess,
+                           preprocess_batch, reduction_factor)
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'uploads')
+
+# Absolute difference allowed against the PIL path (inputs are in [0, 1]). The mean error is
+# the real bound; a few pixels on sharp edges (the markers burnt into the X-rays) are resampled
+# differently, so the worst pixel only gets a looser bound and 99.9% of pixels a tighter one.
+MEAN_TOLERANCE = 0.005
+PERCENTILE_TOLERANCE = 0.125  # 99.9th percentile, ~32 grey levels
+MAX_TOLERANCE = 0.25
+
+
+def sample_paths():
+    return sorted(os.path.join(SAMPLE_DIR, n) for n in os.listdir(SAMPLE_DIR) if n.endswith('.jpeg'))
+
+
+def pil_reference(path):
+    """The preprocessing getResult() used before the shared module"""
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    image = Image.fromarray(image)
+    image = image.resize((256, 256))
+    image = np.array(image).astype('float32') / 255.0
+    return np.expand_dims(image, axis=(0, -1))
+
+
+def test_matches_pil_path_on_samples():
+    """Full-resolution and reduced decodes stay within tolerance of the PIL path"""
+    for reduced in (False, True):
+        worst_mean = 0.0
+        for path in sample_paths():
+            expected = pil_reference(path)
+            actual = preprocess(path, reduced=reduced)
+            assert actual.shape == (1, 256, 256, 1)
+            assert actual.dtype == np.float32
+            diff = np.abs(actual - expected)
+            assert diff.mean() < MEAN_TOLERANCE, (path, reduced, diff.mean())
+            assert np.percentile(diff, 99.9) < PERCENTILE_TOLERANCE, (path, reduced, np.percentile(diff, 99.9))
+            assert diff.max() < MAX_TOLERANCE, (path, reduced, diff.max())
+            worst_mean = max(worst_mean, float(diff.mean()))
+        print(f"reduced={reduced}: worst mean abs diff {worst_mean:.5f}")
+
+
+def test_small_images_are_upscaled():
+    """Images smaller than the model input are enlarged like PIL does"""
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 256, (120, 90), dtype=np.uint8), (5, 5), 0)
+    ok, encoded = cv2.imencode('.png', image)
+    assert ok
+
+    expected = np.array(Image.fromarray(image).resize((256, 256))).astype('float32') / 255.0
+    actual = preprocess(encoded.tobytes())[0, :, :, 0]
+    diff = np.abs(actual - expected)
+    assert diff.mean() < MEAN_TOLERANCE
+    assert diff.max() < 0.02  # no hard edges here, so every pixel stays within ~5 grey levels
+    print("Upscaling within tolerance")
+
+
+def test_batch_fills_preallocated_buffer():
+    """A list of images fills one (N, 256, 256, 1) tensor in place"""
+    paths = sample_paths()[:5]
+    sources = [paths[0], open(paths[1], 'rb').read(), decode_grayscale(paths[2])] + paths[3:]
+    buffer = allocate_batch(8)
+
+    batch = preprocess_batch(sources, out=buffer)
+    assert batch.shape == (5, 256, 256, 1)
+    assert np.shares_memory(batch, buffer)
+    for i, path in enumerate(paths):
+        assert np.allclose(batch[i], preprocess(path)[0])
+    print("Batch buffer filled in place")
+
+
+def test_unreadable_input_rejected():
+    """Garbage bytes and missing files are reported, not silently zero-filled"""
+    assert decode_grayscale(b'not an image') is None
+    assert decode_grayscale(b'') is None
+    assert decode_grayscale('/no/such/file.jpeg') is None
+    try:
+        preprocess_batch([sample_paths()[0], b'not an image'])
+        raise AssertionError("Expected ValueError")
+    except ValueError as e:
+        assert 'Image 1' in str(e)
+    print("Unreadable input rejected")
+
+
+def test_jpeg_header_size():
+    """Dimensions are read from the JPEG header without decoding"""
+    for path in sample_paths()[:5]:
+        with open(path, 'rb') as f:
+            data = f.read()
+        assert jpeg_size(data) == cv2.imread(path, cv2.IMREAD_GRAYSCALE).shape
+        info = sniff(data)
+        assert jpeg_size(data) == (info.height, info.width)
+    assert jpeg_size(b'\x89PNG\r\n\x1a\n') is None
+    # Headers the validator rejects never pick a reduced decode
+    lossless = b'\xff\xd8\xff\xc3\x00\x0b\x08\x10\x00\x10\x00\x01\x01\x11\x00'
+    assert jpeg_size(lossless) is None
+    assert jpeg_size(b'\xff\xd8\xff\xda\x00\x08') is None
+    assert reduction_factor(2048, 2048) == 4
+    assert reduction_factor(600, 800) == 1
+    print("JPEG header parsing OK")
+
+
+if __name__ == "__main__":
+    print("Testing preprocessing...\n")
+    test_matches_pil_path_on_samples()
+    test_small_images_are_upscaled()
+    test_batch_fills_preallocated_buffer()
+    test_unreadable_input_rejected()
+    test_jpeg_header_size()
+    print("\nAll tests completed!")
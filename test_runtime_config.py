@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Test script for the runtime thread configuration and autotuning
+"""
+import json
+import os
+import tempfile
+
+import runtime_config
+from runtime_config import (CpuSlots, autotune, candidate_configs, cpu_set_for_worker, default_config,
+                            resolve_config)
+
+CONFIG_VARS = list(runtime_config.ENV_VARS.values()) + ['RUNTIME_CONFIG', 'RUNTIME_AUTOTUNE', 'WEB_CONCURRENCY']
+
+
+class cleared_env:
+    """Run with the runtime config variables unset, restoring them afterwards"""
+
+    def __enter__(self):
+        self.saved = {var: os.environ.pop(var) for var in CONFIG_VARS if var in os.environ}
+        return self
+
+    def __exit__(self, *exc):
+        for var in CONFIG_VARS:
+            os.environ.pop(var, None)
+        os.environ.update(self.saved)
+        return False
+
+
+def test_default_split():
+    """Cores are divided across workers, never below one thread"""
+    config = default_config(workers=4, cpus=list(range(16)))
+    assert config['intra_op_threads'] == 4 and config['inter_op_threads'] == 2
+    assert default_config(workers=8, cpus=[0, 1])['intra_op_threads'] == 1
+    print(f"16 cores / 4 workers: {config}")
+
+
+def test_file_and_env_precedence():
+    """JSON file overrides defaults, environment variables override the file"""
+    with cleared_env(), tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'runtime.json')
+        with open(path, 'w') as f:
+            json.dump({'intra_op_threads': 3, 'inter_op_threads': 1, 'pin_cpus': True}, f)
+        os.environ['TF_INTER_OP_THREADS'] = '2'
+
+        config = resolve_config(workers=1, config_path=path)
+        assert config['intra_op_threads'] == 3
+        assert config['inter_op_threads'] == 2
+        assert config['pin_cpus'] is True
+
+        with open(path, 'w') as f:
+            json.dump({'intra_threads': 3}, f)
+        try:
+            resolve_config(workers=1, config_path=path)
+            assert False, "unknown keys should be rejected"
+        except ValueError as e:
+            print(f"Rejected config: {e}")
+
+
+def test_apply_environment():
+    """Thread counts are exported for TensorFlow, OpenMP, TFLite and ONNX Runtime"""
+    with cleared_env():
+        saved = {var: os.environ.get(var) for var in
+                 ('TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS', 'TFLITE_NUM_THREADS', 'ONNX_INTRA_OP_THREADS',
+                  'ONNX_INTER_OP_THREADS', 'RUNTIME_CONFIG_RESOLVED')}
+        try:
+            for var in saved:
+                os.environ.pop(var, None)
+            runtime_config.apply_environment({'intra_op_threads': 2, 'inter_op_threads': 1, 'omp_threads': 2,
+                                              'onednn': False})
+            assert os.environ['OMP_NUM_THREADS'] == '2'
+            assert os.environ['TF_NUM_INTRAOP_THREADS'] == '2'
+            assert os.environ['TFLITE_NUM_THREADS'] == '2'
+            assert os.environ['ONNX_INTRA_OP_THREADS'] == '2' and os.environ['ONNX_INTER_OP_THREADS'] == '1'
+            assert os.environ['TF_ENABLE_ONEDNN_OPTS'] == '0'
+            assert json.loads(os.environ['RUNTIME_CONFIG_RESOLVED'])['inter_op_threads'] == 1
+        finally:
+            for var, value in saved.items():
+                os.environ.pop(var, None)
+                if value is not None:
+                    os.environ[var] = value
+
+
+def test_cpu_sets():
+    """Worker CPU slices are disjoint and cover every core"""
+    cpus = list(range(10))
+    slices = [cpu_set_for_worker(i, 3, cpus) for i in range(3)]
+    assert slices == [[0, 1, 2], [3, 4, 5], [6, 7, 8, 9]]
+    assert cpu_set_for_worker(4, 3, cpus) == [3, 4, 5]
+    assert cpu_set_for_worker(5, 8, [0, 1]) == [1]
+    print(f"CPU slices: {slices}")
+
+
+def test_cpu_slots_reused_across_restarts():
+    """A replacement worker takes the slot its predecessor freed, not one shared with a live worker"""
+    slots = CpuSlots()
+    workers = [object() for _ in range(4)]
+    assert [slots.acquire(w) for w in workers] == [0, 1, 2, 3]
+    for _ in range(3):  # worker 2 keeps hitting max_requests
+        assert slots.release(workers[1]) == 1
+        workers[1] = object()
+        assert slots.acquire(workers[1]) == 1
+    slots.release(workers[0])
+    slots.release(workers[3])
+    assert slots.acquire(object()) == 0 and slots.acquire(object()) == 3
+    assert sorted(slots.held.values()) == [0, 1, 2, 3]
+
+
+def test_autotune_picks_fastest_and_caches():
+    """The best measured candidate is chosen and reused without re-measuring"""
+    calls = []
+
+    def fake_measure(config, model_path, cpus):
+        calls.append(config)
+        # Pretend two intra-op threads with one inter-op thread is fastest
+        return 100.0 - abs(config['intra_op_threads'] - 2) * 10 - config['inter_op_threads']
+
+    with tempfile.TemporaryDirectory() as root:
+        model_path = os.path.join(root, 'model.keras')
+        with open(model_path, 'wb') as f:
+            f.write(b'weights')
+        cache_path = os.path.join(root, 'tune.json')
+
+        best = autotune(model_path, workers=1, cache_path=cache_path, measure_fn=fake_measure)
+        measured = len(calls)
+        assert measured == len(candidate_configs(len(runtime_config.available_cpus())))
+        if len(runtime_config.available_cpus()) >= 2:
+            assert best['intra_op_threads'] == 2 and best['inter_op_threads'] == 1
+
+        assert autotune(model_path, workers=1, cache_path=cache_path, measure_fn=fake_measure) == best
+        assert len(calls) == measured
+        print(f"Autotuned: {best}")
+
+
+if __name__ == "__main__":
+    print("Testing runtime configuration...\n")
+    test_default_split()
+    test_file_and_env_precedence()
+    test_apply_environment()
+    test_cpu_sets()
+    test_cpu_slots_reused_across_restarts()
+    test_autotune_picks_fastest_and_caches()
+    print("\nAll tests completed!")
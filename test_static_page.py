@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Test script for the precompressed, cacheable index page
+"""
+import base64
+import gzip
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+
+import index
+from static_page import ASSET_CACHE_CONTROL, Page, Resource, brotli, choose_encoding
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'index.html')
+
+
+def get(path='/', **headers):
+    return index.handler({'method': 'GET', 'path': path, 'headers': headers})
+
+
+def test_inline_assets_fingerprinted():
+    """Inline <style>/<script> become hashed asset links; external scripts stay as they are"""
+    page = Page(TEMPLATE_PATH)
+    html = page.html.variants['identity'].decode()
+    assert '<style>' not in html and '<script>' not in html
+    assert 'cdn.jsdelivr.net/npm/toastify-js' in html
+    assert len(page.assets) == 2
+    for name, resource in page.assets.items():
+        assert f'/assets/{name}' in html
+        assert resource.digest[:12] in name
+        assert resource.cache_control == ASSET_CACHE_CONTROL
+    js = next(resource for name, resource in page.assets.items() if name.endswith('.js'))
+    assert b"getElementById('predictionForm')" in js.variants['identity']
+    print(f"Assets: {sorted(page.assets)}")
+
+
+def test_choose_encoding():
+    available = {'identity': b'', 'gzip': b'', 'br': b''}
+    assert choose_encoding('gzip, deflate, br', available) == 'br'
+    assert choose_encoding('gzip, br;q=0', available) == 'gzip'
+    assert choose_encoding('*', {'identity': b'', 'gzip': b''}) == 'gzip'
+    assert choose_encoding('', available) == 'identity'
+    assert choose_encoding('gzip;q=0', available) == 'identity'
+
+
+def test_compressed_variants_and_etags():
+    """gzip (and br when available) bodies decompress to the page; each has its own strong ETag"""
+    resource = Resource('<p>hello</p>' * 200, 'text/html; charset=utf-8', 'no-cache')
+    status, headers, body = resource.respond('gzip')
+    assert status == 200 and headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(body) == resource.variants['identity']
+    assert headers['ETag'] != resource.etag() and not headers['ETag'].startswith('W/')
+    if brotli is not None:
+        status, headers, body = resource.respond('br, gzip')
+        assert brotli.decompress(body) == resource.variants['identity']
+    print(f"identity {len(resource.variants['identity'])} bytes, gzip {len(resource.variants['gzip'])} bytes")
+
+
+def test_handler_conditional_requests():
+    """The serverless handler serves base64-wrapped gzip and answers a matching ETag with 304"""
+    result = get(**{'Accept-Encoding': 'gzip'})
+    assert result['statusCode'] == 200 and result['isBase64Encoded']
+    html = gzip.decompress(base64.b64decode(result['body'])).decode()
+    assert '<form id="predictionForm">' in html
+    assert result['headers']['Cache-Control'] == 'no-cache'
+
+    repeat = get(**{'Accept-Encoding': 'gzip', 'If-None-Match': result['headers']['ETag']})
+    assert repeat['statusCode'] == 304 and repeat['body'] == ''
+
+    plain = get()
+    assert plain['statusCode'] == 200 and '<form id="predictionForm">' in plain['body']
+    assert 'Content-Encoding' not in plain['headers']
+    print(f"Page: {len(plain['body'])} bytes plain, {result['headers']['Content-Length']} gzip")
+
+
+def test_handler_assets():
+    name = next(iter(index.page.assets))
+    result = get(f'/assets/{name}')
+    assert result['statusCode'] == 200
+    assert result['headers']['Cache-Control'] == ASSET_CACHE_CONTROL
+    assert get('/assets/index.0000.js')['statusCode'] == 404
+    # Any other path is the page itself, as the catch-all route expects
+    assert '<form id="predictionForm">' in get('/some/other/path')['body']
+
+
+if __name__ == "__main__":
+    print("Testing static index page...\n")
+    test_inline_assets_fingerprinted()
+    test_choose_encoding()
+    test_compressed_variants_and_etags()
+    test_handler_conditional_requests()
+    test_handler_assets()
+    print("\nAll tests completed!")
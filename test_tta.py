@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Test script for test-time augmentation
+"""
+import base64
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+
+import predict
+from tta import SHIFT, VARIANTS, make_variants, max_variants, parse_variants, predict_tta
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'uploads', 'NORMAL2-IM-0229-0001.jpeg')
+
+
+class FakeBackend:
+    name = 'fake'
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def predict(self, batch):
+        self.batch_sizes.append(batch.shape[0])
+        return batch.reshape(batch.shape[0], -1).mean(axis=1, keepdims=True)
+
+
+class MockRequest:
+    def __init__(self, method, body=None, headers=None):
+        self.data = {'method': method, 'body': body, 'headers': headers or {}}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+
+def test_variants_match_their_definition():
+    """Identity, shift and contrast variants built by the single gather are what they claim to be"""
+    images = np.random.default_rng(0).random((2, 64, 64, 1), dtype=np.float32)
+    variants = make_variants(images, 7).reshape(2, 7, 64, 64, 1)
+
+    assert np.array_equal(variants[:, 0], images)
+    assert VARIANTS[1][:2] == (SHIFT, 0)
+    assert np.array_equal(variants[:, 1, SHIFT:], images[:, :-SHIFT])
+    assert np.array_equal(variants[:, 1, :SHIFT], np.repeat(images[:, :1], SHIFT, axis=1))
+    assert VARIANTS[5][3] == 0.8
+    assert np.allclose(variants[:, 5], images ** 0.8, atol=1e-6)
+    print(f"Variants OK: {variants.shape}")
+
+
+def test_flip_is_opt_in():
+    """Horizontal flips only appear when allowed"""
+    images = np.random.default_rng(1).random((1, 16, 16, 1), dtype=np.float32)
+    count = max_variants(allow_flip=False)
+    assert all(not flip for _, _, flip, _ in VARIANTS[:count])
+    flipped = make_variants(images, count + 1, allow_flip=True)[count]
+    assert np.array_equal(flipped, images[0, :, ::-1])
+    try:
+        make_variants(images, count + 1, allow_flip=False)
+        raise AssertionError("Expected ValueError")
+    except ValueError:
+        pass
+    print(f"{count} variants without flips")
+
+
+def test_single_batched_forward_pass():
+    """K variants of N images are scored in one call and reduced to mean and spread"""
+    backend = FakeBackend()
+    images = np.random.default_rng(2).random((3, 32, 32, 1), dtype=np.float32)
+    mean, spread, per_variant = predict_tta(backend.predict, images, k=8)
+    assert backend.batch_sizes == [24]
+    assert mean.shape == spread.shape == (3,) and per_variant.shape == (3, 8)
+    assert np.allclose(per_variant[:, 0], images.reshape(3, -1).mean(axis=1), atol=1e-6)
+    assert np.all(spread > 0)
+    print(f"Mean {np.round(mean, 4)}, spread {np.round(spread, 4)}")
+
+
+def test_parse_variants():
+    assert parse_variants('4') == 4
+    for bad in ('0', 'many', str(len(VARIANTS) + 1)):
+        try:
+            parse_variants(bad)
+            raise AssertionError(f"Expected ValueError for {bad}")
+        except ValueError as e:
+            print(f"Rejected: {e}")
+
+
+def test_handler_reports_uncertainty():
+    """"tta" in the JSON body adds the spread and variant count to the response"""
+    predict.model = FakeBackend()
+    predict.prediction_cache.clear()
+    with open(SAMPLE_IMAGE, 'rb') as f:
+        encoded = base64.b64encode(f.read()).decode()
+
+    result = predict.handler(MockRequest('POST', json.dumps({'image': encoded, 'tta': 6})))
+    assert result['statusCode'] == 200, result
+    body = json.loads(result['body'])
+    assert body['tta_variants'] == 6 and body['uncertainty'] >= 0
+    assert predict.model.batch_sizes == [6]
+
+    plain = json.loads(predict.handler(MockRequest('POST', json.dumps({'image': encoded})))['body'])
+    assert 'uncertainty' not in plain
+
+    result = predict.handler(MockRequest('POST', json.dumps({'image': encoded, 'tta': 99})))
+    assert result['statusCode'] == 400
+    print(f"TTA response: {body}")
+
+
+if __name__ == "__main__":
+    print("Testing test-time augmentation...\n")
+    test_variants_match_their_definition()
+    test_flip_is_opt_in()
+    test_single_batched_forward_pass()
+    test_parse_variants()
+    test_handler_reports_uncertainty()
+    print("\nAll tests completed!")
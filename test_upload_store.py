@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Test script for the bounded upload store
+"""
+import os
+import struct
+import tempfile
+import time
+import zlib
+
+import cv2
+import numpy as np
+
+from upload_store import UploadStore, make_thumbnail
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'public', 'uploads')
+
+
+def load_samples(count):
+    samples = []
+    for name in sorted(os.listdir(SAMPLE_DIR))[:count]:
+        with open(os.path.join(SAMPLE_DIR, name), 'rb') as f:
+            samples.append((name, f.read()))
+    return samples
+
+
+def test_content_addressed_names():
+    """Same name with different content gives two files; the same content is stored once"""
+    (_, first), (_, second) = load_samples(2)
+    with tempfile.TemporaryDirectory() as root:
+        store = UploadStore(root, fmt='original')
+        a = store.submit('xray.jpeg', first)
+        b = store.submit('xray.jpeg', second)
+        c = store.submit('copy.jpeg', first)
+        assert store.flush(5)
+        assert a != b and a == c and a.endswith('.jpeg')
+        with open(store.path(a), 'rb') as f:
+            assert f.read() == first
+        stats = store.stats()
+        assert stats['files'] == 2 and stats['written'] == 2 and stats['deduplicated'] == 1
+        store.close()
+        print(f"Stored as {a}, {b}")
+
+
+def test_thumbnails():
+    """Thumbnail mode keeps only a small WebP whose longer side is the thumbnail size"""
+    (_, image_bytes), = load_samples(1)
+    with tempfile.TemporaryDirectory() as root:
+        store = UploadStore(root, fmt='thumbnail', thumbnail_size=128)
+        name = store.submit('xray.jpeg', image_bytes)
+        store.flush(5)
+        assert not os.path.exists(store.path(name))
+        with open(store.thumbnail_path(name), 'rb') as f:
+            thumbnail = f.read()
+        decoded = cv2.imdecode(np.frombuffer(thumbnail, np.uint8), cv2.IMREAD_UNCHANGED)
+        assert max(decoded.shape[:2]) == 128
+        assert len(thumbnail) < len(image_bytes)
+        store.close()
+        print(f"Thumbnail {decoded.shape}: {len(thumbnail)} bytes (original {len(image_bytes)})")
+
+
+def test_size_and_age_eviction():
+    """The oldest files go first once over budget, and anything past max_age goes too"""
+    samples = load_samples(6)
+    budget = sum(len(data) for _, data in samples[-3:])
+    with tempfile.TemporaryDirectory() as root:
+        store = UploadStore(root, max_bytes=budget, fmt='original')
+        names = [store.submit(name, data) for name, data in samples]
+        store.flush(5)
+        stats = store.stats()
+        assert stats['bytes'] <= budget
+        assert stats['evicted'] == 3
+        assert [os.path.exists(store.path(name)) for name in names] == [False] * 3 + [True] * 3
+
+        store.max_age = 60
+        assert store.evict(now=time.time() + 120) == 3
+        assert store.stats()['files'] == 0
+        store.close()
+        print(f"Evicted {store.evicted} files")
+
+
+def test_full_queue_drops_instead_of_blocking():
+    """With the writer stalled, submit() returns at once and counts the dropped upload"""
+    (_, image_bytes), = load_samples(1)
+    with tempfile.TemporaryDirectory() as root:
+        store = UploadStore(root, queue_size=1, fmt='original')
+        store._ensure_thread = lambda: None  # no writer: the queue never drains
+        assert store.submit('a.jpeg', image_bytes) is not None
+        start = time.perf_counter()
+        assert store.submit('b.jpeg', image_bytes + b'x') is None
+        assert time.perf_counter() - start < 0.05
+        assert store.stats()['dropped'] == 1
+        print("Full queue drops uploads")
+
+
+def test_scan_picks_up_existing_files():
+    """A new store (e.g. after a restart) accounts for files already on disk"""
+    (_, image_bytes), = load_samples(1)
+    with tempfile.TemporaryDirectory() as root:
+        store = UploadStore(root, fmt='both')
+        store.submit('xray.jpeg', image_bytes)
+        store.flush(5)
+        store.close()
+
+        reopened = UploadStore(root)
+        stats = reopened.stats()
+        assert stats['files'] == 2 and stats['bytes'] == store.stats()['bytes']
+        print(f"Rescanned: {stats}")
+
+
+def test_rejected_uploads_are_not_decoded():
+    """Thumbnails go through the same validation as predictions: bombs and junk are never decoded"""
+    ihdr = struct.pack('>IIBBBBB', 40000, 40000, 8, 0, 0, 0, 0)
+    bomb = b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + ihdr + struct.pack('>I', zlib.crc32(b'IHDR' + ihdr))
+    assert make_thumbnail(bomb) is None
+    assert make_thumbnail(b'not an image at all') is None
+
+    big = np.random.default_rng(0).integers(0, 256, (4000, 3000), dtype=np.uint8)
+    ok, buffer = cv2.imencode('.jpg', big)
+    start = time.perf_counter()
+    thumbnail = make_thumbnail(buffer.tobytes())
+    elapsed = time.perf_counter() - start
+    decoded = cv2.imdecode(np.frombuffer(thumbnail, np.uint8), cv2.IMREAD_UNCHANGED)
+    assert decoded.shape[:2] == (256, 192)
+    print(f"4000x3000 JPEG thumbnail in {elapsed * 1000:.1f} ms (reduced decode)")
+
+
+if __name__ == "__main__":
+    print("Testing upload store...\n")
+    test_content_addressed_names()
+    test_thumbnails()
+    test_size_and_age_eviction()
+    test_full_queue_drops_instead_of_blocking()
+    test_scan_picks_up_existing_files()
+    test_rejected_uploads_are_not_decoded()
+    print("\nAll tests completed!")
@@ -0,0 +1,98 @@
+"""
+Test-time augmentation (TTA)
+Builds K variants of each preprocessed image (small shifts, contrast changes and, if allowed,
+a horizontal flip) with one gather over precomputed pixel index maps, scores all of them as
+a single batch and reports the mean probability with its spread across variants.
+"""
+import os
+from functools import lru_cache
+
+import numpy as np
+
+SHIFT = 8  # pixels at 256x256, about 3% of the field of view
+
+# (dy, dx, horizontal flip, gamma) in the order variants are taken; the original always comes first.
+# A flip mirrors the heart to the right side of the chest, so it is opt-in (TTA_ALLOW_FLIP=1)
+VARIANTS = (
+    (0, 0, False, 1.0),
+    (SHIFT, 0, False, 1.0),
+    (-SHIFT, 0, False, 1.0),
+    (0, SHIFT, False, 1.0),
+    (0, -SHIFT, False, 1.0),
+    (0, 0, False, 0.8),
+    (0, 0, False, 1.25),
+    (SHIFT, SHIFT, False, 1.0),
+    (-SHIFT, -SHIFT, False, 1.0),
+    (SHIFT, -SHIFT, False, 0.9),
+    (-SHIFT, SHIFT, False, 1.1),
+    (0, 0, True, 1.0),
+    (SHIFT, 0, True, 1.0),
+    (-SHIFT, 0, True, 1.0),
+    (0, 0, True, 0.8),
+    (0, 0, True, 1.25),
+)
+
+TTA_VARIANTS = int(os.environ.get('TTA_VARIANTS', 1))
+TTA_ALLOW_FLIP = os.environ.get('TTA_ALLOW_FLIP', '0') == '1'
+
+
+def max_variants(allow_flip=TTA_ALLOW_FLIP):
+    return sum(1 for v in VARIANTS if allow_flip or not v[2])
+
+
+def parse_variants(value, allow_flip=TTA_ALLOW_FLIP):
+    """Validate a requested variant count (from a query string, header or JSON field)"""
+    try:
+        k = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"tta must be an integer, got {value!r}") from None
+    limit = max_variants(allow_flip)
+    if not 1 <= k <= limit:
+        raise ValueError(f"tta must be between 1 and {limit}, got {k}")
+    return k
+
+
+@lru_cache(maxsize=32)
+def _index_maps(k, allow_flip, height, width):
+    """Flat source pixel index of every output pixel for each variant (K, H * W), plus the per-variant gamma"""
+    specs = [v for v in VARIANTS if allow_flip or not v[2]][:k]
+    if len(specs) < k:
+        raise ValueError(f"Only {len(specs)} TTA variants available, asked for {k}")
+
+    base_rows = np.arange(height)[:, None]
+    base_cols = np.arange(width)[None, :]
+    index = np.empty((k, height, width), dtype=np.intp)
+    for i, (dy, dx, flip, _) in enumerate(specs):
+        source_cols = width - 1 - base_cols if flip else base_cols
+        # Shifted-in borders repeat the edge pixels, like the dark margin of a radiograph
+        rows = np.clip(base_rows - dy, 0, height - 1)
+        cols = np.clip(source_cols - dx, 0, width - 1)
+        index[i] = rows * width + cols
+    gammas = np.array([v[3] for v in specs], dtype=np.float32)
+    return index.reshape(k, height * width), gammas
+
+
+def make_variants(images, k, allow_flip=TTA_ALLOW_FLIP):
+    """(N, H, W, C) images in [0, 1] -> (N * K, H, W, C); each image's K variants are contiguous"""
+    images = np.asarray(images, dtype=np.float32)
+    n, height, width = images.shape[:3]
+    index, gammas = _index_maps(k, allow_flip, height, width)
+
+    # One gather over the flattened pixels builds every shifted/flipped copy: (N, K, H * W, C)
+    variants = np.take(images.reshape(n, height * width, -1), index, axis=1)
+    contrast = np.flatnonzero(gammas != 1.0)
+    if contrast.size:
+        variants[:, contrast] = np.power(variants[:, contrast], gammas[contrast].reshape(1, -1, 1, 1))
+    return variants.reshape((n * k,) + images.shape[1:])
+
+
+def summarize(probabilities, n, k):
+    """Model outputs for N * K variants -> (mean, std, per-variant) probabilities per image"""
+    probabilities = np.asarray(probabilities, dtype=np.float64).reshape(n, k, -1)[..., 0]
+    return probabilities.mean(axis=1), probabilities.std(axis=1), probabilities
+
+
+def predict_tta(predict_fn, images, k=8, allow_flip=TTA_ALLOW_FLIP):
+    """Score K variants of every image in one predict_fn call; returns (mean, std, per-variant)"""
+    images = np.asarray(images)
+    return summarize(predict_fn(make_variants(images, k, allow_flip)), images.shape[0], k)
@@ -0,0 +1,254 @@
+"""
+Bounded on-disk store for uploaded X-rays
+Uploads are named by a hash of their content (identical files are kept once, different files
+never overwrite each other), written by one background thread off the request path, optionally
+kept only as small WebP thumbnails, and evicted oldest-first once the store exceeds its size
+budget or entries pass their maximum age.
+"""
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+
+from image_validation import InvalidImage
+from prediction_cache import hash_bytes
+from preprocessing import decode_checked
+
+FORMATS = ('original', 'thumbnail', 'both')
+THUMBNAIL_DIR = 'thumbs'
+THUMBNAIL_EXTENSION = '.webp'
+_IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff'}
+
+
+def _extension(filename):
+    ext = os.path.splitext(filename or '')[1].lower()
+    return ext if ext in _IMAGE_EXTENSIONS else '.img'
+
+
+def make_thumbnail(image_bytes, size=256, quality=70):
+    """Grayscale WebP whose longer side is at most size pixels, or None if the bytes aren't a valid image
+
+    Decoded with the same checks and memory limit as predictions (large JPEGs at reduced scale).
+    """
+    try:
+        image = decode_checked(image_bytes, size)
+    except InvalidImage:
+        return None
+    scale = size / max(image.shape)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale))),
+                           interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(THUMBNAIL_EXTENSION, image, [cv2.IMWRITE_WEBP_QUALITY, quality])
+    return buffer.tobytes() if ok else None
+
+
+class UploadStore:
+    """Content-addressed upload directory with a background writer and size/age eviction
+
+    submit() only hashes the bytes and enqueues them; when the queue is full the upload is
+    dropped (and counted) rather than making the request wait for the disk.
+    """
+
+    def __init__(self, root, max_bytes=512 << 20, max_age=7 * 24 * 3600, fmt='both',
+                 thumbnail_size=256, queue_size=256, scan_interval=60.0):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown upload store format '{fmt}'. Expected one of: {', '.join(FORMATS)}")
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.max_age = float(max_age)
+        self.fmt = fmt
+        self.thumbnail_size = int(thumbnail_size)
+        self.scan_interval = scan_interval
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # relative path -> (size, mtime), oldest first
+        self._bytes = 0
+        self._last_scan = 0.0
+        self._thread = None
+
+        self.written = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.evicted = 0
+        self.errors = 0
+        self.write_seconds = 0.0
+
+        os.makedirs(os.path.join(root, THUMBNAIL_DIR), exist_ok=True)
+        self.scan()
+
+    # --- request path ---
+
+    def name_for(self, filename, image_bytes):
+        """Stored name of an upload: content hash plus the original (known) image extension"""
+        return hash_bytes(image_bytes) + _extension(filename)
+
+    def submit(self, filename, image_bytes):
+        """Queue an upload for writing; returns its stored name (None if nothing will be written)"""
+        if not image_bytes:
+            return None
+        name = self.name_for(filename, image_bytes)
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait((name, image_bytes))
+        except queue.Full:
+            self.dropped += 1
+            return None
+        return name
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def thumbnail_path(self, name):
+        return os.path.join(self.root, THUMBNAIL_DIR, os.path.splitext(name)[0] + THUMBNAIL_EXTENSION)
+
+    # --- writer thread ---
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='upload-writer', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.scan_interval)
+            except queue.Empty:
+                self.evict()
+                continue
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+                self.evict()
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ Could not store upload: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, name, image_bytes):
+        start = time.perf_counter()
+        files = []
+        if self.fmt in ('original', 'both'):
+            files.append((name, lambda: image_bytes))
+        if self.fmt in ('thumbnail', 'both'):
+            files.append((os.path.relpath(self.thumbnail_path(name), self.root),
+                          lambda: make_thumbnail(image_bytes, self.thumbnail_size)))
+
+        for relative, produce in files:
+            path = os.path.join(self.root, relative)
+            try:
+                # Same content already stored: refresh its age instead of writing it again
+                os.utime(path)
+                self._track(relative, os.path.getsize(path))
+                self.deduplicated += 1
+                continue
+            except FileNotFoundError:
+                pass
+            data = produce()
+            if data is None:
+                continue
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self._track(relative, len(data))
+            self.written += 1
+        self.write_seconds += time.perf_counter() - start
+
+    def _track(self, relative, size):
+        with self._lock:
+            old = self._entries.pop(relative, None)
+            if old is not None:
+                self._bytes -= old[0]
+            self._entries[relative] = (size, time.time())
+            self._bytes += size
+
+    # --- eviction ---
+
+    def scan(self):
+        """Rebuild the index from disk (other workers may share the directory)"""
+        entries = []
+        for directory in (self.root, os.path.join(self.root, THUMBNAIL_DIR)):
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_file() and not entry.name.endswith('.tmp'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, os.path.relpath(entry.path, self.root), stat.st_size))
+        entries.sort()
+        with self._lock:
+            self._entries = OrderedDict((relative, (size, mtime)) for mtime, relative, size in entries)
+            self._bytes = sum(size for _, _, size in entries)
+            self._last_scan = time.time()
+
+    def evict(self, now=None):
+        """Delete the oldest files until the store fits max_bytes and nothing is older than max_age"""
+        now = time.time() if now is None else now
+        if now - self._last_scan >= self.scan_interval:
+            self.scan()
+        victims = []
+        with self._lock:
+            while self._entries:
+                relative, (size, mtime) = next(iter(self._entries.items()))
+                if self._bytes <= self.max_bytes and now - mtime <= self.max_age:
+                    break
+                del self._entries[relative]
+                self._bytes -= size
+                victims.append(relative)
+        for relative in victims:
+            try:
+                os.remove(os.path.join(self.root, relative))
+                self.evicted += 1
+            except FileNotFoundError:
+                pass
+        return len(victims)
+
+    # --- lifecycle ---
+
+    def flush(self, timeout=None):
+        """Wait until every queued upload has been written"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def close(self, timeout=5.0):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            files, size = len(self._entries), self._bytes
+        return {
+            'files': files,
+            'bytes': size,
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'deduplicated': self.deduplicated,
+            'dropped': self.dropped,
+            'evicted': self.evicted,
+            'errors': self.errors,
+            'write_seconds': round(self.write_seconds, 6),
+        }
+
+
+def store_from_env(root):
+    """UPLOAD_STORE_MAX_MB, UPLOAD_STORE_MAX_AGE_HOURS, UPLOAD_STORE_FORMAT (original/thumbnail/both),
+    UPLOAD_THUMBNAIL_SIZE and UPLOAD_QUEUE_SIZE configure the store"""
+    return UploadStore(
+        root,
+        max_bytes=float(os.environ.get('UPLOAD_STORE_MAX_MB', 512)) * (1 << 20),
+        max_age=float(os.environ.get('UPLOAD_STORE_MAX_AGE_HOURS', 168)) * 3600,
+        fmt=os.environ.get('UPLOAD_STORE_FORMAT', 'both'),
+        thumbnail_size=int(os.environ.get('UPLOAD_THUMBNAIL_SIZE', 256)),
+        queue_size=int(os.environ.get('UPLOAD_QUEUE_SIZE', 256)),
+    )